@@ -0,0 +1,262 @@
+"""
+Cart store: one Redis hash per cart, product id -> quantity.
+
+Logged-in and guest carts both live here, so adding to a cart costs a couple
+of Redis round trips and no database write. ``Cart``/``CartItem`` rows stay
+the durable copy of logged-in carts: CartService schedules ``persist_cart``
+after each change (debounced, see core.tasks), and a cart missing from Redis
+(expired, or never loaded) is rebuilt from its rows on first use.
+
+Guest carts are keyed by a random token kept in the session and are merged
+into the user's cart on login (see core.signals). Hashes expire after
+``GUEST_CART_TTL`` / ``USER_CART_TTL`` without activity, which is what clears
+abandoned carts out of Redis; ``cleanup_carts`` deletes abandoned rows.
+
+Hashes live on ``CART_REDIS_URL``, or on the primary server of the default
+cache when that is Redis. Other cache backends (local memory in development
+and tests) get the same interface over one cached dict per cart.
+"""
+import uuid
+from functools import lru_cache
+
+import redis
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Cart, CartItem, Product
+
+GUEST_CART_TTL = 60 * 60 * 24 * 7
+USER_CART_TTL = 60 * 60 * 24 * 30
+# Rows of carts untouched for longer are deleted by ``cleanup_carts``
+ABANDONED_CART_DAYS = 60
+
+CART_TOKEN_SESSION_KEY = 'cart_token'
+# Where guest carts were kept before the store; imported on first use
+LEGACY_SESSION_KEY = 'cart'
+# Present in every hash, so an empty cart isn't mistaken for one that isn't loaded
+LOADED_FIELD = '_loaded'
+
+
+class RedisCartStore:
+    def __init__(self, client):
+        self.client = client
+
+    def _pipeline(self, cart_id):
+        return f"cart:{cart_id}", self.client.pipeline()
+
+    def get(self, cart_id, ttl):
+        """``{product_id: quantity}``, or None if the cart isn't stored. Resets the TTL."""
+        key, pipe = self._pipeline(cart_id)
+        pipe.hgetall(key)
+        pipe.expire(key, ttl)
+        values, _ = pipe.execute()
+        if not values:
+            return None
+        return {int(pid): int(qty) for pid, qty in values.items() if pid != LOADED_FIELD.encode()}
+
+    def replace(self, cart_id, quantities, ttl):
+        key, pipe = self._pipeline(cart_id)
+        pipe.delete(key)
+        pipe.hset(key, mapping={LOADED_FIELD: 1, **quantities})
+        pipe.expire(key, ttl)
+        pipe.execute()
+
+    def set_lines(self, cart_id, quantities, ttl):
+        """Set the given lines; a quantity of 0 or less removes the line."""
+        key, pipe = self._pipeline(cart_id)
+        keep = {pid: qty for pid, qty in quantities.items() if qty > 0}
+        drop = [pid for pid, qty in quantities.items() if qty <= 0]
+        if keep:
+            pipe.hset(key, mapping=keep)
+        if drop:
+            pipe.hdel(key, *drop)
+        pipe.expire(key, ttl)
+        pipe.execute()
+
+    def add(self, cart_id, product_id, quantity, ttl):
+        key, pipe = self._pipeline(cart_id)
+        pipe.hincrby(key, product_id, quantity)
+        pipe.expire(key, ttl)
+        pipe.execute()
+
+    def delete(self, cart_id):
+        key, pipe = self._pipeline(cart_id)
+        pipe.delete(key)
+        pipe.execute()
+
+
+class CacheCartStore:
+    """``RedisCartStore``'s interface over a cached dict per cart (read-modify-write, not atomic)."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get(self, cart_id, ttl):
+        quantities = self.backend.get(f"cart:{cart_id}")
+        if quantities is not None:
+            self.backend.touch(f"cart:{cart_id}", ttl)
+        return quantities
+
+    def replace(self, cart_id, quantities, ttl):
+        self.backend.set(f"cart:{cart_id}", dict(quantities), ttl)
+
+    def set_lines(self, cart_id, quantities, ttl):
+        stored = self.backend.get(f"cart:{cart_id}") or {}
+        for pid, qty in quantities.items():
+            if qty > 0:
+                stored[pid] = qty
+            else:
+                stored.pop(pid, None)
+        self.replace(cart_id, stored, ttl)
+
+    def add(self, cart_id, product_id, quantity, ttl):
+        stored = self.backend.get(f"cart:{cart_id}") or {}
+        stored[product_id] = stored.get(product_id, 0) + quantity
+        self.replace(cart_id, stored, ttl)
+
+    def delete(self, cart_id):
+        self.backend.delete(f"cart:{cart_id}")
+
+
+@lru_cache
+def _redis_client(url):
+    return redis.Redis.from_url(url)
+
+
+def cart_redis_url():
+    """``CART_REDIS_URL``, else the default cache's primary server if it is Redis, else None."""
+    url = getattr(settings, 'CART_REDIS_URL', None)
+    if url or not isinstance(caches['default'], RedisCache):
+        return url
+    location = settings.CACHES['default']['LOCATION']
+    servers = location.split(',') if isinstance(location, str) else location
+    # The primary, so a read never misses a write just made
+    return servers[0]
+
+
+def get_cart_store():
+    url = cart_redis_url()
+    if url:
+        return RedisCartStore(_redis_client(url))
+    return CacheCartStore(caches['default'])
+
+
+def user_cart_id(user_id):
+    return f"user:{user_id}"
+
+
+def _user_id(cart_id):
+    kind, _, value = cart_id.partition(':')
+    return int(value) if kind == 'user' else None
+
+
+def _ttl(cart_id):
+    return USER_CART_TTL if _user_id(cart_id) is not None else GUEST_CART_TTL
+
+
+def _parse_quantities(raw):
+    quantities = {}
+    for pid, qty in (raw or {}).items():
+        try:
+            pid, qty = int(pid), int(qty)
+        except (TypeError, ValueError):
+            continue
+        if qty > 0:
+            quantities[pid] = qty
+    return quantities
+
+
+def request_cart_id(request, create=False):
+    """
+    The visitor's cart id. Guests get a token in their session when ``create``
+    is set; until then a guest without one has no cart (None).
+    """
+    if request.user.is_authenticated:
+        return user_cart_id(request.user.pk)
+    session = request.session
+    token = session.get(CART_TOKEN_SESSION_KEY)
+    legacy = session.pop(LEGACY_SESSION_KEY, None)
+    if token is None and (create or legacy is not None):
+        token = session[CART_TOKEN_SESSION_KEY] = uuid.uuid4().hex
+    if legacy is not None:
+        get_cart_store().replace(f"guest:{token}", _parse_quantities(legacy), GUEST_CART_TTL)
+    return f"guest:{token}" if token else None
+
+
+def load_cart(cart_id):
+    """``{product_id: quantity}`` for ``cart_id``, loading a logged-in cart from its rows if needed."""
+    if cart_id is None:
+        return {}
+    store = get_cart_store()
+    quantities = store.get(cart_id, _ttl(cart_id))
+    if quantities is None:
+        user_id = _user_id(cart_id)
+        quantities = {}
+        if user_id is not None:
+            quantities = dict(CartItem.objects.filter(cart__user_id=user_id).values_list('product_id', 'quantity'))
+        store.replace(cart_id, quantities, _ttl(cart_id))
+    return quantities
+
+
+def save_lines(cart_id, quantities):
+    get_cart_store().set_lines(cart_id, quantities, _ttl(cart_id))
+
+
+def add_line(cart_id, product_id, quantity):
+    get_cart_store().add(cart_id, product_id, quantity, _ttl(cart_id))
+
+
+def discard_cart(cart_id):
+    """Drop the stored copy; a logged-in cart is reloaded from its rows on next use."""
+    if cart_id is not None:
+        get_cart_store().delete(cart_id)
+
+
+def take_guest_cart(session):
+    """Remove the guest cart referenced by ``session`` and return its quantities."""
+    token = session.pop(CART_TOKEN_SESSION_KEY, None)
+    quantities = _parse_quantities(session.pop(LEGACY_SESSION_KEY, None))
+    if token is not None:
+        store = get_cart_store()
+        quantities = store.get(f"guest:{token}", GUEST_CART_TTL) or quantities
+        store.delete(f"guest:{token}")
+    return quantities
+
+
+def persist_user_cart(user_id):
+    """
+    Write the stored cart of user ``user_id`` to its Cart/CartItem rows. Does
+    nothing if the cart isn't stored (expired: the rows are already current).
+    """
+    quantities = get_cart_store().get(user_cart_id(user_id), USER_CART_TTL)
+    if quantities is None:
+        return
+    with transaction.atomic():
+        cart = Cart.objects.filter(user_id=user_id).order_by('pk').first()
+        if cart is None:
+            if not quantities:
+                return
+            cart = Cart.objects.create(user_id=user_id)
+        items = {item.product_id: item for item in cart.items.select_for_update()}
+        # Products deleted since they were added are skipped
+        existing = set(Product.objects.filter(pk__in=set(quantities) - set(items)).values_list('pk', flat=True))
+
+        created, changed = [], []
+        for pid, qty in quantities.items():
+            item = items.get(pid)
+            if item is None:
+                if pid in existing:
+                    created.append(CartItem(cart=cart, product_id=pid, quantity=qty))
+            elif item.quantity != qty:
+                item.quantity = qty
+                changed.append(item)
+        removed = [item.pk for pid, item in items.items() if pid not in quantities]
+
+        if removed:
+            CartItem.objects.filter(pk__in=removed).delete()
+        CartItem.objects.bulk_update(changed, ['quantity'])
+        CartItem.objects.bulk_create(created)
+        Cart.objects.filter(pk=cart.pk).update(updated_at=timezone.now())
@@ -0,0 +1,94 @@
+"""
+Versioned cache for catalog pages.
+
+Cache keys embed a catalog *generation* number. Saving or deleting a
+Product, Brand or Category bumps the generation (see core.signals), which
+makes every previously cached catalog fragment unreachable at once. Old
+entries simply expire; nothing has to be deleted key by key.
+
+Each bump also records when the catalog last changed, which conditional GETs
+use as a lower bound for ``Last-Modified`` (see core.conditional).
+"""
+import hashlib
+import json
+import time
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from .pagination import PRODUCT_ORDERINGS
+
+CATALOG_CACHE_TIMEOUT = 60 * 15
+CATALOG_GENERATION_KEY = 'catalog:generation'
+CATALOG_CHANGED_AT_KEY = 'catalog:changed_at'
+
+# Stands in for the per-request CSRF token inside cached HTML fragments.
+CATALOG_CSRF_PLACEHOLDER = '__CATALOG_CSRF_TOKEN__'
+
+
+def get_catalog_generation():
+    generation = cache.get(CATALOG_GENERATION_KEY)
+    if generation is None:
+        # Seed from the clock so a flushed counter never reuses an old generation
+        cache.add(CATALOG_GENERATION_KEY, int(time.time()), None)
+        generation = cache.get(CATALOG_GENERATION_KEY)
+    return generation
+
+
+def _next_second():
+    # HTTP dates have whole seconds: round up, so a change is always later than a Last-Modified already sent
+    return timezone.now().replace(microsecond=0) + timedelta(seconds=1)
+
+
+def get_catalog_changed_at():
+    """When the catalog generation was last bumped (now, if that was never recorded)."""
+    changed_at = cache.get(CATALOG_CHANGED_AT_KEY)
+    if changed_at is None:
+        cache.add(CATALOG_CHANGED_AT_KEY, _next_second(), None)
+        changed_at = cache.get(CATALOG_CHANGED_AT_KEY)
+    return changed_at
+
+
+def bump_catalog_generation():
+    # Timestamp first, so a request that sees the new generation also sees the new time.
+    # Each bump moves it at least a second forward, even several bumps within one second.
+    previous = cache.get(CATALOG_CHANGED_AT_KEY)
+    changed_at = _next_second()
+    if previous is not None and previous >= changed_at:
+        changed_at = previous + timedelta(seconds=1)
+    cache.set(CATALOG_CHANGED_AT_KEY, changed_at, None)
+    try:
+        return cache.incr(CATALOG_GENERATION_KEY)
+    except ValueError:
+        generation = int(time.time())
+        cache.set(CATALOG_GENERATION_KEY, generation, None)
+        return generation
+
+
+def _clean_id(value):
+    value = (value or '').strip()
+    return value if value.isdigit() else ''
+
+
+def normalize_catalog_filters(params):
+    """
+    Canonical form of the catalog query string, so equivalent URLs share a
+    cache entry (ordering of params, stray whitespace, search casing, bad ids).
+    """
+    page = (params.get('page') or '').strip()
+    sort = params.get('sort')
+    return {
+        'vehicle_id': _clean_id(params.get('vehicle_id')),
+        'category': _clean_id(params.get('category')),
+        'brand': _clean_id(params.get('brand')),
+        'search': ' '.join((params.get('search') or '').split()).lower(),
+        'sort': sort if sort in PRODUCT_ORDERINGS else '',
+        'page': int(page) if page.isdigit() and int(page) > 0 else 1,
+        'cursor': (params.get('cursor') or '').strip(),
+    }
+
+
+def catalog_cache_key(namespace, *parts):
+    digest = hashlib.md5(json.dumps(parts, default=str).encode()).hexdigest()
+    return f"catalog:{get_catalog_generation()}:{namespace}:{digest}"
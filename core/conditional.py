@@ -0,0 +1,117 @@
+"""
+Conditional GET (ETag / Last-Modified) for catalog pages and the product API.
+
+Validators are derived from the catalog generation (bumped on every product,
+brand, category, compatibility, stock or review change; see core.catalog_cache).
+``Last-Modified`` is the later of ``Product.updated_at`` and the time of the
+last bump, so changes that don't touch ``updated_at`` (stock reservations,
+discount tiers, brands, deletes) still move it forward. Both are read from
+the cache, so a matching
+``If-None-Match`` / ``If-Modified-Since`` is answered with 304 before any
+rendering or serializing happens.
+
+HTML pages embed the visitor's login state and CSRF token, so they are
+``private`` and revalidated by the browser only. API responses are
+``public`` with a short ``max-age`` a CDN or reverse proxy can serve from.
+"""
+import hashlib
+import json
+from functools import wraps
+
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.db.models import Max
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.http import condition
+
+from .catalog_cache import (
+    CATALOG_CACHE_TIMEOUT, get_catalog_changed_at, get_catalog_generation, normalize_catalog_filters
+)
+from .models import Product, Vehicle
+
+PAGE_CACHE_CONTROL = {'private': True, 'no_cache': True}
+API_CACHE_CONTROL = {'public': True, 'max_age': 60}
+
+
+def conditional(etag_func, last_modified_func=None, vary=(), **cache_control):
+    """
+    ``django.views.decorators.http.condition`` plus ``Cache-Control`` (and
+    ``Vary``) on both full and 304 responses to GET/HEAD.
+    """
+    def decorator(view):
+        conditional_view = condition(etag_func=etag_func, last_modified_func=last_modified_func)(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            if request.method in ('GET', 'HEAD') and response.status_code in (200, 304):
+                patch_cache_control(response, **cache_control)
+                if vary:
+                    patch_vary_headers(response, vary)
+            return response
+        return wrapper
+    return decorator
+
+
+def _etag(*parts):
+    return hashlib.md5(json.dumps([get_catalog_generation(), *parts], default=str).encode()).hexdigest()
+
+
+def _viewer(request):
+    """What a page shows about the visitor, or None if it can't be revalidated (flash messages pending)."""
+    if len(get_messages(request)):
+        return None
+    user = request.user
+    if not user.is_authenticated:
+        return ['anon']
+    return [user.pk, user.is_staff]
+
+
+def _latest(*moments):
+    return max(moment for moment in moments if moment is not None)
+
+
+def catalog_last_modified(request, *args, **kwargs):
+    generation = get_catalog_generation()
+    key = f"catalog:{generation}:last_modified"
+    last_modified = cache.get(key)
+    if last_modified is None:
+        last_modified = Product.objects.aggregate(latest=Max('updated_at'))['latest']
+        if last_modified is not None:
+            cache.set(key, last_modified, CATALOG_CACHE_TIMEOUT)
+    return _latest(last_modified, get_catalog_changed_at())
+
+
+def catalog_etag(request, *args, **kwargs):
+    viewer = _viewer(request)
+    if viewer is None:
+        return None
+    filters = normalize_catalog_filters(request.GET)
+    if request.user.is_authenticated:
+        # The garage dropdown lists the visitor's vehicles
+        viewer.append(list(Vehicle.objects.filter(user=request.user).values_list('pk', flat=True)))
+    return _etag('catalog', filters, request.GET.get('search', ''), viewer)
+
+
+def _product_updated_at(slug):
+    return Product.objects.filter(slug=slug).values_list('updated_at', flat=True).first()
+
+
+def product_last_modified(request, slug, *args, **kwargs):
+    updated_at = _product_updated_at(slug)
+    if updated_at is None:
+        return None  # 404
+    # The page also shows stock, discount tiers, brand and fitment, which bump the generation
+    return _latest(updated_at, get_catalog_changed_at())
+
+
+def product_etag(request, slug, *args, **kwargs):
+    viewer = _viewer(request)
+    if viewer is None:
+        return None
+    return _etag('product', slug, _product_updated_at(slug), viewer)
+
+
+def api_etag(request, *args, **kwargs):
+    # Renderer (JSON vs browsable API) and every query parameter shape the body
+    return _etag('api', request.path, sorted(request.GET.lists()), request.META.get('HTTP_ACCEPT', ''))
@@ -1,19 +1,8 @@
-from .models import WebsiteLogo, Favicon, StoreSettings
+from .site_context import get_site_context
 
 def core_context(request):
     """
     Context processor to add common data to all templates.
+    Logo, favicon and store settings are served from a two-tier cache (see core.site_context).
     """
-    try:
-        active_logo = WebsiteLogo.objects.filter(is_active=True).first()
-    except WebsiteLogo.DoesNotExist:
-        active_logo = None
-    
-    favicon = Favicon.objects.first()
-    store_settings = StoreSettings.get_solo()
-        
-    return {
-        'logo': active_logo,
-        'favicon_obj': favicon,
-        'store_settings': store_settings,
-    }
+    return dict(get_site_context())
@@ -0,0 +1,119 @@
+"""
+Metrics for the staff dashboard (``admin_management_hub``).
+
+Sales figures come from the daily rollups (core.rollups). Live counters use
+one conditional-aggregate query per table. The assembled metrics are cached
+with stale-while-revalidate: a value is fresh for a minute and may be served
+stale for a while after that. The first request past the fresh window takes
+a short lock and recomputes. Everyone else keeps getting the previous value
+meanwhile, so a burst of staff page loads never stampedes the database. With
+nothing cached at all, the same lock is taken and the other requests wait up
+to ``DASHBOARD_COLD_WAIT`` seconds for its result.
+"""
+import time
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from .models import OnSiteRepairBooking, Order, Product, User
+from .rollups import sales_summary
+
+DASHBOARD_CACHE_KEY = 'dashboard:metrics'
+DASHBOARD_REFRESH_LOCK_KEY = 'dashboard:metrics:refresh'
+DASHBOARD_FRESH_FOR = 60
+DASHBOARD_STALE_FOR = 60 * 10
+DASHBOARD_REFRESH_LOCK_TIMEOUT = 30
+DASHBOARD_COLD_WAIT = 5
+DASHBOARD_COLD_POLL = 0.1
+
+CLOSED_REPAIR_STATUSES = ('Completed', 'Cancelled', 'Rejected')
+LOW_STOCK_THRESHOLD = 5
+
+
+def compute_dashboard_metrics(today=None):
+    today = today or timezone.localdate()
+    sales = sales_summary(today)
+
+    orders = Order.objects.aggregate(
+        pending_orders=Count('id', filter=Q(status='Pending')),
+    )
+    repairs = OnSiteRepairBooking.objects.aggregate(
+        pending_repairs=Count('id', filter=Q(status='Pending')),
+        active_repairs=Count('id', filter=~Q(status__in=CLOSED_REPAIR_STATUSES)),
+    )
+    customers = User.objects.aggregate(
+        total_customers=Count('id', filter=Q(is_active=True)),
+    )
+
+    growth_percentage = 0
+    if sales['prev_7_revenue'] > 0:
+        growth_percentage = ((sales['last_7_revenue'] - sales['prev_7_revenue']) / sales['prev_7_revenue']) * 100
+
+    delivered = sales['delivered_orders']
+    avg_order_value = sales['total_revenue'] / delivered if delivered > 0 else Decimal('0.00')
+
+    top_selling_products = Product.objects.annotate(
+        total_sold=Sum('order_items__quantity', filter=Q(order_items__order__status='Delivered'))
+    ).filter(total_sold__gt=0).order_by('-total_sold')[:5]
+
+    return {
+        'total_revenue': sales['total_revenue'],
+        'today_revenue': sales['today_revenue'],
+        'growth_percentage': round(growth_percentage, 1),
+        'avg_order_value': round(avg_order_value, 2),
+        'new_customers_week': sales['new_customers_week'],
+        **orders,
+        **repairs,
+        **customers,
+        'top_selling_products': list(top_selling_products),
+        'low_stock_products': list(
+            Product.objects.filter(stock__lt=LOW_STOCK_THRESHOLD).select_related('brand', 'category').order_by('stock')[:5]
+        ),
+        'recent_orders': list(Order.objects.select_related('user').order_by('-created_at')[:5]),
+        'recent_repairs': list(OnSiteRepairBooking.objects.order_by('-created_at')[:5]),
+        'status_labels': [status for status, count in sales['order_status_counts']],
+        'status_data': [count for status, count in sales['order_status_counts']],
+        'sales_trend_labels': [day.strftime('%b %d') for day, revenue in sales['sales_trend']],
+        'sales_trend_data': [float(revenue) for day, revenue in sales['sales_trend']],
+        'repair_labels': [vehicle_type for vehicle_type, count in sales['repair_type_counts']],
+        'repair_counts': [count for vehicle_type, count in sales['repair_type_counts']],
+    }
+
+
+def _wait_for_metrics():
+    deadline = time.monotonic() + DASHBOARD_COLD_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(DASHBOARD_COLD_POLL)
+        entry = cache.get(DASHBOARD_CACHE_KEY)
+        if entry is not None:
+            return entry
+    return None
+
+
+def get_dashboard_metrics():
+    entry = cache.get(DASHBOARD_CACHE_KEY)
+    if entry is not None and entry['fresh_until'] > time.time():
+        return entry['metrics']
+
+    locked = cache.add(DASHBOARD_REFRESH_LOCK_KEY, True, DASHBOARD_REFRESH_LOCK_TIMEOUT)
+    if not locked:
+        if entry is None:
+            # Cold cache: wait for the request computing the metrics instead of computing them too
+            entry = _wait_for_metrics()
+        if entry is not None:
+            # Someone else is refreshing; the stale value is good enough
+            return entry['metrics']
+
+    try:
+        metrics = compute_dashboard_metrics()
+        cache.set(
+            DASHBOARD_CACHE_KEY,
+            {'metrics': metrics, 'fresh_until': time.time() + DASHBOARD_FRESH_FOR},
+            DASHBOARD_FRESH_FOR + DASHBOARD_STALE_FOR,
+        )
+    finally:
+        if locked:
+            cache.delete(DASHBOARD_REFRESH_LOCK_KEY)
+    return metrics
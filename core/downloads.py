@@ -0,0 +1,166 @@
+"""
+Concurrent image downloads for the product importers.
+
+``ImageDownloader.fetch_all(urls)`` downloads a batch of URLs on a bounded
+thread pool sharing one pooled ``requests`` session. Transient failures
+(connection errors, 429 and 5xx) are retried with exponential backoff, and a
+per-host semaphore keeps a supplier's server from receiving more than
+``per_host`` requests at a time.
+
+Downloaded bodies are kept in an on-disk cache keyed by URL together with
+the response's ETag / Last-Modified. A re-import revalidates each URL with
+a conditional GET and reuses the cached bytes on ``304 Not Modified``, so
+unchanged images are not transferred again.
+"""
+import hashlib
+import json
+import mimetypes
+import os
+import tempfile
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlparse
+
+import requests
+from django.conf import settings
+from django.core.files.base import ContentFile
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_CACHE_DIR = os.path.join(settings.BASE_DIR, '.image_download_cache')
+
+
+class ImageDownloader:
+    """
+    Usage::
+
+        downloader = ImageDownloader(log=self.stdout.write)
+        files = downloader.fetch_all(urls)   # {url: ContentFile or None}
+
+    Failed downloads map to None and are logged. Pass ``cache_dir=None`` to
+    disable the disk cache; errors reading or writing it are logged and the
+    image is downloaded / returned without it.
+    """
+
+    def __init__(self, workers=16, per_host=4, retries=3, backoff=0.5, timeout=10,
+                 cache_dir=DEFAULT_CACHE_DIR, log=print):
+        self.workers = workers
+        self.per_host = per_host
+        self.timeout = timeout
+        self.cache_dir = cache_dir
+        self.log = log
+        self.stats = {'downloaded': 0, 'cached': 0, 'failed': 0}
+        self._lock = threading.Lock()
+        self._hosts = defaultdict(lambda: threading.BoundedSemaphore(per_host))
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET']),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def fetch_all(self, urls):
+        urls = list(dict.fromkeys(url for url in urls if url))
+        if not urls:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(urls))) as pool:
+            return dict(zip(urls, pool.map(self.fetch, urls)))
+
+    def fetch(self, url):
+        try:
+            with self._host_slot(url):
+                data, content_type = self._get(url)
+        except requests.RequestException as e:
+            self._count('failed')
+            self.log(f"Error downloading image {url}: {e}")
+            return None
+        return ContentFile(data, name=self._file_name(url, content_type))
+
+    def close(self):
+        self.session.close()
+
+    # ----------------- Internals -----------------
+    def _host_slot(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            return self._hosts[host]
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _get(self, url):
+        cached = self._read_cache(url)
+        headers = {}
+        if cached:
+            if cached['etag']:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                headers['If-Modified-Since'] = cached['last_modified']
+
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+        if response.status_code == 304 and cached:
+            self._count('cached')
+            return cached['data'], cached['content_type']
+        response.raise_for_status()
+
+        content_type = response.headers.get('Content-Type', '')
+        try:
+            self._write_cache(url, response, content_type)
+        except OSError as e:
+            # A full disk or unwritable cache must not fail the import: use the bytes uncached
+            self.log(f"Could not cache image {url}: {e}")
+        self._count('downloaded')
+        return response.content, content_type
+
+    def _cache_paths(self, url):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        base = os.path.join(self.cache_dir, key[:2], key)
+        return f"{base}.body", f"{base}.json"
+
+    def _read_cache(self, url):
+        if not self.cache_dir:
+            return None
+        body_path, meta_path = self._cache_paths(url)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            with open(body_path, 'rb') as f:
+                meta['data'] = f.read()
+        except (OSError, ValueError):
+            return None
+        return meta
+
+    def _write_cache(self, url, response, content_type):
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if not self.cache_dir or not (etag or last_modified):
+            # Nothing to revalidate against, so a cached copy could never be reused safely
+            return
+        body_path, meta_path = self._cache_paths(url)
+        os.makedirs(os.path.dirname(body_path), exist_ok=True)
+        meta = {'etag': etag, 'last_modified': last_modified, 'content_type': content_type}
+        # Body first, metadata last: a metadata file always describes a complete body
+        for path, payload, mode in ((body_path, response.content, 'wb'), (meta_path, json.dumps(meta), 'w')):
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+            try:
+                with os.fdopen(fd, mode) as f:
+                    f.write(payload)
+                os.replace(tmp_path, path)
+            except OSError:
+                os.remove(tmp_path)
+                raise
+
+    def _file_name(self, url, content_type):
+        name = os.path.basename(unquote(urlparse(url).path))
+        if not os.path.splitext(name)[1]:
+            extension = mimetypes.guess_extension(content_type.split(';')[0].strip()) or '.jpg'
+            name = f"{name or 'product_image'}{extension}"
+        return name
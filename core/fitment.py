@@ -0,0 +1,129 @@
+"""
+Vehicle fitment index.
+
+For every VehicleType and VehicleModel the cache holds the set of product
+ids listing it in ``compatible_vehicle_types`` / ``compatible_vehicle_models``.
+"Parts for my vehicle" is the union of its model's and its type's sets,
+applied as ``pk__in`` next to the category/brand filters, instead of joining
+through both M2M tables on every catalog or API request. Above
+``FITMENT_MAX_IN_IDS`` ids the list would be too long to send as query
+parameters (SQLite caps them, and huge IN lists are slow on PostgreSQL), so
+``filter_fitting`` filters with subqueries on the through tables instead.
+
+Sets are built from the through table on first use (one indexed query) and
+cached under a per-vehicle *version*, like the catalog generation (see
+core.catalog_cache). ``apply_fitment_change`` runs after commit from
+``m2m_changed`` (see core.signals) and bumps the versions of the affected
+sets, which are then rebuilt on next use (sets are invalidated, not patched). A set built from a read that raced the change is then stored under the
+old version, which nothing reads any more, so it can't hide the change. Deleted
+products can leave stale ids behind; they are harmless because the ids are
+only ever used to filter the product table.
+"""
+import time
+
+from django.core.cache import cache
+from django.db.models import Q
+
+from .models import Product, Vehicle
+
+FITMENT_TIMEOUT = 60 * 60 * 24
+# Larger id sets are filtered through the compatibility tables rather than sent as pk__in parameters
+FITMENT_MAX_IN_IDS = 500
+
+# kind -> (through model, column holding the vehicle type/model id)
+FITMENT_RELATIONS = {
+    'type': (Product.compatible_vehicle_types.through, 'vehicletype_id'),
+    'model': (Product.compatible_vehicle_models.through, 'vehiclemodel_id'),
+}
+
+
+def fitment_version_key(kind, pk):
+    return f"fitment:{kind}:{pk}:version"
+
+
+def fitment_key(kind, pk, version):
+    return f"fitment:{kind}:{pk}:v{version}"
+
+
+def fitment_versions(kind, pks):
+    """``{pk: current version}`` of the sets of ``pks``, seeding missing versions from the clock."""
+    keys = {fitment_version_key(kind, pk): pk for pk in pks}
+    versions = {keys[key]: version for key, version in cache.get_many(keys).items()}
+    for key, pk in keys.items():
+        if pk not in versions:
+            # Seed from the clock so a flushed counter never reuses an old version
+            cache.add(key, int(time.time()), None)
+            versions[pk] = cache.get(key)
+    return versions
+
+
+def _linked_products(kind, pk):
+    through, column = FITMENT_RELATIONS[kind]
+    return through.objects.filter(**{column: pk}).values('product_id')
+
+
+def fitting_product_ids(kind, pk):
+    """Ids of products compatible with VehicleType (kind 'type') or VehicleModel ('model') ``pk``."""
+    # The version is read before the through table, so a change committed after the read bumps it
+    key = fitment_key(kind, pk, fitment_versions(kind, [pk])[pk])
+    ids = cache.get(key)
+    if ids is None:
+        ids = frozenset(_linked_products(kind, pk).values_list('product_id', flat=True))
+        cache.set(key, ids, FITMENT_TIMEOUT)
+    return ids
+
+
+def _vehicle(vehicle_id):
+    return Vehicle.objects.filter(pk=vehicle_id).values_list('model_id', 'model__type_id').first()
+
+
+def vehicle_product_ids(vehicle_id):
+    """Ids of products that fit a garage Vehicle (its model or its type), or None if it doesn't exist."""
+    vehicle = _vehicle(vehicle_id)
+    if vehicle is None:
+        return None
+    model_id, type_id = vehicle
+    return fitting_product_ids('model', model_id) | fitting_product_ids('type', type_id)
+
+
+def filter_fitting(queryset, vehicle_id):
+    """``queryset`` narrowed to products fitting garage Vehicle ``vehicle_id``, or None if it doesn't exist."""
+    vehicle = _vehicle(vehicle_id)
+    if vehicle is None:
+        return None
+    model_id, type_id = vehicle
+    ids = fitting_product_ids('model', model_id) | fitting_product_ids('type', type_id)
+    if len(ids) <= FITMENT_MAX_IN_IDS:
+        return queryset.filter(pk__in=ids)
+    return queryset.filter(Q(pk__in=_linked_products('model', model_id)) | Q(pk__in=_linked_products('type', type_id)))
+
+
+def apply_fitment_change(kind, vehicle_ids):
+    """
+    Invalidate the cached sets of the vehicle types (kind 'type') or models
+    ('model') in ``vehicle_ids``; they are rebuilt on next use. Must run after
+    the change is committed.
+    """
+    for pk in vehicle_ids:
+        key = fitment_version_key(kind, pk)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, int(time.time()), None)
+
+
+def rebuild_fitment_index():
+    """Rebuild every cached set from the through tables. Returns the number of sets."""
+    count = 0
+    for kind, (through, column) in FITMENT_RELATIONS.items():
+        # Versions first: a set changed while the links are read is written under a stale version
+        versions = fitment_versions(kind, through.objects.values_list(column, flat=True).distinct())
+        sets = {}
+        for pk, product_id in through.objects.values_list(column, 'product_id').iterator():
+            sets.setdefault(pk, set()).add(product_id)
+        cache.set_many(
+            {fitment_key(kind, pk, versions[pk]): frozenset(ids) for pk, ids in sets.items() if pk in versions},
+            FITMENT_TIMEOUT,
+        )
+        count += len(sets)
+    return count
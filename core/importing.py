@@ -0,0 +1,362 @@
+"""
+Bulk product import engine shared by the product importers
+(``import_products.py``, ``manage.py upload_products`` and
+``manage.py import_products``).
+
+Brands, categories, existing products (by ``key_field``) and taken slugs are
+loaded into dicts once. Rows are then buffered and written in chunks: new
+products with ``bulk_create``, existing ones with ``bulk_update``, gallery
+images with one ``bulk_create``, and search vectors with a single UPDATE per
+chunk. Nothing is written per row and no ``exists()`` loop runs to find a
+free slug. A chunk that fails is written again row by row, so one bad row is
+reported under ``failed`` without losing the rest of its chunk.
+
+Bulk writes skip model signals, so the engine does what those signals would
+do: it refreshes search vectors, queues WebP conversion and responsive
+renditions for new images, and bumps the catalog cache generation when done.
+
+With a ``sync_source`` the importer keeps a ``CatalogSyncEntry`` per row
+holding fingerprints of its fields and image URLs. ``sync_check()`` tells the
+caller whether a row changed at all, and whether its images did, before
+anything is downloaded or written, and ``finish()`` reports the rows that
+were created, updated, unchanged or have disappeared from the sheet.
+"""
+import hashlib
+import json
+import time
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .catalog_cache import bump_catalog_generation
+from .models import Brand, CatalogSyncEntry, Category, Product, ProductImage
+from .search import refresh_search_vectors
+from .slugs import SLUG_RETRIES, next_free_slug
+from .storage import is_content_addressed
+from .tasks import enqueue_image_variants, enqueue_webp_conversion
+
+DEFAULT_CHUNK_SIZE = 500
+
+# sync_check() results
+UNCHANGED = 'unchanged'
+FIELDS_CHANGED = 'fields'
+CHANGED = 'changed'
+
+
+def fingerprint(*values):
+    """Stable SHA-256 of JSON-able values (Decimals and other scalars via str)."""
+    return hashlib.sha256(json.dumps(values, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ImportRow:
+    def __init__(self, key, fields, brand, category, main_image, images, fingerprints):
+        self.key = key
+        self.fields = fields
+        self.brand = brand
+        self.category = category
+        self.main_image = main_image
+        self.images = images
+        self.fingerprints = fingerprints
+
+
+class ProductImporter:
+    """
+    Usage::
+
+        importer = ProductImporter(key_field='part_number', log=self.stdout.write)
+        for row in rows:
+            importer.add(row['part_no'], {'title': ..., 'price': ...}, brand='Default Brand')
+        stats = importer.finish()
+
+    ``fields`` are Product field values; ``brand``/``category`` are names
+    (created on first use). ``main_image`` is a File, and ``images`` is a
+    list of Files for the product gallery. With ``replace_images=True``, an
+    updated product whose row brings any image (main or gallery) loses its
+    old gallery images.
+    A key repeated within the import updates the same product; the last
+    row wins.
+
+    For a sync, pass ``sync_source`` (identifying the sheet) and check each
+    row first::
+
+        fingerprints = (fingerprint(fields, category), fingerprint(image_urls))
+        change = importer.sync_check(key, *fingerprints)
+        if change == UNCHANGED:
+            continue
+        # FIELDS_CHANGED: same image URLs as last time, add() without images
+        importer.add(key, fields, ..., fingerprints=fingerprints)
+    """
+
+    def __init__(self, key_field='part_number', chunk_size=DEFAULT_CHUNK_SIZE, replace_images=False, log=print,
+                 sync_source=None):
+        self.key_field = key_field
+        self.chunk_size = chunk_size
+        self.replace_images = replace_images
+        self.log = log
+        self.pending = {}
+        self.stats = {'created': 0, 'updated': 0, 'failed': 0, 'images': 0, 'chunks': 0}
+        self.report = {'created': [], 'updated': [], 'unchanged': [], 'deleted': [], 'failed': []}
+        self.started = time.monotonic()
+
+        self.sync_source = sync_source
+        self.sync_entries = {}
+        self.seen = set()
+        if sync_source:
+            self.sync_entries = {entry.key: entry for entry in CatalogSyncEntry.objects.filter(source=sync_source)}
+
+        self.brands = {brand.name: brand for brand in Brand.objects.all()}
+        self.categories = {category.name: category for category in Category.objects.all()}
+        self.products = {}
+        for product in self.existing_products().exclude(**{f"{key_field}__isnull": True}).order_by('pk'):
+            # With duplicate keys already in the database, the oldest product is the one updated
+            self.products.setdefault(getattr(product, key_field), product)
+        self.slugs = set(Product.objects.exclude(slug__isnull=True).values_list('slug', flat=True))
+
+    # ----------------- Lookups -----------------
+    def existing_products(self):
+        # Only what the importer reads back: rows are matched by key, and a replaced main image is released
+        return Product.objects.only('pk', 'slug', self.key_field, 'main_image')
+
+    def brand(self, name):
+        if name not in self.brands:
+            self.brands[name], _ = Brand.objects.get_or_create(name=name)
+        return self.brands[name]
+
+    def category(self, name):
+        if name not in self.categories:
+            self.categories[name], _ = Category.objects.get_or_create(name=name)
+        return self.categories[name]
+
+    def allocate_slug(self, title):
+        slug = next_free_slug(title, self.slugs, Product._meta.get_field('slug').max_length)
+        self.slugs.add(slug)
+        return slug
+
+    # ----------------- Sync -----------------
+    def sync_check(self, key, fields_fingerprint, images_fingerprint):
+        """
+        Compare a row with its last sync: UNCHANGED (nothing to do, don't
+        add() it), FIELDS_CHANGED (same image URLs, so skip downloading them)
+        or CHANGED.
+        """
+        self.seen.add(key)
+        entry = self.sync_entries.get(key)
+        if entry is None or self.products.get(key) is None:
+            return CHANGED
+        if entry.images_fingerprint != images_fingerprint:
+            return CHANGED
+        if entry.fields_fingerprint != fields_fingerprint or entry.pruned:
+            return FIELDS_CHANGED
+        self.report['unchanged'].append(key)
+        return UNCHANGED
+
+    # ----------------- Buffering -----------------
+    def add(self, key, fields, brand=None, category=None, main_image=None, images=(), fingerprints=None):
+        entry = self.sync_entries.get(key)
+        if entry is not None and entry.pruned:
+            # Back in the sheet after being pruned
+            fields = {**fields, 'is_out_of_stock_manual': False}
+        previous = self.pending.pop(key, None)
+        if previous is not None:
+            # Same key twice in one chunk: merge, keeping images the later row doesn't replace
+            fields = {**previous.fields, **fields}
+            brand = brand or previous.brand
+            category = category or previous.category
+            main_image = main_image or previous.main_image
+            images = list(images) or previous.images
+            fingerprints = fingerprints or previous.fingerprints
+        self.pending[key] = ImportRow(key, fields, brand, category, main_image, list(images), fingerprints)
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the pending rows in one transaction. If that fails, the rows are
+        written one at a time so a bad row only costs itself; rows that still
+        fail are logged and reported under ``failed``.
+        """
+        if not self.pending:
+            return
+        rows = list(self.pending.values())
+        try:
+            self.write_rows(rows)
+        except Exception as e:
+            self.log(f"Chunk of {len(rows)} rows failed ({e}); retrying row by row")
+            for row in rows:
+                try:
+                    self.write_rows([row])
+                except Exception as e:
+                    self.stats['failed'] += 1
+                    self.report['failed'].append(row.key)
+                    self.log(f"Row {row.key} failed: {e}")
+        self.pending = {}
+
+    def write_rows(self, rows):
+        main_image_field = Product._meta.get_field('main_image')
+        gallery_field = ProductImage._meta.get_field('image')
+        now = timezone.now()
+        creates, updates, released, new_images = [], [], [], []
+        update_fields = {'updated_at'}
+        gallery = []
+        # Updated products whose row brings images: their old gallery is replaced
+        refreshed = []
+        # Files saved for this write, released again if it fails
+        stored = []
+
+        for row in rows:
+            product = self.products.get(row.key)
+            values = dict(row.fields, **{self.key_field: row.key})
+            if row.brand:
+                values['brand'] = self.brand(row.brand)
+            if row.category:
+                values['category'] = self.category(row.category)
+
+            if product is None:
+                product = Product(**values)
+                product.slug = self.allocate_slug(product.title)
+                creates.append(product)
+                self.products[row.key] = product
+            else:
+                for name, value in values.items():
+                    setattr(product, name, value)
+                product.updated_at = now
+                update_fields.update(values)
+                updates.append(product)
+                if row.main_image or row.images:
+                    refreshed.append(product)
+
+            if row.main_image:
+                if product.main_image:
+                    released.append(product.main_image.name)
+                # Saved straight to storage, so the bulk write only carries the file name
+                product.main_image = main_image_field.storage.save(
+                    main_image_field.generate_filename(product, row.main_image.name), row.main_image
+                )
+                stored.append((main_image_field.storage, product.main_image.name))
+                update_fields.add('main_image')
+                new_images.append(product)
+            for image in row.images:
+                name = gallery_field.storage.save(gallery_field.generate_filename(None, image.name), image)
+                stored.append((gallery_field.storage, name))
+                gallery.append((product, name))
+
+        try:
+            for attempt in range(SLUG_RETRIES):
+                try:
+                    gallery_rows, replaced_images = self.write_chunk(
+                        rows, creates, updates, update_fields, gallery, refreshed
+                    )
+                    break
+                except IntegrityError:
+                    # Only a slug taken by a concurrent save is retried; any other violation is the rows' own
+                    collided = Product.objects.filter(slug__in=[product.slug for product in creates]).exists()
+                    if not collided or attempt == SLUG_RETRIES - 1:
+                        raise
+                    # Reload the taken slugs and allocate again
+                    self.slugs = set(Product.objects.exclude(slug__isnull=True).values_list('slug', flat=True))
+                    for product in creates:
+                        product.pk = None  # set by batches inserted before the rollback
+                        product.slug = self.allocate_slug(product.title)
+        except Exception:
+            self.discard(rows, creates, updates, stored)
+            raise
+        released.extend(replaced_images)
+        created_ids = {product.pk for product in creates}
+
+        refresh_search_vectors([product.pk for product in creates + updates])
+        if is_content_addressed(main_image_field.storage):
+            # Content-addressed files are reference counted, so dropping ours is safe
+            for name in released:
+                main_image_field.storage.delete(name)
+        for product in new_images:
+            enqueue_webp_conversion(product, 'main_image')
+            enqueue_image_variants(product, 'main_image')
+        for product_image in gallery_rows:
+            enqueue_webp_conversion(product_image, 'image')
+            enqueue_image_variants(product_image, 'image')
+
+        self.stats['created'] += len(creates)
+        self.stats['updated'] += len(updates)
+        self.stats['images'] += len(new_images) + len(gallery)
+        for row in rows:
+            self.report['created' if self.products[row.key].pk in created_ids else 'updated'].append(row.key)
+        self.stats['chunks'] += 1
+        self.log(
+            f"Chunk {self.stats['chunks']}: {len(creates)} created, {len(updates)} updated, "
+            f"{len(gallery)} gallery images ({self.stats['created'] + self.stats['updated']} products so far)"
+        )
+
+    def discard(self, rows, creates, updates, stored):
+        """Undo the in-memory effects of a failed write and release the files it stored."""
+        for product in creates:
+            product.pk = None
+        for row in rows:
+            if self.products.get(row.key) in creates:
+                del self.products[row.key]
+        # Updated products were modified in place: reload what the database still holds
+        for product in self.existing_products().filter(pk__in=[product.pk for product in updates]):
+            self.products[getattr(product, self.key_field)] = product
+        for storage, name in stored:
+            # Content-addressed: drops our reference; otherwise removes the file just written
+            storage.delete(name)
+
+    def write_chunk(self, rows, creates, updates, update_fields, gallery, refreshed):
+        replaced_images = []
+        with transaction.atomic():
+            Product.objects.bulk_create(creates, batch_size=self.chunk_size)
+            if updates:
+                Product.objects.bulk_update(updates, sorted(update_fields), batch_size=self.chunk_size)
+            if self.replace_images and refreshed:
+                old_images = ProductImage.objects.filter(product_id__in=[product.pk for product in refreshed])
+                replaced_images = list(old_images.values_list('image', flat=True))
+                old_images.delete()
+            gallery_rows = ProductImage.objects.bulk_create(
+                [ProductImage(product=product, image=name) for product, name in gallery], batch_size=self.chunk_size
+            )
+            if self.sync_source:
+                self.save_sync_entries(rows)
+        return gallery_rows, replaced_images
+
+    def save_sync_entries(self, rows):
+        entries = [
+            CatalogSyncEntry(
+                source=self.sync_source, key=row.key, product=self.products[row.key],
+                fields_fingerprint=row.fingerprints[0], images_fingerprint=row.fingerprints[1], pruned=False,
+            )
+            for row in rows if row.fingerprints
+        ]
+        CatalogSyncEntry.objects.bulk_create(
+            entries, batch_size=self.chunk_size, update_conflicts=True, unique_fields=['source', 'key'],
+            update_fields=['product', 'fields_fingerprint', 'images_fingerprint', 'pruned', 'synced_at'],
+        )
+        for entry in entries:
+            self.sync_entries[entry.key] = entry
+
+    def finish(self, prune=False):
+        """
+        Flush the last chunk and return the stats. For a sync, rows synced
+        before but absent from this import are reported as deleted; with
+        ``prune`` their products are marked out of stock (never deleted:
+        orders reference them).
+        """
+        self.flush()
+        if self.sync_source:
+            missing = [entry for key, entry in self.sync_entries.items() if key not in self.seen and not entry.pruned]
+            self.report['deleted'] = [entry.key for entry in missing]
+            if prune and missing:
+                with transaction.atomic():
+                    Product.objects.filter(pk__in=[entry.product_id for entry in missing]).update(
+                        is_out_of_stock_manual=True, updated_at=timezone.now()
+                    )
+                    CatalogSyncEntry.objects.filter(source=self.sync_source, key__in=self.report['deleted']).update(pruned=True)
+        bump_catalog_generation()
+        self.stats['seconds'] = round(time.monotonic() - self.started, 1)
+        return self.stats
+
+    def diff_report(self):
+        """Machine-readable summary of the import: row keys by outcome, plus counts."""
+        return {
+            'source': self.sync_source,
+            'counts': {outcome: len(keys) for outcome, keys in self.report.items()},
+            **self.report,
+        }
@@ -0,0 +1,32 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from core.tasks import RESPONSIVE_IMAGE_FIELDS, generate_image_variants, variants_field_name
+
+class Command(BaseCommand):
+    help = 'Generates responsive WebP renditions for catalog images that have none (or outdated ones).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--inline', action='store_true', help='Generate in this process instead of queueing Celery tasks.')
+
+    def handle(self, *args, **options):
+        queued = 0
+        for model_label, field_names in RESPONSIVE_IMAGE_FIELDS.items():
+            model = apps.get_model(model_label)
+            for field_name in field_names:
+                manifest_field = variants_field_name(field_name)
+                rows = model.objects.exclude(**{field_name: ''}).exclude(**{f"{field_name}__isnull": True})
+                for pk, name, manifest in rows.values_list('pk', field_name, manifest_field).iterator():
+                    if (manifest or {}).get('source') == name:
+                        continue
+                    if not name.lower().endswith('.webp'):
+                        self.stdout.write(self.style.WARNING(f"{model_label} #{pk}: {name} is not WebP yet; run convert_to_webp first."))
+                        continue
+                    task_args = (model_label, pk, field_name, name)
+                    if options['inline']:
+                        generate_image_variants(*task_args)
+                    else:
+                        generate_image_variants.delay(*task_args)
+                    queued += 1
+
+        action = 'Generated' if options['inline'] else 'Queued'
+        self.stdout.write(self.style.SUCCESS(f'{action} image variants for {queued} images.'))
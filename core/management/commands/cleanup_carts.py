@@ -0,0 +1,18 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.cart_store import ABANDONED_CART_DAYS
+from core.models import Cart
+
+class Command(BaseCommand):
+    help = 'Deletes logged-in carts untouched for --days (their Redis copies expire on their own). Run daily.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=ABANDONED_CART_DAYS)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        deleted, _ = Cart.objects.filter(updated_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} abandoned cart rows.'))
@@ -1,78 +1,259 @@
+import hashlib
+import io
+import json
 import os
 import shutil
-from django.core.management.base import BaseCommand
-from django.conf import settings
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
 from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
 from django.db import models
-from core.utils.image_utils import convert_to_webp
-from django.core.files.base import ContentFile
+from PIL import Image
+
+from core.catalog_cache import bump_catalog_generation
+from core.models import MediaBlob
+from core.site_context import invalidate_site_context
+from core.storage import hashed_name, is_content_addressed, remember_derivative
+
+
+def convert_file(media_root, name, quality, content_addressed):
+    """
+    Worker: write a WebP copy of one media file and return
+    (name, new_name, sha256, size, error). With content-addressed storage the
+    copy is stored under its content hash, otherwise next to the original.
+    Runs in a pool process, so it only touches the filesystem; the original
+    stays put until the row is updated.
+    """
+    source = os.path.join(media_root, name)
+    if not os.path.exists(source):
+        return name, None, None, 0, 'file not found'
+
+    if content_addressed:
+        try:
+            output = io.BytesIO()
+            with Image.open(source) as img:
+                img.save(output, format='WEBP', quality=quality)
+        except Exception as e:
+            return name, None, None, 0, str(e)
+        data = output.getvalue()
+        digest = hashlib.sha256(data).hexdigest()
+        new_name = hashed_name(digest, '.webp')
+        path = os.path.join(media_root, new_name)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.part"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return name, new_name, digest, len(data), None
+
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    new_name = None
+    try:
+        with Image.open(source) as img:
+            # Reserve a free name atomically: a.png and a.jpg in the same folder must not both become a.webp
+            suffix = 0
+            while True:
+                new_name = os.path.join(directory, f"{stem}{f'_{suffix}' if suffix else ''}.webp")
+                try:
+                    fd = os.open(os.path.join(media_root, new_name), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                    break
+                except FileExistsError:
+                    suffix += 1
+            with os.fdopen(fd, 'wb') as output:
+                img.save(output, format='WEBP', quality=quality)
+    except Exception as e:
+        if new_name:
+            os.remove(os.path.join(media_root, new_name))
+        return name, None, None, 0, str(e)
+    return name, new_name, None, 0, None
+
+
+def convert_job(job):
+    return convert_file(*job)
+
 
 class Command(BaseCommand):
     help = 'Converts all existing images in the media directory to WebP format and updates database references.'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Conversion processes (1 = convert in this process).')
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows converted and written per batch.')
+        parser.add_argument('--quality', type=int, default=80)
+        parser.add_argument('--checkpoint', default=os.path.join(settings.BASE_DIR, '.convert_to_webp.checkpoint.json'),
+                            help='Progress file used to resume an interrupted run.')
+        parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint and start over.')
+
     def handle(self, *args, **options):
-        media_root = settings.MEDIA_ROOT
+        media_root = str(settings.MEDIA_ROOT)
         backup_root = os.path.join(settings.BASE_DIR, 'backup_originals')
+        os.makedirs(backup_root, exist_ok=True)
+
+        self.checkpoint_path = options['checkpoint']
+        self.progress = {} if options['restart'] else self.load_checkpoint()
+        if self.progress:
+            self.stdout.write(f"Resuming from checkpoint {self.checkpoint_path}")
+
+        self.stats = {'converted': 0, 'reused': 0, 'failed': 0}
+        # Files already converted in this run, so rows sharing an image reuse the result
+        self.converted = {}
+        # Fields with a failed row: their checkpoint stays before it, so a resumed run retries it
+        self.held = set()
+        self.media_root, self.backup_root = media_root, backup_root
+        self.quality, self.workers = options['quality'], options['workers']
+        started = time.monotonic()
+
+        pool = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+        try:
+            for model in apps.get_models():
+                for field in model._meta.fields:
+                    if isinstance(field, models.ImageField):
+                        self.convert_field(pool, model, field.name, options['batch_size'])
+        finally:
+            if pool:
+                pool.shutdown()
+
+        # Rows were written with bulk_update (no signals), so drop the caches those signals would have
+        bump_catalog_generation()
+        invalidate_site_context()
+        # Keep the checkpoint while rows failed, so the next run retries them
+        if not self.held and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+        elapsed = time.monotonic() - started
+        rate = self.stats['converted'] / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Converted {self.stats['converted']} images ({self.stats['reused']} reused from identical content, "
+            f"{self.stats['failed']} failed) in {elapsed:.1f}s "
+            f"- {rate:.1f} images/sec. Originals are backed up in backup_originals/"
+        ))
+        if self.stats['converted'] or self.stats['reused']:
+            self.stdout.write("Run build_image_variants to regenerate responsive renditions.")
+
+    def load_checkpoint(self):
+        if not os.path.exists(self.checkpoint_path):
+            return {}
+        with open(self.checkpoint_path) as f:
+            return json.load(f)
+
+    def save_checkpoint(self, key, last_pk):
+        self.progress[key] = last_pk
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.progress, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def convert_field(self, pool, model, field_name, batch_size):
+        key = f"{model._meta.label}.{field_name}"
+        rows = (
+            model.objects.exclude(**{field_name: ''}).exclude(**{f"{field_name}__isnull": True})
+            .exclude(**{f"{field_name}__iendswith": '.webp'})
+            .order_by('pk').values_list('pk', field_name)
+        )
+        if key in self.progress:
+            rows = rows.filter(pk__gt=self.progress[key])
+
+        self.stdout.write(f"Processing {key}...")
+        batch = []
+        for row in rows.iterator(chunk_size=batch_size):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                self.convert_batch(pool, model, field_name, key, batch)
+                batch = []
+        if batch:
+            self.convert_batch(pool, model, field_name, key, batch)
+
+    def back_up(self, name, copy=False):
+        source = os.path.join(self.media_root, name)
+        backup_path = os.path.join(self.backup_root, name)
+        if not os.path.exists(source) or (copy and os.path.exists(backup_path)):
+            return
+        os.makedirs(os.path.dirname(backup_path), exist_ok=True)
+        (shutil.copy2 if copy else shutil.move)(source, backup_path)
+
+    def referenced_names(self, names):
+        """Which of ``names`` some image field of some row still holds."""
+        referenced = set()
+        for model in apps.get_models():
+            for field in model._meta.fields:
+                if isinstance(field, models.ImageField):
+                    referenced.update(
+                        model.objects.filter(**{f"{field.name}__in": names}).values_list(field.name, flat=True)
+                    )
+        return referenced
+
+    def reusable_conversions(self, storage, names):
+        """WebP copies already made from identical content (content-addressed storage only)."""
+        if not is_content_addressed(storage):
+            return {}
+        reusable = {}
+        for blob in MediaBlob.objects.filter(name__in=names).exclude(derivatives={}).only('name', 'derivatives'):
+            webp_name = blob.derivatives.get('webp')
+            if webp_name and storage.exists(webp_name):
+                reusable[blob.name] = webp_name
+        return reusable
+
+    def convert_batch(self, pool, model, field_name, key, batch):
+        storage = model._meta.get_field(field_name).storage
+        content_addressed = is_content_addressed(storage)
+        pending = {name for _, name in batch if name not in self.converted}
+
+        reused = self.reusable_conversions(storage, pending)
+        self.converted.update(reused)
+        self.stats['reused'] += len(reused)
+
+        jobs = [(self.media_root, name, self.quality, content_addressed) for name in pending if name not in reused]
+        if pool:
+            results = pool.map(convert_job, jobs, chunksize=max(1, len(jobs) // (self.workers * 4)))
+        else:
+            results = map(convert_job, jobs)
+
+        converted_now = list(reused)
+        new_files = {}
+        for name, new_name, digest, size, error in results:
+            if error:
+                self.stats['failed'] += 1
+                self.stdout.write(self.style.ERROR(f"Error converting {name}: {error}"))
+            else:
+                self.stats['converted'] += 1
+                converted_now.append(name)
+                if content_addressed:
+                    new_files[new_name] = (digest, size)
+                    remember_derivative(storage, name, 'webp', new_name)
+            self.converted[name] = new_name
+
+        updates = [model(pk=pk, **{field_name: self.converted[name]}) for pk, name in batch if self.converted[name]]
+        model.objects.bulk_update(updates, [field_name], batch_size=500)
+        if content_addressed:
+            # One reference per row now pointing at each WebP file
+            for new_name, references in Counter(getattr(obj, field_name).name for obj in updates).items():
+                digest, size = new_files.get(new_name, (None, 0))
+                storage.register(new_name, digest, size, references=references)
+
+        failed = [pk for pk, name in batch if not self.converted[name]]
+        if key not in self.held:
+            done = [pk for pk, _ in batch if not failed or pk < failed[0]]
+            if failed:
+                self.held.add(key)
+            if done:
+                self.save_checkpoint(key, done[-1])
 
-        if not os.path.exists(backup_root):
-            os.makedirs(backup_root)
-            self.stdout.write(self.style.SUCCESS(f'Created backup directory: {backup_root}'))
-
-        # Get all models
-        all_models = apps.get_models()
-        self.stdout.write(f"Scanning {len(all_models)} models...")
-
-        for model in all_models:
-            # Find models with ImageField
-            image_fields = [f for f in model._meta.fields if isinstance(f, models.ImageField)]
-            if not image_fields:
-                continue
-
-            self.stdout.write(f"Processing model: {model.__name__}")
-            
-            instances = model.objects.all()
-            for instance in instances:
-                updated = False
-                for field in image_fields:
-                    image_field_file = getattr(instance, field.name)
-                    
-                    if not image_field_file or not image_field_file.name:
-                        continue
-                    
-                    if image_field_file.name.lower().endswith('.webp'):
-                        continue
-
-                    original_path = image_field_file.path
-                    if not os.path.exists(original_path):
-                        self.stdout.write(self.style.WARNING(f"File not found: {original_path}"))
-                        continue
-
-                    self.stdout.write(f"Converting {image_field_file.name}...")
-
-                    try:
-                        # Convert to WebP
-                        webp_content_file = convert_to_webp(image_field_file)
-                        
-                        if webp_content_file:
-                            # Save the new file
-                            # Django will handle the path relative to upload_to
-                            new_name = webp_content_file.name
-                            image_field_file.save(new_name, webp_content_file, save=False)
-                            
-                            # Backup original
-                            relative_path = os.path.relpath(original_path, media_root)
-                            backup_path = os.path.join(backup_root, relative_path)
-                            backup_dir = os.path.dirname(backup_path)
-                            
-                            if not os.path.exists(backup_dir):
-                                os.makedirs(backup_dir)
-                            
-                            shutil.move(original_path, backup_path)
-                            updated = True
-                    except Exception as e:
-                        self.stdout.write(self.style.ERROR(f"Error converting {original_path}: {e}"))
-
-                if updated:
-                    instance.save()
-
-        self.stdout.write(self.style.SUCCESS('Bulk conversion completed! Originals are backed up in backup_originals/'))
+        # Only now that the rows point at the WebP files is it safe to move the originals away
+        if content_addressed:
+            # Other rows or fields may still reference the same content: drop one reference per
+            # row repointed here; the file itself is removed once the last reference is gone
+            for name, references in Counter(name for _, name in batch if self.converted[name]).items():
+                self.back_up(name, copy=True)
+                storage.release(name, references)
+        else:
+            # Another row or field may still show the same file (e.g. one not converted yet): keep
+            # the original in place for it and back up a copy; move it away once nothing uses it
+            names = {name for _, name in batch if self.converted[name]}
+            referenced = self.referenced_names(names)
+            for name in names:
+                self.back_up(name, copy=name in referenced)
+        self.stdout.write(f"  {key}: up to #{batch[-1][0]} ({self.stats['converted']} converted so far)")
@@ -1,19 +1,39 @@
 # core/management/commands/populate_slugs.py
 from django.core.management.base import BaseCommand
-from django.utils.text import slugify
+from django.db import IntegrityError, transaction
+from core.catalog_cache import bump_catalog_generation
 from core.models import Product
+from core.slugs import SLUG_RETRIES, next_free_slug
+
+BATCH_SIZE = 500
 
 class Command(BaseCommand):
     help = 'Populate slugs for products that do not have one'
 
     def handle(self, *args, **kwargs):
-        products = Product.objects.filter(slug__isnull=True)
-        for product in products:
-            product.slug = slugify(product.title)
-            original_slug = product.slug
-            counter = 1
-            while Product.objects.filter(slug=product.slug).exclude(id=product.id).exists():
-                product.slug = f"{original_slug}-{counter}"
-                counter += 1
-            product.save()
-            self.stdout.write(self.style.SUCCESS(f'Updated slug for product: {product.title} to {product.slug}'))
\ No newline at end of file
+        products = list(Product.objects.filter(slug__isnull=True).only('id', 'title'))
+        max_length = Product._meta.get_field('slug').max_length
+
+        for start in range(0, len(products), BATCH_SIZE):
+            batch = products[start:start + BATCH_SIZE]
+            for attempt in range(SLUG_RETRIES):
+                # All taken slugs in one query; suffixes are then picked in memory
+                taken = set(Product.objects.exclude(slug__isnull=True).values_list('slug', flat=True))
+                for product in batch:
+                    product.slug = next_free_slug(product.title, taken, max_length)
+                    taken.add(product.slug)
+                try:
+                    with transaction.atomic():
+                        Product.objects.bulk_update(batch, ['slug'])
+                    break
+                except IntegrityError:
+                    # A concurrent save took one of these slugs; allocate the batch again
+                    if attempt == SLUG_RETRIES - 1:
+                        raise
+            for product in batch:
+                self.stdout.write(self.style.SUCCESS(f'Updated slug for product: {product.title} to {product.slug}'))
+
+        if products:
+            # bulk_update skips post_save, so cached catalog pages still link without slugs
+            bump_catalog_generation()
+        self.stdout.write(self.style.SUCCESS(f'{len(products)} slugs populated.'))
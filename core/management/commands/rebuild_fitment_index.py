@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from core.fitment import rebuild_fitment_index
+
+class Command(BaseCommand):
+    help = 'Rebuilds the cached vehicle fitment index (after a cache flush, or bulk edits of compatibility that bypass signals).'
+
+    def handle(self, *args, **options):
+        written = rebuild_fitment_index()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {written} fitment sets.'))
@@ -0,0 +1,21 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.rollups import rebuild_daily_rollups
+
+class Command(BaseCommand):
+    help = 'Recomputes the daily sales rollups behind the admin dashboard (first deploy, or after bulk updates that bypass signals).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Only rebuild the last N days instead of the full history.')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['days']:
+            since = timezone.localdate() - timedelta(days=options['days'])
+
+        written = rebuild_daily_rollups(since=since)
+        scope = f"since {since}" if since else "for the full history"
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {written} daily rollup rows {scope}.'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from core.search import is_search_supported, refresh_search_vectors
+
+class Command(BaseCommand):
+    help = 'Recomputes the full-text search vector for every product (run after bulk imports or on first deploy).'
+
+    def handle(self, *args, **options):
+        if not is_search_supported():
+            self.stdout.write(self.style.WARNING("Full-text search requires PostgreSQL; nothing to rebuild."))
+            return
+
+        updated = refresh_search_vectors()
+        self.stdout.write(self.style.SUCCESS(f'Search index rebuilt for {updated} products.'))
@@ -1,17 +1,119 @@
+import hashlib
+import json
 import os
+import re
 import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
 from io import BytesIO
 from PIL import Image
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 from django.apps import apps
-from django.db import models
-from django.core.files.base import ContentFile
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from core.catalog_cache import bump_catalog_generation
+from core.storage import hashed_name, is_content_addressed
+from core.tasks import variants_field_name
 
 try:
-    from rembg import remove
+    from rembg import new_session, remove
 except ImportError:
-    remove = None
+    new_session = remove = None
+
+# One rembg session per worker process, created on first use and reused for every image
+_session = None
+_session_model = None
+_processed_hashes = frozenset()
+
+
+def init_worker(model_name, processed_hashes):
+    global _session, _session_model, _processed_hashes
+    _session, _session_model, _processed_hashes = None, model_name, processed_hashes
+
+
+def file_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def process_image(media_root, backup_root, name, dry_run, content_addressed=False):
+    """
+    Worker: replace the background of one media file with white. Returns
+    (name, status, output_hash, new_name, error) with status 'processed',
+    'skipped' (content already processed) or 'failed'.
+
+    With content-addressed storage the result is written under its own hash
+    name (``new_name``) and the original is left for the caller to release;
+    otherwise the file is overwritten in place (``new_name == name``).
+    """
+    global _session
+    path = os.path.join(media_root, name)
+    try:
+        with open(path, 'rb') as f:
+            input_data = f.read()
+        if file_hash(input_data) in _processed_hashes:
+            return name, 'skipped', None, None, None
+        if dry_run:
+            return name, 'processed', None, None, None
+
+        if _session is None:
+            _session = new_session(_session_model)
+        output_data = remove(input_data, session=_session)
+
+        # rembg output is RGBA; composite it over a white background
+        img = Image.open(BytesIO(output_data)).convert("RGBA")
+        white_bg = Image.new("RGBA", img.size, (255, 255, 255, 255))
+        final_img = Image.alpha_composite(white_bg, img).convert("RGB")
+
+        extension = os.path.splitext(name)[1]
+        output = BytesIO()
+        final_img.save(output, format=Image.registered_extensions().get(extension.lower(), 'PNG'))
+        data = output.getvalue()
+        output_hash = file_hash(data)
+
+        if content_addressed:
+            # Hash-named files are immutable: the result gets its own name (same extension)
+            new_name = hashed_name(output_hash, extension)
+            new_path = os.path.join(media_root, new_name)
+            if not os.path.exists(new_path):
+                os.makedirs(os.path.dirname(new_path), exist_ok=True)
+                tmp_path = f"{new_path}.{os.getpid()}.part"
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, new_path)
+            return name, 'processed', output_hash, new_name, None
+
+        backup_path = os.path.join(backup_root, name)
+        os.makedirs(os.path.dirname(backup_path), exist_ok=True)
+        shutil.copy2(path, backup_path)
+        # Overwrite the original file (same name and extension), so no DB path changes
+        with open(path, 'wb') as f:
+            f.write(data)
+        return name, 'processed', output_hash, name, None
+    except Exception as e:
+        return name, 'failed', None, None, str(e)
+
+
+def process_job(job):
+    return process_image(*job)
+
+
+def parse_since(value):
+    """'24h', '7d', '2024-05-01' or an ISO datetime -> aware datetime."""
+    match = re.fullmatch(r'(\d+)([hd])', value.strip())
+    if match:
+        amount, unit = int(match.group(1)), match.group(2)
+        return timezone.now() - timedelta(**{'hours' if unit == 'h' else 'days': amount})
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f"Invalid --since value: {value!r} (use e.g. 24h, 7d or 2024-05-01)")
+        moment = datetime.combine(day, datetime.min.time())
+    return moment if timezone.is_aware(moment) else timezone.make_aware(moment)
+
 
 class Command(BaseCommand):
     help = 'Removes background from product images using rembg and replaces it with white.'
@@ -27,6 +129,26 @@ class Command(BaseCommand):
             type=int,
             help='Limit the number of images to process (useful for testing)',
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=max(1, (os.cpu_count() or 2) // 2),
+            help='Worker processes, each holding its own rembg session (1 = run in this process)',
+        )
+        parser.add_argument(
+            '--since',
+            help='Only images uploaded (file modified) since this time: 24h, 7d, 2024-05-01 or an ISO datetime',
+        )
+        parser.add_argument(
+            '--model',
+            default='u2net',
+            help='rembg model name',
+        )
+        parser.add_argument(
+            '--manifest',
+            default=os.path.join(settings.BASE_DIR, '.remove_bg.manifest.json'),
+            help='File recording content hashes of already processed images',
+        )
 
     def handle(self, *args, **options):
         if remove is None:
@@ -36,14 +158,9 @@ class Command(BaseCommand):
             return
 
         dry_run = options['dry_run']
-        limit = options['limit']
-        
-        media_root = settings.MEDIA_ROOT
+        media_root = str(settings.MEDIA_ROOT)
         backup_root = os.path.join(settings.BASE_DIR, 'backup_originals')
-
-        if not dry_run and not os.path.exists(backup_root):
-            os.makedirs(backup_root)
-            self.stdout.write(self.style.SUCCESS(f'Created backup directory: {backup_root}'))
+        since = parse_since(options['since']).timestamp() if options['since'] else None
 
         # Targeted models and their image fields
         target_models = [
@@ -51,85 +168,115 @@ class Command(BaseCommand):
             ('core', 'ProductImage', ['image']),
         ]
 
-        count = 0
+        names = []
+        seen = set()
         for app_label, model_name, fields in target_models:
-            try:
-                model = apps.get_model(app_label, model_name)
-            except LookupError:
-                self.stdout.write(self.style.WARNING(f"Model {app_label}.{model_name} not found."))
-                continue
-
-            self.stdout.write(f"Processing model: {model_name}")
-            instances = model.objects.all()
-            
-            for instance in instances:
-                if limit and count >= limit:
-                    break
-                
-                updated = False
-                for field_name in fields:
-                    image_field = getattr(instance, field_name)
-                    
-                    if not image_field or not image_field.name:
+            model = apps.get_model(app_label, model_name)
+            for field_name in fields:
+                rows = model.objects.exclude(**{field_name: ''}).exclude(**{f"{field_name}__isnull": True})
+                for name in rows.values_list(field_name, flat=True).iterator():
+                    if name in seen:
                         continue
-
-                    original_path = image_field.path
-                    if not os.path.exists(original_path):
-                        self.stdout.write(self.style.WARNING(f"File not found: {original_path}"))
+                    seen.add(name)
+                    path = os.path.join(media_root, name)
+                    if not os.path.exists(path):
+                        self.stdout.write(self.style.WARNING(f"File not found: {path}"))
                         continue
+                    if since and os.path.getmtime(path) < since:
+                        continue
+                    names.append(name)
+        if options['limit']:
+            names = names[:options['limit']]
+
+        manifest_path = options['manifest']
+        manifest = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+
+        self.stdout.write(f"Processing {len(names)} images with {options['workers']} worker(s)...")
+        started = time.monotonic()
+        counts = {'processed': 0, 'skipped': 0, 'failed': 0}
+        # original name -> name of the processed file, until the rows are repointed
+        replacements = {}
+        storage = apps.get_model('core', 'Product')._meta.get_field('main_image').storage
+        jobs = [(media_root, backup_root, name, dry_run, is_content_addressed(storage)) for name in names]
+        initargs = (options['model'], frozenset(manifest))
+
+        if options['workers'] > 1:
+            pool = ProcessPoolExecutor(max_workers=options['workers'], initializer=init_worker, initargs=initargs)
+            results = pool.map(process_job, jobs, chunksize=4)
+        else:
+            pool = None
+            init_worker(*initargs)
+            results = map(process_job, jobs)
 
-                    self.stdout.write(f"Processing {image_field.name}...")
-
-                    try:
-                        # 1. Backup original
-                        relative_path = os.path.relpath(original_path, media_root)
-                        backup_path = os.path.join(backup_root, relative_path)
-                        backup_dir = os.path.dirname(backup_path)
-                        
-                        if not dry_run:
-                            if not os.path.exists(backup_dir):
-                                os.makedirs(backup_dir)
-                            
-                            # Use copy instead of move to keep original in place while processing
-                            shutil.copy2(original_path, backup_path)
-
-                        # 2. Remove background
-                        with open(original_path, 'rb') as i:
-                            input_data = i.read()
-                            output_data = remove(input_data)
-
-                        # 3. Apply white background
-                        # output_data is RGBA (with transparency)
-                        img = Image.open(BytesIO(output_data)).convert("RGBA")
-                        
-                        # Create white background
-                        white_bg = Image.new("RGBA", img.size, (255, 255, 255, 255))
-                        # Composite the image over white background
-                        final_img = Image.alpha_composite(white_bg, img).convert("RGB")
-
-                        # 4. Save processed image
-                        if not dry_run:
-                            # We'll save it back to the original path (maintaining format/extension if compatible)
-                            # Or we can always save as PNG/JPEG. rembg output is usually PNG.
-                            # Since user wants it for ecommerce, we might want to save as JPEG or WebP but 
-                            # let's stick to the original extension but with white BG.
-                            final_img.save(original_path)
-                            updated = True
-                            count += 1
-                        else:
-                            self.stdout.write(self.style.NOTICE(f"[Dry Run] Would process {image_field.name}"))
-                            count += 1
-
-                    except Exception as e:
-                        self.stdout.write(self.style.ERROR(f"Error processing {original_path}: {e}"))
-
-                if updated and not dry_run:
-                    # No need to change DB path if we overwrite the original file, 
-                    # but if we wanted to change extension, we would need to update.
-                    # For now, we overwrite the physical file.
-                    pass
+        try:
+            for name, status, output_hash, new_name, error in results:
+                counts[status] += 1
+                if status == 'failed':
+                    self.stdout.write(self.style.ERROR(f"Error processing {name}: {error}"))
+                elif status == 'processed':
+                    if dry_run:
+                        self.stdout.write(self.style.NOTICE(f"[Dry Run] Would process {name}"))
+                    else:
+                        self.stdout.write(f"Processed {name}")
+                        replacements[name] = new_name
+                        manifest[output_hash] = new_name
+                        if len(replacements) >= 50:
+                            self.save_manifest(manifest_path, manifest)
+                            self.invalidate_renditions(target_models, replacements, backup_root)
+                            replacements = {}
+        finally:
+            if pool:
+                pool.shutdown()
+            if replacements:
+                self.save_manifest(manifest_path, manifest)
+                self.invalidate_renditions(target_models, replacements, backup_root)
+            if counts['processed'] and not dry_run:
+                bump_catalog_generation()
+                self.stdout.write("Run build_image_variants to regenerate responsive renditions.")
 
+        elapsed = time.monotonic() - started
+        summary = (
+            f"{counts['processed']} processed, {counts['skipped']} already done, {counts['failed']} failed "
+            f"in {elapsed:.1f}s ({counts['processed'] / elapsed if elapsed else 0:.2f} images/sec)"
+        )
         if dry_run:
-            self.stdout.write(self.style.SUCCESS(f'Dry run completed. {count} images would be processed.'))
+            self.stdout.write(self.style.SUCCESS(f'Dry run completed. {summary}'))
         else:
-            self.stdout.write(self.style.SUCCESS(f'Background removal completed for {count} images! Originals are backed up in backup_originals/'))
+            self.stdout.write(self.style.SUCCESS(f'Background removal completed: {summary}. Originals are backed up in backup_originals/'))
+
+    def save_manifest(self, path, manifest):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, path)
+
+    def invalidate_renditions(self, target_models, replacements, backup_root):
+        """
+        Drop the variant manifests of rows showing a processed image. Rows on
+        a renamed (content-addressed) file are pointed at the new file, which
+        takes over their references; the original's are released, so neither
+        its bytes nor its recorded derivatives are reused for the new content.
+        """
+        in_place = [name for name, new_name in replacements.items() if new_name == name]
+        renamed = {name: new_name for name, new_name in replacements.items() if new_name != name}
+        for app_label, model_name, fields in target_models:
+            model = apps.get_model(app_label, model_name)
+            for field_name in fields:
+                storage = model._meta.get_field(field_name).storage
+                reset = {variants_field_name(field_name): {}}
+                for start in range(0, len(in_place), 500):
+                    model.objects.filter(**{f"{field_name}__in": in_place[start:start + 500]}).update(**reset)
+                for name, new_name in renamed.items():
+                    references = model.objects.filter(**{field_name: name}).update(**{field_name: new_name}, **reset)
+                    if not references:
+                        continue
+                    digest = os.path.splitext(os.path.basename(new_name))[0]
+                    storage.register(new_name, digest, storage.size(new_name), references=references)
+                    backup_path = os.path.join(backup_root, name)
+                    if not os.path.exists(backup_path) and storage.exists(name):
+                        os.makedirs(os.path.dirname(backup_path), exist_ok=True)
+                        shutil.copy2(storage.path(name), backup_path)
+                    storage.release(name, references)
@@ -1,18 +1,27 @@
-import pandas as pd
-import requests
-import os
-from urllib.parse import urlparse
+import itertools
+import json
 from decimal import Decimal, InvalidOperation
 
 from django.core.management.base import BaseCommand
-from django.core.files.base import ContentFile
-from core.models import Product, Category, ProductImage
+from core.downloads import ImageDownloader
+from core.importing import FIELDS_CHANGED, UNCHANGED, ProductImporter, fingerprint
+from core.spreadsheets import iter_records
+
+# Rows whose images are downloaded together before being queued for import
+DOWNLOAD_BLOCK_ROWS = 100
 
 class Command(BaseCommand):
     help = 'Upload products directly from Google Sheet URL'
 
     def add_arguments(self, parser):
         parser.add_argument('sheet_url', type=str, help='Google Sheet shareable link')
+        parser.add_argument('--download-workers', type=int, default=16, help='Concurrent image downloads')
+        parser.add_argument('--per-host', type=int, default=4, help='Concurrent downloads per image host')
+        parser.add_argument('--sync', action='store_true',
+                            help='Only write rows whose fields or image URLs changed since the last sync of this sheet')
+        parser.add_argument('--prune', action='store_true',
+                            help='With --sync, mark products whose rows were removed from the sheet as out of stock')
+        parser.add_argument('--report', help='Write a JSON report of created/updated/unchanged/deleted rows to this file')
 
     def clean_value(self, value, value_type='decimal'):
         """Helper function to clean numeric values from strings."""
@@ -45,42 +54,6 @@ class Command(BaseCommand):
                 return parts[1].strip()  # e.g., "PCS"
         return None  # Let model default (blank=True, null=True) handle it
 
-    def download_and_save_image(self, product, image_url, is_main=False, index=0):
-        """Downloads an image from a URL and saves it to the product."""
-        if not image_url or not image_url.startswith('http'):
-            self.stdout.write(self.style.WARNING(f"Invalid or empty image URL for {product.title}: {image_url}"))
-            return
-
-        try:
-            response = requests.get(image_url, stream=True, timeout=10)
-            response.raise_for_status()  # Raise an error for bad responses (4xx or 5xx)
-
-            # Get original extension or default to .jpg
-            path = urlparse(image_url).path
-            ext = os.path.splitext(path)[1]
-            if not ext:
-                ext = '.jpg'
-            
-            # Create a unique, descriptive name
-            filename = f"{product.slug}-{index}{ext}"
-            image_content = ContentFile(response.content)
-
-            if is_main:
-                # Save to main_image field
-                product.main_image.save(filename, image_content, save=True)
-                self.stdout.write(self.style.SUCCESS(f"Saved main image for {product.title}"))
-            else:
-                # Create and save to ProductImage model
-                pi = ProductImage(product=product)
-                pi.image.save(filename, image_content, save=True)
-                self.stdout.write(self.style.SUCCESS(f"Saved additional image for {product.title}"))
-
-        except requests.exceptions.RequestException as e:
-            self.stdout.write(self.style.ERROR(f"Error downloading image {image_url} for {product.title}: {e}"))
-        except Exception as e:
-            self.stdout.write(self.style.ERROR(f"Error saving image {image_url} for {product.title}: {e}"))
-
-
     def handle(self, *args, **options):
         sheet_url = options['sheet_url']
 
@@ -91,18 +64,30 @@ class Command(BaseCommand):
             self.stdout.write(self.style.ERROR("Invalid Google Sheet URL format. Use the 'share' link."))
             return
 
+        # Existing images are replaced when a row brings new ones
+        importer = ProductImporter(
+            key_field='title', replace_images=True, log=self.stdout.write,
+            sync_source=sheet_url.split('/edit')[0] if options['sync'] else None,
+        )
+        downloader = ImageDownloader(
+            workers=options['download_workers'], per_host=options['per_host'],
+            log=lambda message: self.stdout.write(self.style.ERROR(message)),
+        )
+        rows = []
+
+        # The sheet is streamed in chunks (values read as text) instead of loaded whole
+        records = iter_records(csv_url, xlsx=False)
         try:
-            # Read all data as strings to prevent pandas from auto-converting
-            df = pd.read_csv(csv_url, dtype=str).fillna('')
+            first = next(records, None)
         except Exception as e:
             self.stdout.write(self.style.ERROR(f"Error fetching Google Sheet: {e}"))
             return
 
-        for index, row in df.iterrows():
+        for row in itertools.chain([first] if first else [], records):
             # --- 1. Get data and handle column name variations ---
             title = row.get('Title') or row.get('title')
             if not title:
-                self.stdout.write(self.style.WARNING(f"Skipping row {index+2}: No title found."))
+                self.stdout.write(self.style.WARNING(f"Skipping row {row.number}: No title found."))
                 continue
 
             category_name = row.get('Category') or row.get('category') or "Uncategorized"
@@ -128,67 +113,68 @@ class Command(BaseCommand):
 
             net_quantity = self.get_net_quantity(raw_price) # Try to get 'PCS' etc.
 
-            # --- 3. Get or create Category ---
-            category_obj, _ = Category.objects.get_or_create(name=category_name)
-
-            # --- 4. Create or update Product (NEW LOGIC) ---
-            # Use update_or_create to update existing products based on title
-            try:
-                product, created = Product.objects.update_or_create(
-                    title=title,
-                    defaults={
-                        'category': category_obj,
-                        'price': price,
-                        'mrp': mrp,
-                        'stock': stock,
-                        'moq': moq,
-                        'description': description,
-                        'net_quantity': net_quantity,
-                    }
-                )
-
-                if created:
-                    self.stdout.write(self.style.SUCCESS(f"Created new product: {title}"))
-                else:
-                    self.stdout.write(self.style.WARNING(f"Updated existing product: {title}"))
-
-            except Product.MultipleObjectsReturned:
-                self.stdout.write(self.style.ERROR(f"DUPLICATE ERROR: Multiple products found with title '{title}'."))
-                # Get all products with that title, update the first one, and warn about others.
-                products = Product.objects.filter(title=title)
-                product = products.first() # Get the first one
-                
-                # Update this first object
-                product.category = category_obj
-                product.price = price
-                product.mrp = mrp
-                product.stock = stock
-                product.moq = moq
-                product.description = description
-                product.net_quantity = net_quantity
-                product.save()
-                
-                created = False # It was not created, it was updated
-                self.stdout.write(self.style.WARNING(f"--> Updated FIRST product found for: {title}. ({products.count() - 1} other duplicates exist in DB)"))
-
-            # --- 5. Handle Image Downloads ---
-            if image_urls_str:
-                # Clear existing images before adding new ones
-                if not created:
-                    if product.main_image:
-                        product.main_image.delete(save=False) # Delete old main image
-                    ProductImage.objects.filter(product=product).delete() # Delete old additional images
-                    self.stdout.write(self.style.NOTICE(f"Cleared old images for {title}"))
-
-
-                image_urls = [url.strip() for url in image_urls_str.split(',') if url.strip().startswith('http')]
-                
-                if image_urls:
-                    # Download and save main image (first one)
-                    self.download_and_save_image(product, image_urls[0], is_main=True, index=0)
-                    
-                    # Download and save remaining images
-                    for i, image_url in enumerate(image_urls[1:], start=1):
-                        self.download_and_save_image(product, image_url, is_main=False, index=i)
-
-        self.stdout.write(self.style.SUCCESS("All products processed successfully!"))
\ No newline at end of file
+            # --- 3. Collect image URLs; they are downloaded concurrently per block of rows ---
+            image_urls = [url.strip() for url in image_urls_str.split(',') if url.strip().startswith('http')]
+            fields = {
+                'price': price,
+                'mrp': mrp,
+                'stock': stock,
+                'moq': moq,
+                'description': description,
+                'net_quantity': net_quantity,
+            }
+
+            fingerprints = None
+            if options['sync']:
+                # Skip rows identical to the last sync; keep the current images if their URLs are unchanged
+                fingerprints = (fingerprint(fields, category_name), fingerprint(image_urls))
+                change = importer.sync_check(title, *fingerprints)
+                if change == UNCHANGED:
+                    continue
+                if change == FIELDS_CHANGED:
+                    image_urls = []
+            rows.append((title, fields, category_name, image_urls, fingerprints))
+            if len(rows) >= DOWNLOAD_BLOCK_ROWS:
+                self.add_rows(importer, downloader, rows)
+                rows = []
+
+        self.add_rows(importer, downloader, rows)
+        downloader.close()
+        stats = importer.finish(prune=options['prune'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['created']} products created, {stats['updated']} updated, {stats['images']} images saved "
+            f"in {stats['seconds']}s ({downloader.stats['downloaded']} downloaded, "
+            f"{downloader.stats['cached']} revalidated from cache, {downloader.stats['failed']} failed)."
+        ))
+        if stats['failed']:
+            self.stdout.write(self.style.ERROR(
+                f"{stats['failed']} products could not be saved: {', '.join(importer.report['failed'])}"
+            ))
+        report = importer.diff_report()
+        if options['sync']:
+            self.stdout.write(
+                f"Sync: {report['counts']['unchanged']} unchanged, {report['counts']['deleted']} rows no longer in the sheet"
+                + (" (marked out of stock)" if options['prune'] else "")
+            )
+        if options['report']:
+            with open(options['report'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Report written to {options['report']}")
+        self.stdout.write(self.style.SUCCESS("All products processed successfully!"))
+
+    def add_rows(self, importer, downloader, rows):
+        images = downloader.fetch_all(url for _, _, _, image_urls, _ in rows for url in image_urls)
+        for title, fields, category_name, image_urls, fingerprints in rows:
+            # --- 4. Queue the product (first image is the main one); rows are written in bulk chunks keyed by title ---
+            files = [images[url] for url in image_urls if images.get(url)]
+            if fingerprints and len(files) < len(image_urls):
+                # Some downloads failed: don't record the URLs as synced, so the next sync fetches them again
+                fingerprints = (fingerprints[0], '')
+            importer.add(
+                title,
+                fields,
+                category=category_name,
+                main_image=files[0] if files else None,
+                images=files[1:],
+                fingerprints=fingerprints,
+            )
@@ -0,0 +1,78 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_onsiterepairbooking'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoreSettings',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('whatsapp_number', models.CharField(default='9641609686', max_length=15)),
+                ('site_name', models.CharField(default='EVWORX', max_length=100)),
+                ('support_email', models.EmailField(default='support@evworx.co.in', max_length=254)),
+                ('enquiry_number', models.CharField(default='1-800-EVWORX', help_text='Number for business enquiries', max_length=15)),
+                ('enquiry_email', models.EmailField(default='enquiry@evworx.co.in', help_text='Email for business enquiries', max_length=254)),
+            ],
+            options={
+                'verbose_name': 'Store Settings',
+                'verbose_name_plural': 'Store Settings',
+            },
+        ),
+        migrations.CreateModel(
+            name='WhatsAppQuery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('customer_name', models.CharField(max_length=255)),
+                ('phone', models.CharField(max_length=15)),
+                ('email', models.EmailField(blank=True, max_length=254, null=True)),
+                ('address', models.TextField()),
+                ('city', models.CharField(max_length=100)),
+                ('district', models.CharField(blank=True, max_length=100, null=True)),
+                ('state', models.CharField(blank=True, max_length=100, null=True)),
+                ('pincode', models.CharField(max_length=10)),
+                ('query_message', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('ACCEPT_AS_ORDER', 'Accepted as Order'), ('REJECTED', 'Rejected'), ('CUSTOMER_CONTACTED', 'Customer Contacted'), ('WAITING_PAYMENT', 'Waiting Payment'), ('CONFIRMED', 'Confirmed'), ('CANCELLED', 'Cancelled')], default='PENDING', max_length=20)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+            ],
+            options={
+                'verbose_name': 'WhatsApp Query',
+                'verbose_name_plural': 'WhatsApp Queries',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='onsiterepairbooking',
+            name='admin_notes',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='onsiterepairbooking',
+            name='status',
+            field=models.CharField(choices=[('Pending', 'Pending'), ('Accepted', 'Accepted'), ('Rejected', 'Rejected'), ('In Progress', 'In Progress'), ('Completed', 'Completed'), ('Cancelled', 'Cancelled')], default='Pending', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('Pending', 'Pending'), ('Accepted', 'Accepted'), ('Rejected', 'Rejected'), ('Shipped', 'Shipped'), ('Delivered', 'Delivered'), ('Cancelled', 'Cancelled')], default='Pending', max_length=20),
+        ),
+        migrations.CreateModel(
+            name='WhatsAppQueryItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('subtotal', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.product')),
+                ('query', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='core.whatsappquery')),
+            ],
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_product_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, help_text='Total of orders delivered on this day', max_digits=14)),
+                ('delivered_orders', models.IntegerField(default=0)),
+                ('orders_by_status', models.JSONField(blank=True, default=dict, help_text='Orders created on this day, by current status')),
+                ('repairs_by_vehicle_type', models.JSONField(blank=True, default=dict, help_text='Repair bookings created on this day, by vehicle type')),
+                ('new_customers', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Daily Sales Rollup',
+                'verbose_name_plural': 'Daily Sales Rollups',
+                'ordering': ['-date'],
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_dailysalesrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='brand',
+            name='logo_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text='Responsive WebP renditions (see core.tasks.generate_image_variants).'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text='Responsive WebP renditions (see core.tasks.generate_image_variants).'),
+        ),
+        migrations.AddField(
+            model_name='heroslider',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text='Responsive WebP renditions (see core.tasks.generate_image_variants).'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='main_image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text='Responsive WebP renditions (see core.tasks.generate_image_variants).'),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text='Responsive WebP renditions (see core.tasks.generate_image_variants).'),
+        ),
+    ]
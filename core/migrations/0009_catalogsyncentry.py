@@ -0,0 +1,32 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_mediablob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogSyncEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(help_text='Sheet the row comes from', max_length=255)),
+                ('key', models.CharField(help_text='Row key (e.g. product title)', max_length=255)),
+                ('fields_fingerprint', models.CharField(max_length=64)),
+                ('images_fingerprint', models.CharField(max_length=64)),
+                ('pruned', models.BooleanField(default=False, help_text='Row disappeared from the sheet and the product was marked out of stock')),
+                ('synced_at', models.DateTimeField(auto_now=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sync_entries', to='core.product')),
+            ],
+            options={
+                'verbose_name': 'Catalog Sync Entry',
+                'verbose_name_plural': 'Catalog Sync Entries',
+                'unique_together': {('source', 'key')},
+            },
+        ),
+    ]
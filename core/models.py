@@ -1,16 +1,33 @@
 from decimal import Decimal
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models, transaction
 from django.utils import timezone
 from django.utils.text import slugify
 
+from .slugs import save_with_unique_slug
+
+# ----------------- Stock errors -----------------
+class InsufficientStockError(ValidationError):
+    """Raised by Product.reserve_stock; ``failures`` holds one dict per short line."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        super().__init__([
+            f"Insufficient stock for '{line['title']}' (Available: {line['available']}, Requested: {line['requested']})"
+            for line in failures
+        ])
+
+
 # ----------------- Brand -----------------
 class Brand(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     logo = models.ImageField(upload_to='brands/', blank=True, null=True)
+    logo_variants = models.JSONField(default=dict, blank=True, editable=False, help_text='Responsive WebP renditions (see core.tasks.generate_image_variants).')
     name = models.CharField(max_length=100, db_index=True)
 
     def __str__(self):
@@ -36,6 +53,8 @@ class BulkDiscountTier(models.Model):
 # ----------------- Cart -----------------
 class Cart(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
+    # Last write from the cart store; carts untouched for long are deleted by cleanup_carts
+    updated_at = models.DateTimeField(auto_now=True)
     user = models.ForeignKey('User', on_delete=models.CASCADE, related_name='carts')
 
     def __str__(self):
@@ -53,15 +72,7 @@ class CartItem(models.Model):
         return f"{self.product.title} x{self.quantity}"
 
     def get_total_price(self):
-        price = self.product.price
-        quantity = self.quantity
-        bulk_discount = Decimal('0.0')
-        for tier in self.product.bulk_discounts.all():
-            if quantity >= tier.min_quantity:
-                bulk_discount = Decimal(tier.discount_percentage)
-                break
-        discounted_price = price * (Decimal('1.0') - bulk_discount / Decimal('100'))
-        return discounted_price * quantity
+        return (self.product.get_unit_price(self.quantity) * self.quantity).quantize(Decimal('0.01'))
 
 
 # ----------------- Category -----------------
@@ -70,6 +81,7 @@ class Category(models.Model):
     description = models.TextField(blank=True)
     name = models.CharField(max_length=100, unique=True)
     image = models.ImageField(upload_to='categories/', blank=True, null=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False, help_text='Responsive WebP renditions (see core.tasks.generate_image_variants).')
 
     class Meta:
         ordering = ['name']
@@ -129,6 +141,7 @@ class HeroSlider(models.Model):
     button_link = models.URLField(blank=True, null=True)
     background_color = models.CharField(max_length=50, default="bg-gradient-to-r from-blue-600 to-indigo-700")
     image = models.ImageField(upload_to="hero_slides/")
+    image_variants = models.JSONField(default=dict, blank=True, editable=False, help_text='Responsive WebP renditions (see core.tasks.generate_image_variants).')
     order = models.PositiveIntegerField(default=0, help_text="Slide order (0 = first)")
     active = models.BooleanField(default=True)
 
@@ -190,10 +203,13 @@ class Order(models.Model):
             return f"Order {self.id} ({self.delivery_address.full_name})"
         return f"Order {self.id} (Guest)"
 
-    def calculate_total(self, save=True):
+    def calculate_total(self, save=True, items=None):
+        # ``items`` lets checkout price unsaved in-memory OrderItems without re-reading them
+        if items is None:
+            items = self.items.select_related('product').all()
         subtotal = Decimal('0.00')
         gst = Decimal('0.00')
-        for item in self.items.select_related('product').all():
+        for item in items:
             item_subtotal = item.get_total_price()
             subtotal += item_subtotal
             # Calculate GST based on product's specific percentage
@@ -216,13 +232,13 @@ class Order(models.Model):
 
     def process_order(self):
         with transaction.atomic():
-            for item in self.items.select_related('product'):
-                product = item.product
-                if product.stock < item.quantity:
-                    raise ValidationError(f"Insufficient stock for '{product.title}' (Available: {product.stock}, Requested: {item.quantity})")
-                product.stock -= item.quantity
-                product.save()
-            self.calculate_total(save=True)
+            items = list(self.items.select_related('product'))
+            quantities = {}
+            for item in items:
+                quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+            # Raises InsufficientStockError (a ValidationError) naming every short line
+            Product.reserve_stock(quantities)
+            self.calculate_total(save=True, items=items)
 
 
 
@@ -273,10 +289,13 @@ class WhatsAppQuery(models.Model):
     def __str__(self):
         return f"Query {self.id} - {self.customer_name}"
 
-    def calculate_total(self):
-        total = sum(item.subtotal for item in self.items.all())
+    def calculate_total(self, save=True, items=None):
+        if items is None:
+            items = self.items.all()
+        total = sum((item.subtotal for item in items), Decimal('0.00'))
         self.total_amount = total
-        self.save()
+        if save:
+            self.save()
         return total
 
 
@@ -316,6 +335,7 @@ class Product(models.Model):
     discount_percentage = models.DecimalField(max_digits=5, decimal_places=2, default=0, validators=[MinValueValidator(0), MaxValueValidator(100)])
     is_out_of_stock_manual = models.BooleanField(default=False)
     main_image = models.ImageField(upload_to='products/', blank=True, null=True)
+    main_image_variants = models.JSONField(default=dict, blank=True, editable=False, help_text='Responsive WebP renditions (see core.tasks.generate_image_variants).')
     manufacturer = models.ForeignKey('Manufacturer', on_delete=models.SET_NULL, null=True, blank=True, related_name='products')
     mrp = models.DecimalField(max_digits=10, decimal_places=2)
     net_quantity = models.CharField(max_length=100, blank=True, null=True)
@@ -339,8 +359,17 @@ class Product(models.Model):
                                          help_text="GST percentage (default 18%)")
     moq = models.PositiveIntegerField(default=5, help_text="Minimum Order Quantity (default = 5). Can be adjusted per product.")
 
+    # Maintained by core.search.refresh_search_vectors (title, part number, HSN, brand, category, description)
+    search_vector = SearchVectorField(null=True, blank=True, editable=False)
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            GinIndex(fields=['search_vector'], name='product_search_vector_gin'),
+            # Keyset pagination for the price/name sort options (core.pagination)
+            models.Index(fields=['price', 'id'], name='product_price_id_idx'),
+            models.Index(fields=['title', 'id'], name='product_title_id_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -351,15 +380,54 @@ class Product(models.Model):
     def stock_status(self):
         return "Out of Stock" if self.is_out_of_stock() else "In Stock"
 
+    def get_bulk_discount(self, quantity):
+        # Tiers are ordered by -min_quantity, so the first match is the best one.
+        # Uses the prefetched tiers when loaded through core.pricing.
+        for tier in self.bulk_discounts.all():
+            if quantity >= tier.min_quantity:
+                return Decimal(tier.discount_percentage)
+        return Decimal('0.0')
+
+    @classmethod
+    def reserve_stock(cls, quantities):
+        """
+        Decrement stock for ``{product_id: quantity}`` with conditional
+        ``UPDATE ... SET stock = stock - n WHERE stock >= n`` statements, in
+        product id order so concurrent checkouts lock rows in the same order.
+        Only the ``stock`` column is written. If any line is short nothing is
+        reserved and InsufficientStockError reports every failing line.
+        """
+        from .catalog_cache import bump_catalog_generation
+
+        failed = {}
+        with transaction.atomic():
+            for product_id in sorted(quantities):
+                quantity = quantities[product_id]
+                reserved = cls.objects.filter(pk=product_id, stock__gte=quantity).update(stock=models.F('stock') - quantity)
+                if not reserved:
+                    failed[product_id] = quantity
+            if failed:
+                products = cls.objects.in_bulk(list(failed))
+                raise InsufficientStockError([
+                    {
+                        'product_id': product_id,
+                        'title': products[product_id].title if product_id in products else f"Product #{product_id}",
+                        'requested': quantity,
+                        'available': products[product_id].stock if product_id in products else 0,
+                    }
+                    for product_id, quantity in failed.items()
+                ])
+        # update() bypasses post_save, so invalidate cached catalog pages explicitly
+        transaction.on_commit(bump_catalog_generation)
+
+    def get_unit_price(self, quantity=1):
+        return self.price * (Decimal('1.0') - self.get_bulk_discount(quantity) / Decimal('100'))
+
     def save(self, *args, **kwargs):
         if not self.slug:
-            base_slug = slugify(self.title)
-            slug = base_slug
-            counter = 1
-            while Product.objects.filter(slug=slug).exists():
-                slug = f"{base_slug}-{counter}"
-                counter += 1
-            self.slug = slug
+            # One prefix query for the free suffix, retried if a concurrent save takes it
+            save_with_unique_slug(self, lambda: super(Product, self).save(*args, **kwargs), self.title)
+            return
         super().save(*args, **kwargs)
 
 
@@ -389,6 +457,7 @@ class MOQRule(models.Model):
 class ProductImage(models.Model):
     alt_text = models.CharField(max_length=255, blank=True)
     image = models.ImageField(upload_to='product_images/')
+    image_variants = models.JSONField(default=dict, blank=True, editable=False, help_text='Responsive WebP renditions (see core.tasks.generate_image_variants).')
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
 
     def __str__(self):
@@ -590,6 +659,75 @@ class OnSiteRepairBooking(models.Model):
         ordering = ['-created_at']
 
 
+# ----------------- Daily Sales Rollup -----------------
+class DailySalesRollup(models.Model):
+    """
+    Precomputed per-day figures for the staff dashboard. Kept current by
+    core.rollups from order/repair/user signals; rebuild with the
+    rebuild_sales_rollups command.
+    """
+    date = models.DateField(unique=True)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0, help_text="Total of orders delivered on this day")
+    delivered_orders = models.IntegerField(default=0)
+    orders_by_status = models.JSONField(default=dict, blank=True, help_text="Orders created on this day, by current status")
+    repairs_by_vehicle_type = models.JSONField(default=dict, blank=True, help_text="Repair bookings created on this day, by vehicle type")
+    new_customers = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-date']
+        verbose_name = "Daily Sales Rollup"
+        verbose_name_plural = "Daily Sales Rollups"
+
+    def __str__(self):
+        return f"Sales rollup {self.date}"
+
+
+# ----------------- Media Blob -----------------
+class MediaBlob(models.Model):
+    """
+    One file in the content-addressed media storage (core.storage), with the
+    number of field values referencing it and the derived files (WebP copy,
+    responsive renditions) already generated from its content.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    sha256 = models.CharField(max_length=64, db_index=True)
+    size = models.PositiveBigIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(default=0)
+    derivatives = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Media Blob"
+        verbose_name_plural = "Media Blobs"
+
+    def __str__(self):
+        return self.name
+
+
+# ----------------- Catalog Sync Entry -----------------
+class CatalogSyncEntry(models.Model):
+    """
+    Fingerprints of a sheet row as last imported by a sync (core.importing),
+    so the next sync only writes rows whose fields or image URLs changed.
+    """
+    source = models.CharField(max_length=255, help_text="Sheet the row comes from")
+    key = models.CharField(max_length=255, help_text="Row key (e.g. product title)")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='sync_entries')
+    fields_fingerprint = models.CharField(max_length=64)
+    images_fingerprint = models.CharField(max_length=64)
+    pruned = models.BooleanField(default=False, help_text="Row disappeared from the sheet and the product was marked out of stock")
+    synced_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('source', 'key')
+        verbose_name = "Catalog Sync Entry"
+        verbose_name_plural = "Catalog Sync Entries"
+
+    def __str__(self):
+        return f"{self.source}: {self.key}"
+
+
 # ----------------- Store Settings -----------------
 class StoreSettings(models.Model):
     whatsapp_number = models.CharField(max_length=15, default='9641609686')
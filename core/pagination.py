@@ -0,0 +1,255 @@
+"""
+Keyset (cursor) pagination for the product catalog and product API.
+
+Rows are fetched with ``WHERE (sort_key, id) > (last_sort_key, last_id)``
+instead of ``OFFSET``, so following next/previous links costs the same on
+page 500 as on page 1. Every ordering ends with ``id`` as a tiebreaker so
+the position is always unique. Total counts (for the page-number UI and the
+API ``count``) are cached briefly instead of running ``COUNT(*)`` per request.
+"""
+import base64
+import hashlib
+import json
+import math
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+# Sort options accepted by the catalog and the product API (?sort=...)
+PRODUCT_ORDERINGS = {
+    'price_asc': ('price', 'id'),
+    'price_desc': ('-price', '-id'),
+    'name_asc': ('title', 'id'),
+    'name_desc': ('-title', '-id'),
+}
+DEFAULT_PRODUCT_ORDERING = ('-id',)
+SEARCH_PRODUCT_ORDERING = ('-search_rank', '-id')
+
+COUNT_CACHE_TIMEOUT = 60 * 5
+
+
+def product_ordering(sort_option, searching=False):
+    if sort_option in PRODUCT_ORDERINGS:
+        return PRODUCT_ORDERINGS[sort_option]
+    return SEARCH_PRODUCT_ORDERING if searching else DEFAULT_PRODUCT_ORDERING
+
+
+def encode_cursor(values, reverse=False):
+    payload = json.dumps({'v': [str(v) if isinstance(v, Decimal) else v for v in values], 'r': reverse})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Returns (values, reverse); raises InvalidPage for a malformed cursor."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return list(payload['v']), bool(payload.get('r', False))
+    except (ValueError, TypeError, KeyError):
+        raise InvalidPage("Invalid cursor.")
+
+
+def _field_name(order):
+    return order.lstrip('-')
+
+
+def _reverse_ordering(ordering):
+    return tuple(_field_name(o) if o.startswith('-') else f"-{o}" for o in ordering)
+
+
+def keyset_filter(ordering, values):
+    """
+    Q object selecting rows strictly after ``values`` in ``ordering``, e.g. for
+    ('price', 'id'): price > p OR (price = p AND id > i).
+    """
+    condition = Q()
+    for i, order in enumerate(ordering):
+        lookup = 'lt' if order.startswith('-') else 'gt'
+        step = Q(**{_field_name(o): values[j] for j, o in enumerate(ordering[:i])})
+        step &= Q(**{f"{_field_name(order)}__{lookup}": values[i]})
+        condition |= step
+    return condition
+
+
+def cached_count(queryset, timeout=COUNT_CACHE_TIMEOUT):
+    """``queryset.count()`` cached per distinct query for a few minutes."""
+    sql, params = queryset.order_by().query.sql_with_params()
+    key = 'qs_count:' + hashlib.md5(f"{sql}{params}".encode()).hexdigest()
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
+
+
+class KeysetPaginator:
+    """
+    Paginates ``queryset`` by ``ordering`` (whose last field must be unique).
+    Sequential navigation uses cursors; jumping to a page number without a
+    cursor falls back to an offset query. ``count`` is cached, not exact.
+    """
+
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset.order_by(*ordering)
+        self.ordering = tuple(ordering)
+        self.per_page = per_page
+
+    @property
+    def count(self):
+        if not hasattr(self, '_count'):
+            self._count = cached_count(self.queryset)
+        return self._count
+
+    @property
+    def num_pages(self):
+        return max(1, math.ceil(self.count / self.per_page))
+
+    @property
+    def page_range(self):
+        return range(1, self.num_pages + 1)
+
+    def _position(self, obj):
+        return [getattr(obj, _field_name(order)) for order in self.ordering]
+
+    def page(self, cursor=None, number=1):
+        try:
+            number = max(1, int(number or 1))
+        except (TypeError, ValueError):
+            number = 1
+
+        if cursor:
+            values, reverse = decode_cursor(cursor)
+            if len(values) != len(self.ordering):
+                raise InvalidPage("Cursor does not match the current ordering.")
+            ordering = _reverse_ordering(self.ordering) if reverse else self.ordering
+            rows = list(self.queryset.filter(keyset_filter(ordering, values)).order_by(*ordering)[:self.per_page + 1])
+            has_more = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            if reverse:
+                rows.reverse()
+                has_previous, has_next = has_more, True
+            else:
+                has_previous, has_next = True, has_more
+        else:
+            offset = (number - 1) * self.per_page
+            rows = list(self.queryset[offset:offset + self.per_page + 1])
+            has_next = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            has_previous = number > 1
+
+        return KeysetPage(self, rows, number, has_previous, has_next)
+
+
+class KeysetPage:
+    """Page object compatible with the ``django.core.paginator.Page`` bits the templates use."""
+
+    def __init__(self, paginator, object_list, number, has_previous, has_next):
+        self.paginator = paginator
+        self.object_list = object_list
+        self.number = number
+        self._has_previous = has_previous
+        self._has_next = has_next and bool(object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_next(self):
+        return self._has_next
+
+    def has_other_pages(self):
+        return self._has_previous or self._has_next
+
+    def previous_page_number(self):
+        return max(1, self.number - 1)
+
+    def next_page_number(self):
+        return self.number + 1
+
+    @property
+    def previous_cursor(self):
+        if not self._has_previous or not self.object_list:
+            return None
+        return encode_cursor(self.paginator._position(self.object_list[0]), reverse=True)
+
+    @property
+    def next_cursor(self):
+        if not self._has_next:
+            return None
+        return encode_cursor(self.paginator._position(self.object_list[-1]))
+
+
+class ProductCursorPagination(BasePagination):
+    """
+    DRF pagination for ``/api/products/`` using ``?sort=`` (same options as
+    the catalog), ``?cursor=`` and ``?page_size=``.
+    """
+    page_size = 20
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        ordering = product_ordering(request.query_params.get('sort'))
+        self.paginator = KeysetPaginator(queryset, ordering, self.get_page_size(request))
+        try:
+            self.page = self.paginator.page(cursor=request.query_params.get(self.cursor_query_param))
+        except InvalidPage as exc:
+            raise NotFound(str(exc))
+        return list(self.page)
+
+    def _link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        return self._link(self.page.next_cursor)
+
+    def get_previous_link(self):
+        if not self.page.has_previous():
+            return None
+        cursor = self.page.previous_cursor
+        if cursor is None:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self._link(cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.paginator.count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'count': {'type': 'integer'},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,84 @@
+"""
+Cart pricing engine.
+
+Loads every product in a cart together with its bulk discount tiers in one
+prefetched query, then prices all lines (bulk discount, subtotal, GST) in a
+single pass. Cart pages, the cart API and checkout all reuse the resulting
+``CartPricing`` instead of pricing items one query at a time.
+"""
+from decimal import Decimal
+
+from django.db.models import Prefetch
+
+from .models import BulkDiscountTier, Product
+
+CENTS = Decimal('0.01')
+
+
+def bulk_discounts_prefetch(lookup='bulk_discounts'):
+    # Highest threshold first, which is what Product.get_bulk_discount expects
+    return Prefetch(lookup, queryset=BulkDiscountTier.objects.order_by('-min_quantity'))
+
+
+def load_cart_products(product_ids):
+    """Products for the given ids (with brand, category and discount tiers), keyed by id."""
+    products = (
+        Product.objects.filter(id__in=product_ids)
+        .select_related('brand', 'category')
+        .prefetch_related(bulk_discounts_prefetch())
+    )
+    return {product.id: product for product in products}
+
+
+class CartLine:
+    """One priced cart line. ``cart_item`` is the CartItem row for logged-in carts, else None."""
+
+    def __init__(self, product, quantity, cart_item=None):
+        self.product = product
+        self.quantity = quantity
+        self.cart_item = cart_item
+        self.discount_percentage = product.get_bulk_discount(quantity)
+        self.unit_price = product.get_unit_price(quantity)
+        self.subtotal = (self.unit_price * quantity).quantize(CENTS)
+        self.gst = (self.subtotal * product.gst_percentage / Decimal('100')).quantize(CENTS)
+
+    def get_total_price(self):
+        return self.subtotal
+
+
+class CartPricing:
+    """Priced cart: iterable of ``CartLine`` plus subtotal, GST and item count."""
+
+    def __init__(self, lines):
+        self.lines = list(lines)
+        self.subtotal = sum((line.subtotal for line in self.lines), Decimal('0.00'))
+        self.gst = sum((line.gst for line in self.lines), Decimal('0.00'))
+        self.total = self.subtotal + self.gst
+        self.item_count = sum(line.quantity for line in self.lines)
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __bool__(self):
+        return bool(self.lines)
+
+
+def price_cart_items(cart_items):
+    """Price a logged-in user's ``CartItem`` queryset (2 queries: items + discount tiers)."""
+    items = cart_items.select_related('product__brand', 'product__category').prefetch_related(
+        bulk_discounts_prefetch('product__bulk_discounts')
+    )
+    return CartPricing(CartLine(item.product, item.quantity, cart_item=item) for item in items)
+
+
+def price_quantities(quantities):
+    """Price a ``{product_id: quantity}`` mapping; unknown product ids are skipped."""
+    products = load_cart_products(quantities.keys())
+    return CartPricing(
+        CartLine(products[product_id], quantity)
+        for product_id, quantity in quantities.items()
+        if product_id in products
+    )
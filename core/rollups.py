@@ -0,0 +1,204 @@
+"""
+Incremental maintenance of ``DailySalesRollup`` rows.
+
+The signal handlers in core.signals pass each order, repair booking or user
+change here. Each change is turned into per-day deltas, and only the
+affected rows are updated. The attribution matches what the dashboard
+computed from live tables:
+
+* revenue / delivered_orders: delivered orders, by ``updated_at`` date
+* orders_by_status: orders by ``created_at`` date, bucketed by current status
+* repairs_by_vehicle_type: bookings by ``created_at`` date
+* new_customers: users by ``date_joined`` date
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailySalesRollup, OnSiteRepairBooking, Order, User
+
+DELIVERED = 'Delivered'
+
+
+def _day(value):
+    return timezone.localdate(value) if timezone.is_aware(value) else value.date()
+
+
+class RollupDelta:
+    """Accumulates changes per day so each affected row is written once."""
+
+    def __init__(self):
+        self.days = defaultdict(lambda: {
+            'revenue': Decimal('0.00'),
+            'delivered_orders': 0,
+            'orders_by_status': defaultdict(int),
+            'repairs_by_vehicle_type': defaultdict(int),
+            'new_customers': 0,
+        })
+
+    def add_order(self, sign, status, total_amount, created_at, updated_at):
+        # A save of a delivered order moves its revenue from the old updated_at day to the new one
+        self.days[_day(created_at)]['orders_by_status'][status] += sign
+        if status == DELIVERED:
+            day = self.days[_day(updated_at)]
+            day['revenue'] += sign * Decimal(total_amount or 0)
+            day['delivered_orders'] += sign
+
+    def add_repair(self, sign, vehicle_type, created_at):
+        self.days[_day(created_at)]['repairs_by_vehicle_type'][vehicle_type] += sign
+
+    def add_customer(self, sign, date_joined):
+        self.days[_day(date_joined)]['new_customers'] += sign
+
+    def apply(self):
+        changed = {date: delta for date, delta in self.days.items() if not _is_noop(delta)}
+        if not changed:
+            return
+        with transaction.atomic():
+            for date in sorted(changed):
+                delta = changed[date]
+                rollup, _ = DailySalesRollup.objects.select_for_update().get_or_create(date=date)
+                rollup.revenue += delta['revenue']
+                rollup.delivered_orders += delta['delivered_orders']
+                rollup.new_customers += delta['new_customers']
+                _merge_counts(rollup.orders_by_status, delta['orders_by_status'])
+                _merge_counts(rollup.repairs_by_vehicle_type, delta['repairs_by_vehicle_type'])
+                rollup.save()
+
+
+def _is_noop(delta):
+    return (
+        not delta['revenue'] and not delta['delivered_orders'] and not delta['new_customers']
+        and not any(delta['orders_by_status'].values())
+        and not any(delta['repairs_by_vehicle_type'].values())
+    )
+
+
+def _merge_counts(counts, delta):
+    for key, change in delta.items():
+        value = counts.get(key, 0) + change
+        if value:
+            counts[key] = value
+        else:
+            counts.pop(key, None)
+
+
+# ----------------- Signal entry points -----------------
+ORDER_ROLLUP_FIELDS = ('status', 'total_amount', 'created_at', 'updated_at')
+REPAIR_ROLLUP_FIELDS = ('vehicle_type', 'created_at')
+
+
+def record_order_change(previous, current):
+    """``previous``/``current`` are dicts of ORDER_ROLLUP_FIELDS, or None for create/delete."""
+    delta = RollupDelta()
+    if previous:
+        delta.add_order(-1, **previous)
+    if current:
+        delta.add_order(1, **current)
+    delta.apply()
+
+
+def record_repair_change(previous, current):
+    delta = RollupDelta()
+    if previous:
+        delta.add_repair(-1, **previous)
+    if current:
+        delta.add_repair(1, **current)
+    delta.apply()
+
+
+def record_customer_change(date_joined, sign):
+    delta = RollupDelta()
+    delta.add_customer(sign, date_joined)
+    delta.apply()
+
+
+# ----------------- Backfill -----------------
+def rebuild_daily_rollups(since=None):
+    """
+    Recompute rollup rows from the source tables (all days, or days >= ``since``)
+    with a few grouped queries. Returns the number of rows written.
+    """
+    rows = defaultdict(lambda: DailySalesRollup(orders_by_status={}, repairs_by_vehicle_type={}))
+
+    def in_range(queryset, field):
+        return queryset.filter(**{f"{field}__date__gte": since}) if since else queryset
+
+    delivered = in_range(Order.objects.filter(status=DELIVERED), 'updated_at')
+    for entry in delivered.annotate(day=TruncDate('updated_at')).values('day').annotate(revenue=Sum('total_amount'), count=Count('id')):
+        rows[entry['day']].revenue = entry['revenue'] or Decimal('0.00')
+        rows[entry['day']].delivered_orders = entry['count']
+
+    orders = in_range(Order.objects.all(), 'created_at')
+    for entry in orders.annotate(day=TruncDate('created_at')).values('day', 'status').annotate(count=Count('id')):
+        rows[entry['day']].orders_by_status[entry['status']] = entry['count']
+
+    repairs = in_range(OnSiteRepairBooking.objects.all(), 'created_at')
+    for entry in repairs.annotate(day=TruncDate('created_at')).values('day', 'vehicle_type').annotate(count=Count('id')):
+        rows[entry['day']].repairs_by_vehicle_type[entry['vehicle_type']] = entry['count']
+
+    users = in_range(User.objects.all(), 'date_joined')
+    for entry in users.annotate(day=TruncDate('date_joined')).values('day').annotate(count=Count('id')):
+        rows[entry['day']].new_customers = entry['count']
+
+    for day, row in rows.items():
+        row.date = day
+
+    with transaction.atomic():
+        existing = DailySalesRollup.objects.filter(date__gte=since) if since else DailySalesRollup.objects.all()
+        existing.delete()
+        DailySalesRollup.objects.bulk_create(rows.values(), batch_size=500)
+    return len(rows)
+
+
+# ----------------- Dashboard -----------------
+def _json_totals(column):
+    """``{key: total}`` of the per-day counts in the rollup JSON ``column``, summed by the database."""
+    quote = connection.ops.quote_name
+    table, column = quote(DailySalesRollup._meta.db_table), quote(column)
+    if connection.vendor == 'postgresql':
+        sql = f"SELECT e.key, SUM(e.value::integer) FROM {table}, jsonb_each_text({table}.{column}) AS e GROUP BY e.key"
+    else:
+        sql = f"SELECT e.key, SUM(e.value) FROM {table}, json_each({table}.{column}) AS e GROUP BY e.key"
+    with connection.cursor() as cursor:
+        cursor.execute(sql)
+        return {key: int(total) for key, total in cursor.fetchall()}
+
+
+def sales_summary(today):
+    """
+    Dashboard sales figures aggregated in SQL over the rollup table: revenue
+    totals and growth and the 7-day trend in one query, plus one grouped query
+    each for the order status and repair type breakdowns.
+    """
+    seven_days_ago = today - timedelta(days=7)
+    prev_7_start = today - timedelta(days=14)
+    trend_days = [today - timedelta(days=i) for i in range(6, -1, -1)]
+
+    totals = DailySalesRollup.objects.aggregate(
+        total_revenue=Sum('revenue'),
+        today_revenue=Sum('revenue', filter=Q(date=today)),
+        last_7_revenue=Sum('revenue', filter=Q(date__gte=seven_days_ago)),
+        prev_7_revenue=Sum('revenue', filter=Q(date__gte=prev_7_start, date__lt=seven_days_ago)),
+        delivered_orders=Sum('delivered_orders'),
+        new_customers_week=Sum('new_customers', filter=Q(date__gte=seven_days_ago)),
+        **{f"trend_{i}": Sum('revenue', filter=Q(date=day)) for i, day in enumerate(trend_days)},
+    )
+    summary = {
+        name: totals[name] or Decimal('0.00')
+        for name in ('total_revenue', 'today_revenue', 'last_7_revenue', 'prev_7_revenue')
+    }
+    summary['delivered_orders'] = totals['delivered_orders'] or 0
+    summary['new_customers_week'] = totals['new_customers_week'] or 0
+    summary['sales_trend'] = [(day, totals[f"trend_{i}"] or Decimal('0.00')) for i, day in enumerate(trend_days)]
+
+    summary['order_status_counts'] = [(s, c) for s, c in _json_totals('orders_by_status').items() if c]
+    summary['repair_type_counts'] = sorted(
+        ((t, c) for t, c in _json_totals('repairs_by_vehicle_type').items() if c), key=lambda item: -item[1]
+    )
+    return summary
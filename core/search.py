@@ -0,0 +1,99 @@
+"""
+Full-text product search.
+
+Each product carries a precomputed ``search_vector`` built from its title,
+part number, HSN code, brand, category and description. The vector is
+refreshed with a single UPDATE whenever a product (or the brand/category it
+belongs to) is saved, and by the ``rebuild_search_index`` command after bulk
+imports. Search falls back to plain ``icontains`` matching on databases other
+than PostgreSQL (e.g. a local SQLite setup).
+"""
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connections
+from django.db.models import Case, F, FloatField, OuterRef, Q, Subquery, Value, When
+
+from .models import Brand, Category, Product
+
+# Language config for titles/descriptions; part and HSN codes use 'simple' so they are not stemmed.
+SEARCH_CONFIG = 'english'
+
+# Rank given to an exact part number hit so it always sorts first.
+EXACT_PART_NUMBER_RANK = 10.0
+
+
+def is_search_supported(using='default'):
+    return connections[using].vendor == 'postgresql'
+
+
+def product_search_vector():
+    """Expression that computes ``Product.search_vector`` for the row being updated."""
+    brand_name = Subquery(Brand.objects.filter(pk=OuterRef('brand_id')).values('name')[:1])
+    category_name = Subquery(Category.objects.filter(pk=OuterRef('category_id')).values('name')[:1])
+    return (
+        SearchVector('title', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('part_number', weight='A', config='simple')
+        + SearchVector('hsn_code', weight='B', config='simple')
+        + SearchVector(brand_name, category_name, weight='B', config=SEARCH_CONFIG)
+        + SearchVector('description', weight='D', config=SEARCH_CONFIG)
+    )
+
+
+def refresh_search_vectors(product_ids=None, using='default'):
+    """
+    Recompute the search vector for the given product ids (a list or a
+    ``values_list`` queryset; all products if None) in one UPDATE statement.
+    Returns the number of rows updated.
+    """
+    if not is_search_supported(using):
+        return 0
+    products = Product.objects.using(using)
+    if product_ids is not None:
+        products = products.filter(pk__in=product_ids)
+    return products.update(search_vector=product_search_vector())
+
+
+def _prefix_query(query):
+    # 'brake pa' -> 'brake:* & pa:*' so partially typed words and part numbers still match
+    terms = re.findall(r'\w+', query.lower())
+    return ' & '.join(f"{term}:*" for term in terms)
+
+
+def search_products(queryset, query):
+    """
+    Filter ``queryset`` to products matching ``query`` and annotate each with
+    ``search_rank``. The queryset is ordered best match first.
+    """
+    query = (query or '').strip()
+    if not query:
+        return queryset
+
+    exact_part = Case(
+        When(part_number__iexact=query, then=Value(EXACT_PART_NUMBER_RANK)),
+        default=Value(0.0),
+        output_field=FloatField(),
+    )
+
+    if not is_search_supported(queryset.db):
+        matches = (
+            Q(title__icontains=query)
+            | Q(part_number__icontains=query)
+            | Q(hsn_code__icontains=query)
+            | Q(brand__name__icontains=query)
+            | Q(category__name__icontains=query)
+            | Q(description__icontains=query)
+        )
+        return queryset.filter(matches).annotate(search_rank=exact_part).order_by('-search_rank', '-id')
+
+    search_query = SearchQuery(query, search_type='websearch', config=SEARCH_CONFIG)
+    prefix = _prefix_query(query)
+    if prefix:
+        search_query |= SearchQuery(prefix, search_type='raw', config='simple')
+
+    return (
+        queryset
+        .filter(Q(search_vector=search_query) | Q(part_number__iexact=query))
+        .annotate(search_rank=SearchRank(F('search_vector'), search_query) + exact_part)
+        .order_by('-search_rank', '-id')
+    )
@@ -1,5 +1,41 @@
 from rest_framework import serializers
-from .models import User, Vehicle, VehicleType, Brand, Product, Cart, CartItem, Order, OrderItem, Wishlist, Review, Coupon
+from .models import User, Vehicle, VehicleModel, VehicleType, Brand, Product, Cart, CartItem, Order, OrderItem, Wishlist, Review, Coupon, BulkDiscountTier
+
+
+class SparseFieldsMixin:
+    """
+    ``fields=[...]`` limits the serializer to those fields (views pass it from
+    ``?fields=``), and ``optimize_queryset()`` eager-loads exactly what the
+    remaining fields read: nested serializers and FK fields are joined, many
+    relations prefetched, and only the needed columns selected.
+    """
+    # Columns always loaded (keyset pagination reads the sort keys)
+    always_load = ('id',)
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    def optimize_queryset(self, queryset):
+        model_fields = {field.name: field for field in queryset.model._meta.get_fields()}
+        columns = set(self.always_load)
+        for field in self.fields.values():
+            source = field.source.split('.')[0]
+            model_field = model_fields.get(source)
+            if model_field is None:
+                continue
+            if isinstance(field, (serializers.ListSerializer, serializers.ManyRelatedField)) or model_field.one_to_many:
+                queryset = queryset.prefetch_related(source)
+                continue
+            if isinstance(field, serializers.BaseSerializer):
+                queryset = queryset.select_related(source)
+            if model_field.concrete:
+                columns.add(source)
+        return queryset.only(*columns)
+
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -16,19 +52,33 @@ class BrandSerializer(serializers.ModelSerializer):
         model = Brand
         fields = ['id', 'name', 'logo']
 
+class VehicleModelSerializer(serializers.ModelSerializer):
+    brand = BrandSerializer(read_only=True)
+    type = VehicleTypeSerializer(read_only=True)
+    class Meta:
+        model = VehicleModel
+        fields = ['id', 'name', 'brand', 'type']
+
 class VehicleSerializer(serializers.ModelSerializer):
-    brand = BrandSerializer()
-    type = VehicleTypeSerializer()
+    model_detail = VehicleModelSerializer(source='model', read_only=True)
     class Meta:
         model = Vehicle
-        fields = ['id', 'user', 'brand', 'model', 'year', 'type', 'created_at']
+        fields = ['id', 'user', 'model', 'model_detail', 'year', 'created_at']
 
-class ProductSerializer(serializers.ModelSerializer):
+class BulkDiscountTierSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = BulkDiscountTier
+        fields = ['min_quantity', 'discount_percentage']
+
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     compatible_vehicle_types = VehicleTypeSerializer(many=True)
     brand = BrandSerializer()
+    bulk_discounts = BulkDiscountTierSerializer(many=True, read_only=True)
+    always_load = ('id', 'price', 'title')
+
     class Meta:
         model = Product
-        fields = ['id', 'title', 'description', 'image', 'brand', 'category', 'compatible_vehicle_types', 'price', 'discount_percentage', 'bulk_discount_10', 'bulk_discount_100', 'stock', 'created_at']
+        fields = ['id', 'title', 'slug', 'description', 'main_image', 'brand', 'category', 'compatible_vehicle_types', 'price', 'mrp', 'discount_percentage', 'bulk_discounts', 'stock', 'created_at']
 
 class CouponSerializer(serializers.ModelSerializer):
     class Meta:
@@ -1,62 +1,65 @@
-from django.shortcuts import get_object_or_404
-from .models import Product, Cart, CartItem, Order, OrderItem
 from decimal import Decimal
+from django.db import transaction
+from django.shortcuts import get_object_or_404
+from . import cart_store
+from .models import Product, Order, OrderItem, DeliveryAddress, WhatsAppQuery, WhatsAppQueryItem
+from .pricing import CartLine, CartPricing, load_cart_products, price_quantities
+from .tasks import enqueue_cart_persist
+
+CART_ACTIONS = ('add', 'update', 'delete')
+MAX_CART_OPERATIONS = 50
 
 class CartService:
+    """
+    Cart operations for logged-in users and guests alike. Carts are read and
+    written through the cart store (core.cart_store); logged-in carts are
+    written back to Cart/CartItem rows in the background.
+    """
+
     @staticmethod
     def get_cart(request):
+        """The visitor's cart as ``{product_id: quantity}``."""
+        return cart_store.load_cart(cart_store.request_cart_id(request))
+
+    @staticmethod
+    def _changed(request):
         if request.user.is_authenticated:
-            cart, _ = Cart.objects.get_or_create(user=request.user)
-            return cart
-        return request.session.get('cart', {})
+            enqueue_cart_persist(request.user.pk)
 
     @staticmethod
-    def add_to_cart(request, product_id, quantity, cart=None):
+    def add_to_cart(request, product_id, quantity):
         product = get_object_or_404(Product, id=product_id)
         
         # Enforce MOQ
         if quantity < product.moq:
             quantity = product.moq
 
-        if product.is_out_of_stock() or product.stock < quantity:
+        cart_id = cart_store.request_cart_id(request, create=True)
+        in_cart = cart_store.load_cart(cart_id).get(product.id, 0)
+        if product.is_out_of_stock() or product.stock < in_cart + quantity:
             return False, f"Insufficient stock. Available: {product.stock}"
 
-        if request.user.is_authenticated:
-            if not cart:
-                cart, _ = Cart.objects.get_or_create(user=request.user)
-            cart_item, created = CartItem.objects.get_or_create(cart=cart, product=product)
-            if not created:
-                cart_item.quantity += quantity
-            else:
-                cart_item.quantity = quantity
-            cart_item.save()
-        else:
-            session_cart = request.session.get('cart', {})
-            session_cart[str(product_id)] = session_cart.get(str(product_id), 0) + quantity
-            request.session['cart'] = session_cart
-            request.session.modified = True
-        
+        cart_store.add_line(cart_id, product.id, quantity)
+        CartService._changed(request)
         return True, "Item added to cart."
 
     @staticmethod
-    def remove_from_cart(request, product_id, cart=None):
-        if request.user.is_authenticated:
-            if not cart:
-                cart = Cart.objects.filter(user=request.user).first()
-            if cart:
-                CartItem.objects.filter(cart=cart, product_id=product_id).delete()
-        else:
-            session_cart = request.session.get('cart', {})
-            session_cart.pop(str(product_id), None)
-            request.session['cart'] = session_cart
-            request.session.modified = True
+    def remove_from_cart(request, product_id):
+        cart_id = cart_store.request_cart_id(request)
+        try:
+            product_id = int(product_id)
+        except (TypeError, ValueError):
+            return
+        if cart_id is not None and product_id in cart_store.load_cart(cart_id):
+            cart_store.save_lines(cart_id, {product_id: 0})
+            CartService._changed(request)
 
     @staticmethod
-    def update_cart_quantity(request, product_id, quantity, cart=None):
+    def update_cart_quantity(request, product_id, quantity):
         product = get_object_or_404(Product, id=product_id)
         
         if quantity < 1:
-            CartService.remove_from_cart(request, product_id, cart)
+            CartService.remove_from_cart(request, product.id)
             return True, "Item removed."
 
         # Enforce MOQ
@@ -66,63 +69,150 @@ class CartService:
         if product.stock < quantity:
             return False, f"Insufficient stock. Available: {product.stock}"
 
-        if request.user.is_authenticated:
-            if not cart:
-                cart = Cart.objects.filter(user=request.user).first()
-            if cart:
-                cart_item = CartItem.objects.filter(cart=cart, product_id=product_id).first()
-                if cart_item:
-                    cart_item.quantity = quantity
-                    cart_item.save()
-        else:
-            session_cart = request.session.get('cart', {})
-            session_cart[str(product_id)] = quantity
-            request.session['cart'] = session_cart
-            request.session.modified = True
+        cart_id = cart_store.request_cart_id(request, create=True)
+        cart_store.load_cart(cart_id)
+        cart_store.save_lines(cart_id, {product.id: quantity})
+        CartService._changed(request)
         
         return True, "Cart updated."
 
+    @staticmethod
+    def apply_operations(request, operations):
+        """
+        Apply a list of ``(action, product_id, quantity)`` cart edits at once.
+
+        Every product involved (and already in the cart) is loaded in one query
+        and each operation is checked in order against the running quantities,
+        with the same MOQ/stock rules as the single-item methods. Nothing is
+        written unless all of them pass; then the changed lines are written to
+        the cart store in one round trip. Returns ``(errors, pricing)``: errors
+        are ``(index, message)`` pairs, and pricing is the resulting cart (the
+        unchanged one on error), priced from the loaded products without
+        re-reading it.
+        """
+        cart_id = cart_store.request_cart_id(request, create=True)
+        current = cart_store.load_cart(cart_id)
+        products = load_cart_products({product_id for _, product_id, _ in operations} | set(current))
+        initial = {pid: qty for pid, qty in current.items() if pid in products and qty > 0}
+        quantities = dict(initial)
+        errors = []
+        for index, (action, product_id, quantity) in enumerate(operations):
+            product = products.get(product_id)
+            if action == 'delete':
+                quantities.pop(product_id, None)
+                continue
+            if product is None:
+                errors.append((index, "Product not found."))
+                continue
+            if action == 'update' and quantity < 1:
+                quantities.pop(product_id, None)
+                continue
+            if action == 'add':
+                quantity = quantities.get(product_id, 0) + max(quantity, product.moq)
+            elif quantity < product.moq:
+                errors.append((index, f"Minimum order quantity for {product.title} is {product.moq}."))
+                continue
+            if product.is_out_of_stock() or product.stock < quantity:
+                errors.append((index, f"Insufficient stock for {product.title}. Available: {product.stock}"))
+                continue
+            quantities[product_id] = quantity
+
+        if errors:
+            quantities = initial
+        else:
+            # Lines of deleted products are dropped along the way
+            changes = {
+                pid: quantities.get(pid, 0)
+                for pid in set(current) | set(quantities)
+                if current.get(pid) != quantities.get(pid)
+            }
+            if changes:
+                cart_store.save_lines(cart_id, changes)
+                CartService._changed(request)
+
+        return errors, CartPricing(CartLine(products[pid], qty) for pid, qty in quantities.items())
+
+    @staticmethod
+    def merge_guest_cart(request, user):
+        """Add the session's guest cart to ``user``'s cart (on login)."""
+        guest = cart_store.take_guest_cart(request.session)
+        if not guest:
+            return
+        cart_id = cart_store.user_cart_id(user.pk)
+        quantities = cart_store.load_cart(cart_id)
+        cart_store.save_lines(cart_id, {pid: quantities.get(pid, 0) + qty for pid, qty in guest.items()})
+        enqueue_cart_persist(user.pk)
+
+    @staticmethod
+    def clear_cart(request):
+        """Empty the visitor's stored cart (logged-in carts: delete the rows in the same request)."""
+        cart_store.discard_cart(cart_store.request_cart_id(request))
+
+    @staticmethod
+    def get_cart_pricing(request):
+        """Priced cart for the current user or guest session (see core.pricing)."""
+        cart_id = cart_store.request_cart_id(request)
+        quantities = cart_store.load_cart(cart_id)
+
+        # One id__in query for every line; lines whose product no longer exists are dropped
+        pricing = price_quantities({pid: qty for pid, qty in quantities.items() if qty > 0})
+
+        # Prune stale entries from the stored cart in the same pass
+        stale = {pid: 0 for pid in set(quantities) - {line.product.id for line in pricing}}
+        if stale:
+            cart_store.save_lines(cart_id, stale)
+            CartService._changed(request)
+        return pricing
+
     @staticmethod
     def get_cart_items_and_total(request):
-        cart_items = []
-        total_price = Decimal('0.00')
+        pricing = CartService.get_cart_pricing(request)
+        return pricing.lines, pricing.subtotal
 
-        if request.user.is_authenticated:
-            cart, _ = Cart.objects.get_or_create(user=request.user)
-            items = cart.items.select_related('product__brand', 'product__category').all()
-            total_price = sum(item.get_total_price() for item in items)
-            cart_items = items
-        else:
-            session_cart = request.session.get('cart', {})
-            for pid, qty in session_cart.items():
-                try:
-                    product = Product.objects.get(id=int(pid))
-                    subtotal = product.price * qty
-                    total_price += subtotal
-                    cart_items.append({
-                        'product': product,
-                        'quantity': qty,
-                        'subtotal': subtotal
-                    })
-                except (Product.DoesNotExist, ValueError):
-                    continue
-        
-        return cart_items, total_price
+
+def save_order_with_items(order, items):
+    """
+    Insert ``order`` and its unsaved ``OrderItem`` objects in one transaction.
+    Totals are computed from the in-memory items, so the order is written once
+    and the items in a single bulk INSERT, whatever the cart size.
+    """
+    with transaction.atomic():
+        order.calculate_total(save=False, items=items)
+        order.save()
+        for item in items:
+            item.order = order
+        OrderItem.objects.bulk_create(items)
+    return order
+
+
+def save_query_with_items(query, items):
+    """Same as ``save_order_with_items`` for a WhatsAppQuery and its items."""
+    for item in items:
+        # bulk_create skips WhatsAppQueryItem.save(), which normally sets the subtotal
+        item.subtotal = Decimal(str(item.price)) * item.quantity
+    with transaction.atomic():
+        query.calculate_total(save=False, items=items)
+        query.save()
+        for item in items:
+            item.query = query
+        WhatsAppQueryItem.objects.bulk_create(items)
+    return query
 
 
 def convert_query_to_order(query_id):
-    from .models import Order, OrderItem, DeliveryAddress, WhatsAppQuery
-    from django.db import transaction
-    
     query = WhatsAppQuery.objects.get(id=query_id)
+    items = [
+        OrderItem(product=item.product, quantity=item.quantity, price=item.price)
+        for item in query.items.select_related('product')
+    ]
 
     with transaction.atomic():
-        # 1. Create Order
-        order = Order.objects.create(
+        # 1. Create Order with its items (totals incl. GST computed in memory)
+        order = Order(
             user=None,  # Inquiries are typically treated as guest orders until linked
             status='Pending',
-            total_amount=query.total_amount
         )
+        save_order_with_items(order, items)
 
         # 2. Copy customer info to DeliveryAddress
         DeliveryAddress.objects.create(
@@ -138,20 +228,8 @@ def convert_query_to_order(query_id):
             verified=True
         )
 
-        # 3. Copy query items to OrderItems
-        for item in query.items.all():
-            OrderItem.objects.create(
-                order=order,
-                product=item.product,
-                quantity=item.quantity,
-                price=item.price
-            )
-        
-        # 4. Recalculate total (handles GST and other model logic)
-        order.calculate_total(save=True)
-
-        # 5. Mark query as accepted
+        # 3. Mark query as accepted
         query.status = 'ACCEPT_AS_ORDER'
-        query.save()
+        query.save(update_fields=['status'])
 
         return order
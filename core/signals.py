@@ -1,59 +1,200 @@
-from django.db.models.signals import pre_save
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+from django.db import transaction
 from django.dispatch import receiver
-from .models import Brand, Category, HeroSlider, Product, ProductImage, BlogPost, WebsiteLogo, Favicon
-from .utils.image_utils import convert_to_webp
-import os
-
-def handle_image_conversion(instance, field_name):
-    image_field = getattr(instance, field_name)
-    if not image_field:
-        return
-
-    # Check if a new file is being uploaded or if the file has changed
-    try:
-        if instance.pk:
-            old_instance = instance.__class__.objects.get(pk=instance.pk)
-            old_file = getattr(old_instance, field_name)
-            if old_file and old_file.name == image_field.name:
-                return # File hasn't changed
-    except instance.__class__.DoesNotExist:
-        pass # New instance
-
-    # Only convert if not already WebP
-    if not image_field.name.lower().endswith('.webp'):
-        webp_file = convert_to_webp(image_field)
-        if webp_file:
-            # Set the new file to the field
-            getattr(instance, field_name).save(webp_file.name, webp_file, save=False)
-
-@receiver(pre_save, sender=Brand)
-def convert_brand_logo(sender, instance, **kwargs):
-    handle_image_conversion(instance, 'logo')
-
-@receiver(pre_save, sender=Category)
-def convert_category_image(sender, instance, **kwargs):
-    handle_image_conversion(instance, 'image')
-
-@receiver(pre_save, sender=HeroSlider)
-def convert_heroslider_image(sender, instance, **kwargs):
-    handle_image_conversion(instance, 'image')
-
-@receiver(pre_save, sender=Product)
-def convert_product_main_image(sender, instance, **kwargs):
-    handle_image_conversion(instance, 'main_image')
-
-@receiver(pre_save, sender=ProductImage)
-def convert_product_image(sender, instance, **kwargs):
-    handle_image_conversion(instance, 'image')
-
-@receiver(pre_save, sender=BlogPost)
-def convert_blog_image(sender, instance, **kwargs):
-    handle_image_conversion(instance, 'image')
-
-@receiver(pre_save, sender=WebsiteLogo)
-def convert_websitelogo_image(sender, instance, **kwargs):
-    handle_image_conversion(instance, 'logo_image')
-
-@receiver(pre_save, sender=Favicon)
-def convert_favicon_image(sender, instance, **kwargs):
-    handle_image_conversion(instance, 'icon')
+from django.utils import timezone
+from .models import (
+    Brand, Category, HeroSlider, Product, ProductImage, BlogPost, WebsiteLogo, Favicon,
+    Order, OnSiteRepairBooking, User, StoreSettings, BulkDiscountTier, Review
+)
+from . import fitment, rollups
+from .catalog_cache import bump_catalog_generation
+from .search import refresh_search_vectors
+from .services import CartService
+from .site_context import invalidate_site_context
+from .tasks import enqueue_image_variants, enqueue_webp_conversion
+
+def handle_image_conversion(instance, field_name, raw=False):
+    # Conversion and resizing run in Celery tasks after commit, so saves don't wait on Pillow
+    if not raw:
+        enqueue_webp_conversion(instance, field_name)
+        enqueue_image_variants(instance, field_name)
+
+@receiver(post_save, sender=Brand)
+def convert_brand_logo(sender, instance, raw=False, **kwargs):
+    handle_image_conversion(instance, 'logo', raw)
+
+@receiver(post_save, sender=Category)
+def convert_category_image(sender, instance, raw=False, **kwargs):
+    handle_image_conversion(instance, 'image', raw)
+
+@receiver(post_save, sender=HeroSlider)
+def convert_heroslider_image(sender, instance, raw=False, **kwargs):
+    handle_image_conversion(instance, 'image', raw)
+
+@receiver(post_save, sender=Product)
+def convert_product_main_image(sender, instance, raw=False, **kwargs):
+    handle_image_conversion(instance, 'main_image', raw)
+
+@receiver(post_save, sender=ProductImage)
+def convert_product_image(sender, instance, raw=False, **kwargs):
+    handle_image_conversion(instance, 'image', raw)
+
+@receiver(post_save, sender=BlogPost)
+def convert_blog_image(sender, instance, raw=False, **kwargs):
+    handle_image_conversion(instance, 'image', raw)
+
+@receiver(post_save, sender=WebsiteLogo)
+def convert_websitelogo_image(sender, instance, raw=False, **kwargs):
+    handle_image_conversion(instance, 'logo_image', raw)
+
+@receiver(post_save, sender=Favicon)
+def convert_favicon_image(sender, instance, raw=False, **kwargs):
+    handle_image_conversion(instance, 'icon', raw)
+
+
+# ----------------- Search index -----------------
+SEARCHABLE_PRODUCT_FIELDS = {'title', 'part_number', 'hsn_code', 'brand', 'category', 'description'}
+
+@receiver(post_save, sender=Product)
+def update_product_search_vector(sender, instance, update_fields=None, raw=False, **kwargs):
+    if raw:
+        return
+    if update_fields is not None and not SEARCHABLE_PRODUCT_FIELDS.intersection(update_fields):
+        return
+    refresh_search_vectors([instance.pk])
+
+@receiver(post_save, sender=Brand)
+def update_brand_products_search_vector(sender, instance, created=False, raw=False, **kwargs):
+    if raw or created:
+        return
+    refresh_search_vectors(instance.products.values_list('pk', flat=True))
+
+@receiver(post_save, sender=Category)
+def update_category_products_search_vector(sender, instance, created=False, raw=False, **kwargs):
+    if raw or created:
+        return
+    refresh_search_vectors(instance.products.values_list('pk', flat=True))
+
+
+# ----------------- Catalog cache -----------------
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductImage)
+@receiver([post_save, post_delete], sender=BulkDiscountTier)
+@receiver([post_save, post_delete], sender=Brand)
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_catalog_cache(sender, **kwargs):
+    # After commit, so a concurrent request can't re-cache pre-commit data under the new generation
+    transaction.on_commit(bump_catalog_generation)
+
+@receiver([post_save, post_delete], sender=Review)
+def invalidate_reviewed_product(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # The product page lists its reviews: move its Last-Modified and ETag along
+    def touch():
+        Product.objects.filter(pk=instance.product_id).update(updated_at=timezone.now())
+        bump_catalog_generation()
+    transaction.on_commit(touch)
+
+
+# ----------------- Vehicle fitment index -----------------
+def update_fitment_index(kind, instance, action, reverse, pk_set):
+    through, column = fitment.FITMENT_RELATIONS[kind]
+    # Forward: instance is the Product and pk_set holds vehicle type/model ids; reverse: instance is the vehicle
+    if action == 'pre_clear' and not reverse:
+        # post_clear carries no ids, so note the vehicles about to lose this product
+        rows = through.objects.filter(product_id=instance.pk)
+        instance._fitment_cleared = list(rows.values_list(column, flat=True))
+        return
+    if action == 'post_clear':
+        vehicle_ids = [instance.pk] if reverse else instance.__dict__.pop('_fitment_cleared', [])
+    elif action in ('post_add', 'post_remove') and pk_set:
+        vehicle_ids = [instance.pk] if reverse else list(pk_set)
+    else:
+        return
+
+    if vehicle_ids:
+        transaction.on_commit(lambda: fitment.apply_fitment_change(kind, vehicle_ids))
+        transaction.on_commit(bump_catalog_generation)
+
+@receiver(m2m_changed, sender=Product.compatible_vehicle_types.through)
+def update_vehicle_type_fitment(sender, instance, action, reverse, pk_set, **kwargs):
+    update_fitment_index('type', instance, action, reverse, pk_set)
+
+@receiver(m2m_changed, sender=Product.compatible_vehicle_models.through)
+def update_vehicle_model_fitment(sender, instance, action, reverse, pk_set, **kwargs):
+    update_fitment_index('model', instance, action, reverse, pk_set)
+
+
+# ----------------- Dashboard rollups -----------------
+def _stored_values(instance, fields):
+    if not instance.pk:
+        return None
+    return instance.__class__.objects.filter(pk=instance.pk).values(*fields).first()
+
+def _current_values(instance, fields):
+    return {field: getattr(instance, field) for field in fields}
+
+@receiver(pre_save, sender=Order)
+def snapshot_order_for_rollup(sender, instance, raw=False, **kwargs):
+    instance._rollup_previous = None if raw else _stored_values(instance, rollups.ORDER_ROLLUP_FIELDS)
+
+@receiver(post_save, sender=Order)
+def update_order_rollup(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous, current = instance._rollup_previous, _current_values(instance, rollups.ORDER_ROLLUP_FIELDS)
+    # Applied after commit in its own short transaction so checkouts don't queue on the day's row
+    transaction.on_commit(lambda: rollups.record_order_change(previous, current))
+
+@receiver(post_delete, sender=Order)
+def remove_order_from_rollup(sender, instance, **kwargs):
+    previous = _current_values(instance, rollups.ORDER_ROLLUP_FIELDS)
+    transaction.on_commit(lambda: rollups.record_order_change(previous, None))
+
+@receiver(pre_save, sender=OnSiteRepairBooking)
+def snapshot_repair_for_rollup(sender, instance, raw=False, **kwargs):
+    instance._rollup_previous = None if raw else _stored_values(instance, rollups.REPAIR_ROLLUP_FIELDS)
+
+@receiver(post_save, sender=OnSiteRepairBooking)
+def update_repair_rollup(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous, current = instance._rollup_previous, _current_values(instance, rollups.REPAIR_ROLLUP_FIELDS)
+    transaction.on_commit(lambda: rollups.record_repair_change(previous, current))
+
+@receiver(post_delete, sender=OnSiteRepairBooking)
+def remove_repair_from_rollup(sender, instance, **kwargs):
+    previous = _current_values(instance, rollups.REPAIR_ROLLUP_FIELDS)
+    transaction.on_commit(lambda: rollups.record_repair_change(previous, None))
+
+@receiver(post_save, sender=User)
+def count_new_customer(sender, instance, created=False, raw=False, **kwargs):
+    if created and not raw:
+        date_joined = instance.date_joined
+        transaction.on_commit(lambda: rollups.record_customer_change(date_joined, 1))
+
+@receiver(post_delete, sender=User)
+def uncount_customer(sender, instance, **kwargs):
+    date_joined = instance.date_joined
+    transaction.on_commit(lambda: rollups.record_customer_change(date_joined, -1))
+
+
+# ----------------- Site-wide template context -----------------
+@receiver([post_save, post_delete], sender=WebsiteLogo)
+@receiver([post_save, post_delete], sender=Favicon)
+@receiver([post_save, post_delete], sender=StoreSettings)
+def invalidate_site_context_cache(sender, **kwargs):
+    invalidate_site_context()
+    # Again after commit, in case another request re-cached the old rows in between
+    transaction.on_commit(invalidate_site_context)
+    # Every page shows the logo and store settings, so their ETags must change too
+    transaction.on_commit(bump_catalog_generation)
+
+
+# ----------------- Cart store -----------------
+@receiver(user_logged_in)
+def merge_guest_cart(sender, request, user, **kwargs):
+    if request is not None and hasattr(request, 'session'):
+        CartService.merge_guest_cart(request, user)
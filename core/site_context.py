@@ -0,0 +1,53 @@
+"""
+Two-tier cache for the site-wide rows every page renders (active logo,
+favicon, store settings).
+
+Tier one is a per-process copy kept for ``LOCAL_TIMEOUT`` seconds; tier two
+is the shared Redis cache. Saving or deleting any of the three models drops
+both tiers (see core.signals), so the change shows up immediately in the
+process that made it and within ``LOCAL_TIMEOUT`` everywhere else.
+"""
+import threading
+import time
+
+from django.core.cache import cache
+
+from .models import Favicon, StoreSettings, WebsiteLogo
+
+SITE_CONTEXT_CACHE_KEY = 'site_context'
+SITE_CONTEXT_TIMEOUT = 60 * 60
+LOCAL_TIMEOUT = 30
+
+_local = {'value': None, 'expires_at': 0}
+_local_lock = threading.Lock()
+
+
+def _load_site_context():
+    return {
+        'logo': WebsiteLogo.objects.filter(is_active=True).first(),
+        'favicon_obj': Favicon.objects.first(),
+        'store_settings': StoreSettings.get_solo(),
+    }
+
+
+def get_site_context():
+    value = _local['value']
+    if value is not None and _local['expires_at'] > time.monotonic():
+        return value
+
+    value = cache.get(SITE_CONTEXT_CACHE_KEY)
+    if value is None:
+        value = _load_site_context()
+        cache.set(SITE_CONTEXT_CACHE_KEY, value, SITE_CONTEXT_TIMEOUT)
+
+    with _local_lock:
+        _local['value'] = value
+        _local['expires_at'] = time.monotonic() + LOCAL_TIMEOUT
+    return value
+
+
+def invalidate_site_context():
+    with _local_lock:
+        _local['value'] = None
+        _local['expires_at'] = 0
+    cache.delete(SITE_CONTEXT_CACHE_KEY)
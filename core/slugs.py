@@ -0,0 +1,64 @@
+"""
+Unique slug allocation.
+
+``allocate_slug(Product, title)`` loads every slug sharing the title's base
+(``brake-pad``, ``brake-pad-1``, ...) in one prefix query and picks the first
+free suffix, instead of probing ``exists()`` once per collision. Two requests
+can still pick the same slug concurrently; the unique constraint rejects the
+second insert and ``save_with_unique_slug`` allocates again.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils.text import slugify
+
+SLUG_RETRIES = 5
+# Room kept for a "-<n>" suffix when a base slug is cut to the field's max_length
+SUFFIX_LENGTH = 6
+
+
+def slug_base(title, max_length, fallback='item'):
+    base = slugify(title)[:max_length].strip('-') or fallback
+    return base, base[:max_length - SUFFIX_LENGTH].strip('-')
+
+
+def next_free_slug(title, taken, max_length=50):
+    """The first of ``base``, ``base-1``, ``base-2``... not in ``taken``."""
+    base, stem = slug_base(title, max_length)
+    slug = base
+    counter = 1
+    while slug in taken:
+        slug = f"{stem}-{counter}"
+        counter += 1
+    return slug
+
+
+def taken_slugs(model, title, exclude_pk=None):
+    """Existing slugs that could collide with ``title``'s, in one query."""
+    base, stem = slug_base(title, model._meta.get_field('slug').max_length)
+    rows = model._default_manager.filter(Q(slug=base) | Q(slug__startswith=f"{stem}-"))
+    if exclude_pk is not None:
+        rows = rows.exclude(pk=exclude_pk)
+    return set(rows.values_list('slug', flat=True))
+
+
+def allocate_slug(model, title, exclude_pk=None):
+    max_length = model._meta.get_field('slug').max_length
+    return next_free_slug(title, taken_slugs(model, title, exclude_pk), max_length)
+
+
+def save_with_unique_slug(instance, save, title):
+    """
+    Allocate ``instance.slug`` from ``title`` and call ``save()``, retrying
+    with a fresh slug if a concurrent save took it first.
+    """
+    model = type(instance)
+    for attempt in range(SLUG_RETRIES):
+        instance.slug = allocate_slug(model, title, exclude_pk=instance.pk)
+        try:
+            # Savepoint, so a collision doesn't break the caller's transaction
+            with transaction.atomic():
+                return save()
+        except IntegrityError:
+            collided = model._default_manager.filter(slug=instance.slug).exclude(pk=instance.pk).exists()
+            if not collided or attempt == SLUG_RETRIES - 1:
+                raise
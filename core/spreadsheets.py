@@ -0,0 +1,170 @@
+"""
+Streaming readers for supplier spreadsheets (.xlsx and .csv).
+
+``iter_records(source)`` yields one ``SheetRecord`` per data row without
+loading the file: workbooks are opened in openpyxl's read-only mode and CSV
+files are read in pandas chunks. Memory use stays flat however many rows the
+sheet has.
+
+Read-only openpyxl does not load embedded pictures, so for workbooks only the
+drawing parts are parsed, recording which archive member is anchored to which
+row. A record's ``image()`` reads those bytes on demand, so at most one
+picture is held in memory at a time.
+
+Remote sources (Google Sheet exports) are streamed to a temporary file first.
+"""
+import math
+import os
+import posixpath
+import tempfile
+from contextlib import contextmanager
+
+import pandas as pd
+import requests
+from django.core.files.base import ContentFile
+from openpyxl import load_workbook
+from openpyxl.drawing.spreadsheet_drawing import SpreadsheetDrawing
+from openpyxl.packaging.relationship import get_dependents, get_rels_path
+from openpyxl.xml.functions import fromstring
+
+CSV_CHUNK_ROWS = 1000
+IMAGE_REL_TYPE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/image'
+DRAWING_REL_TYPE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/drawing'
+
+
+class SheetRecord(dict):
+    """
+    A data row as ``{header: value}``. Headers are stripped, blank cells are
+    None and text values are stripped. ``number`` is the 1-based row number in
+    the sheet (CSV: counting the header row as 1).
+    """
+
+    def __init__(self, values, number, images=None):
+        super().__init__(values)
+        self.number = number
+        self._images = images
+
+    def image(self, name=None):
+        """The picture embedded in this row as a ContentFile, or None."""
+        if self._images is None:
+            return None
+        return self._images.read(self.number, name)
+
+
+def normalize(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if isinstance(value, str):
+        value = value.strip()
+        return value or None
+    return value
+
+
+class EmbeddedImages:
+    """Maps sheet rows to the pictures anchored on them, reading bytes lazily."""
+
+    def __init__(self, archive, worksheet_path):
+        self.archive = archive
+        self.targets = {}
+        rels_path = get_rels_path(worksheet_path)
+        if rels_path not in archive.namelist():
+            return
+        for drawing_rel in get_dependents(archive, rels_path).find(DRAWING_REL_TYPE):
+            self._index_drawing(drawing_rel.target)
+
+    def _index_drawing(self, path):
+        try:
+            drawing = SpreadsheetDrawing.from_tree(fromstring(self.archive.read(path)))
+        except (KeyError, TypeError):
+            return
+        rels_path = get_rels_path(path)
+        if rels_path not in self.archive.namelist():
+            return
+        deps = get_dependents(self.archive, rels_path)
+        for blip in drawing._blip_rels:
+            dep = deps.get(blip.embed)
+            anchor = getattr(blip.anchor, '_from', None)
+            if dep is None or dep.Type != IMAGE_REL_TYPE or anchor is None:
+                continue
+            # Anchor rows are 0-based; the first picture on a row wins
+            self.targets.setdefault(anchor.row + 1, dep.target)
+
+    def read(self, row_number, name=None):
+        target = self.targets.get(row_number)
+        if target is None:
+            return None
+        if name:
+            name = f"{name}{posixpath.splitext(target)[1]}"
+        return ContentFile(self.archive.read(target), name=name or posixpath.basename(target))
+
+
+@contextmanager
+def local_copy(source):
+    """Yields a local path for ``source``, streaming URLs to a temporary file."""
+    if not str(source).startswith('http'):
+        yield source
+        return
+    fd, path = tempfile.mkstemp(suffix='.download')
+    try:
+        with requests.get(source, stream=True, timeout=60) as response, os.fdopen(fd, 'wb') as f:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=1 << 16):
+                f.write(chunk)
+        yield path
+    finally:
+        os.remove(path)
+
+
+def iter_xlsx(path, header_row=1, images=True):
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.active
+        embedded = EmbeddedImages(workbook._archive, sheet._worksheet_path) if images else None
+        headers = None
+        for number, values in enumerate(sheet.iter_rows(values_only=True), start=1):
+            if number < header_row:
+                continue
+            if headers is None:
+                headers = [str(normalize(value) or f"column_{i}") for i, value in enumerate(values)]
+                continue
+            if all(value is None for value in values):
+                continue
+            yield SheetRecord({header: normalize(value) for header, value in zip(headers, values)}, number, embedded)
+    finally:
+        workbook.close()
+
+
+def iter_csv(path, header_row=1, chunk_rows=CSV_CHUNK_ROWS):
+    number = header_row
+    for chunk in pd.read_csv(path, dtype=str, skiprows=header_row - 1, chunksize=chunk_rows):
+        headers = [str(column).strip() for column in chunk.columns]
+        for values in chunk.itertuples(index=False, name=None):
+            number += 1
+            yield SheetRecord({header: normalize(value) for header, value in zip(headers, values)}, number)
+
+
+def in_blocks(records, size):
+    """Group a record stream into lists of up to ``size`` records."""
+    block = []
+    for record in records:
+        block.append(record)
+        if len(block) >= size:
+            yield block
+            block = []
+    if block:
+        yield block
+
+
+def iter_records(source, header_row=1, images=True, xlsx=None):
+    """
+    Stream the records of a local or remote .xlsx/.csv file. The format is
+    taken from the extension unless ``xlsx`` is given.
+    """
+    if xlsx is None:
+        xlsx = str(source).lower().split('?')[0].endswith(('.xlsx', '.xlsm')) or 'format=xlsx' in str(source) \
+            or 'output=xlsx' in str(source)
+    with local_copy(source) as path:
+        if xlsx:
+            yield from iter_xlsx(path, header_row=header_row, images=images)
+        else:
+            yield from iter_csv(path, header_row=header_row)
@@ -66,6 +66,39 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
+    // Quantity edits made in quick succession are sent as one batch request
+    const BATCH_DELAY = 400;
+    let pendingOperations = [];
+    let batchTimer = null;
+
+    function queueCartOperation(action, productId, quantity = 1) {
+        pendingOperations.push({ action, product_id: productId, quantity });
+        clearTimeout(batchTimer);
+        batchTimer = setTimeout(flushCartOperations, BATCH_DELAY);
+    }
+
+    async function flushCartOperations() {
+        const operations = pendingOperations;
+        pendingOperations = [];
+        batchTimer = null;
+        if (!operations.length) return;
+        try {
+            const response = await fetch('/cart/api/', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'X-CSRFToken': getCookie('csrftoken')
+                },
+                body: JSON.stringify({ operations })
+            });
+            const data = await response.json();
+            if (data.items) renderCart(data);
+            if (!data.success) alert(data.message || 'Error updating cart');
+        } catch (error) {
+            console.error('Error updating cart:', error);
+        }
+    }
+
     // --- Rendering ---
 
     function renderCart(data) {
@@ -106,19 +139,25 @@ document.addEventListener('DOMContentLoaded', function() {
             
             // Price & Qty
             clone.querySelector('.cart-item-price').innerText = `₹${item.subtotal.toFixed(2)}`;
-            clone.querySelector('.cart-item-qty').innerText = item.quantity;
+            const qtyDisplay = clone.querySelector('.cart-item-qty');
+            qtyDisplay.innerText = item.quantity;
             
-            // Event Listeners
+            // Event Listeners: shown immediately, sent to the server in a batch
+            let quantity = item.quantity;
             clone.querySelector('.qty-minus').addEventListener('click', () => {
-                updateCart('update', item.product_id, item.quantity - 1);
+                quantity = Math.max(quantity - 1, 0);
+                qtyDisplay.innerText = quantity;
+                queueCartOperation('update', item.product_id, quantity);
             });
             
             clone.querySelector('.qty-plus').addEventListener('click', () => {
-                updateCart('update', item.product_id, item.quantity + 1);
+                quantity += 1;
+                qtyDisplay.innerText = quantity;
+                queueCartOperation('update', item.product_id, quantity);
             });
             
             clone.querySelector('.remove-item').addEventListener('click', () => {
-                updateCart('delete', item.product_id);
+                queueCartOperation('delete', item.product_id);
             });
             
             itemsContainer.appendChild(clone);
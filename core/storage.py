@@ -0,0 +1,140 @@
+"""
+Content-addressed media storage.
+
+Every uploaded file is stored once, under a name derived from the SHA-256 of
+its bytes (``content/ab/cd/abcd...ef.jpg``), whatever ``upload_to`` or file
+name it arrived with. Saving the same bytes again returns the existing name,
+so a supplier photo shared by fifty product variants is written, converted
+and served once, from a URL that never changes (safe to cache forever).
+
+Each stored file has a ``MediaBlob`` row counting the field values that
+reference it. ``delete()`` only removes the file when the last reference is
+released. The blob also remembers files derived from it (the WebP copy,
+responsive renditions), which lets the image pipeline reuse them instead of
+re-encoding identical content.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.apps import apps
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+CONTENT_PREFIX = 'content'
+
+
+def hashed_name(digest, extension):
+    return f"{CONTENT_PREFIX}/{digest[:2]}/{digest[2:4]}/{digest}{extension.lower()}"
+
+
+def is_content_addressed(storage=None):
+    return isinstance(storage or default_storage, ContentAddressedStorage)
+
+
+def _blobs():
+    return apps.get_model('core', 'MediaBlob').objects
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        sha256 = hashlib.sha256()
+        size = 0
+        for chunk in content.chunks():
+            sha256.update(chunk)
+            size += len(chunk)
+        digest = sha256.hexdigest()
+        stored_name = hashed_name(digest, os.path.splitext(name)[1])
+
+        # Reference first: delete() removes the file under the blob's row lock, so once
+        # registered the file can no longer disappear underneath this save
+        self.register(stored_name, digest, size)
+        if not self.exists(stored_name):
+            self._write(stored_name, content)
+        return stored_name
+
+    def _write(self, name, content):
+        # Write to a temp file and rename over the target: concurrent writers of the same
+        # content are harmless, and readers never see a partially written file
+        path = self.path(name)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in content.chunks():
+                    f.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(tmp_path, self.file_permissions_mode)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def register(self, name, digest=None, size=0, references=1):
+        """
+        Record ``references`` new references to the stored file ``name``. The
+        blob row is created if needed, which requires the content ``digest``.
+        """
+        if _blobs().filter(name=name).update(ref_count=F('ref_count') + references) or digest is None:
+            return
+        try:
+            with transaction.atomic():
+                _blobs().create(name=name, sha256=digest, size=size, ref_count=references)
+        except IntegrityError:
+            # Created concurrently by another request
+            _blobs().filter(name=name).update(ref_count=F('ref_count') + references)
+
+    def retain(self, name):
+        """Add a reference to an already stored file (e.g. a reused derivative)."""
+        _blobs().filter(name=name).update(ref_count=F('ref_count') + 1)
+
+    def release(self, name, references=1):
+        """Drop ``references`` references to the stored file ``name``, removing it when none are left."""
+        with transaction.atomic():
+            blob = _blobs().select_for_update().filter(name=name).first()
+            if blob is not None and blob.ref_count > references:
+                blob.ref_count -= references
+                blob.save(update_fields=['ref_count'])
+                return
+            if blob is not None:
+                # Keep the row: its derivatives are reused if the same bytes are uploaded again
+                blob.ref_count = 0
+                blob.save(update_fields=['ref_count'])
+            super().delete(name)
+
+    def delete(self, name):
+        if not name.startswith(f"{CONTENT_PREFIX}/"):
+            return super().delete(name)
+        self.release(name)
+
+
+def cached_derivative(storage, source_name, key):
+    """A derivative previously recorded for ``source_name``'s content, if its files still exist."""
+    if not is_content_addressed(storage) or not source_name.startswith(f"{CONTENT_PREFIX}/"):
+        return None
+    blob = _blobs().filter(name=source_name).only('derivatives').first()
+    value = blob.derivatives.get(key) if blob else None
+    if value is None:
+        return None
+    names = value['variants'].values() if isinstance(value, dict) else [value]
+    return value if all(storage.exists(name) for name in names) else None
+
+
+def remember_derivative(storage, source_name, key, value):
+    if not is_content_addressed(storage) or not source_name.startswith(f"{CONTENT_PREFIX}/"):
+        return
+    with transaction.atomic():
+        blob = _blobs().select_for_update().filter(name=source_name).first()
+        if blob is not None:
+            blob.derivatives[key] = value
+            blob.save(update_fields=['derivatives'])
@@ -0,0 +1,179 @@
+import logging
+import os
+
+from celery import shared_task
+from django.apps import apps
+from django.core.cache import cache
+from django.db import transaction
+from kombu.exceptions import OperationalError
+from PIL import Image, UnidentifiedImageError
+
+from .cart_store import persist_user_cart
+from .storage import cached_derivative, is_content_addressed, remember_derivative
+from .utils.image_utils import build_image_variants, convert_to_webp, variant_name
+
+logger = logging.getLogger(__name__)
+
+
+# Seconds a cart change waits before being written to Postgres; later changes ride along
+CART_PERSIST_DELAY = 5
+
+# Image fields that get responsive renditions; the manifest lives in ``<field>_variants``
+RESPONSIVE_IMAGE_FIELDS = {
+    'core.Product': ('main_image',),
+    'core.ProductImage': ('image',),
+    'core.Category': ('image',),
+    'core.Brand': ('logo',),
+    'core.HeroSlider': ('image',),
+}
+
+
+def is_webp(field_file):
+    return field_file.name.lower().endswith('.webp')
+
+
+def needs_webp_conversion(field_file):
+    """Raster images Pillow can read, other than WebP; SVG and other formats are left as uploaded."""
+    if not field_file or is_webp(field_file):
+        return False
+    return os.path.splitext(field_file.name)[1].lower() in Image.registered_extensions()
+
+
+def variants_field_name(field_name):
+    return f"{field_name}_variants"
+
+
+def _send(task, args, **options):
+    try:
+        task.apply_async(args=args, **options)
+    except OperationalError:
+        logger.warning("Celery broker unavailable; running %s inline", task.name)
+        task.apply(args=args)
+
+
+def _enqueue(task, args):
+    transaction.on_commit(lambda: _send(task, args))
+
+
+@shared_task(autoretry_for=(OSError,), retry_backoff=True, max_retries=3)
+def convert_image_to_webp(model_label, pk, field_name, source_name):
+    """
+    Convert ``<model>.<field_name>`` of row ``pk`` to WebP and point the field
+    at the new file. Idempotent: does nothing if the row is gone, or if the
+    field no longer holds ``source_name`` (already converted or replaced).
+    """
+    model = apps.get_model(model_label)
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None or getattr(instance, field_name).name != source_name:
+        return
+
+    field_file = getattr(instance, field_name)
+    storage = field_file.storage
+    # Identical content has been converted before: reuse that WebP file
+    webp_name = cached_derivative(storage, source_name, 'webp')
+    if webp_name:
+        storage.retain(webp_name)
+    else:
+        try:
+            webp_file = convert_to_webp(field_file)
+        except UnidentifiedImageError:
+            logger.warning("Skipping WebP conversion of %s (not a raster image)", source_name)
+            return
+        if not webp_file:
+            return
+        # Encode outside the transaction; only the swap itself holds the row lock
+        webp_name = storage.save(field_file.field.generate_filename(instance, webp_file.name), webp_file)
+        remember_derivative(storage, source_name, 'webp', webp_name)
+
+    with transaction.atomic():
+        instance = model.objects.select_for_update().filter(pk=pk).first()
+        if instance is None or getattr(instance, field_name).name != source_name:
+            storage.delete(webp_name)
+            return
+        setattr(instance, field_name, webp_name)
+        # A regular save so catalog/site caches are invalidated by their signals
+        instance.save(update_fields=[field_name])
+
+    if is_content_addressed(storage):
+        # Release this row's reference to the original; the file goes once nothing uses it
+        storage.delete(source_name)
+
+
+def enqueue_webp_conversion(instance, field_name):
+    """Queue conversion of a freshly saved image field once the transaction commits."""
+    field_file = getattr(instance, field_name)
+    if not needs_webp_conversion(field_file):
+        return
+    _enqueue(convert_image_to_webp, (instance._meta.label, instance.pk, field_name, field_file.name))
+
+
+@shared_task(autoretry_for=(OSError,), retry_backoff=True, max_retries=3)
+def generate_image_variants(model_label, pk, field_name, source_name):
+    """
+    Write the responsive WebP renditions of ``source_name`` and record them in
+    the ``<field>_variants`` manifest. Idempotent like convert_image_to_webp.
+    """
+    model = apps.get_model(model_label)
+    manifest_field = variants_field_name(field_name)
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None or getattr(instance, field_name).name != source_name:
+        return
+    if getattr(instance, manifest_field).get('source') == source_name:
+        return
+
+    field_file = getattr(instance, field_name)
+    storage = field_file.storage
+    cached = cached_derivative(storage, source_name, 'variants')
+    if cached:
+        source_width, variants = cached['width'], cached['variants']
+        for name in variants.values():
+            storage.retain(name)
+    else:
+        try:
+            source_width, renditions = build_image_variants(field_file)
+        except UnidentifiedImageError:
+            logger.warning("Skipping image variants of %s (not a raster image)", source_name)
+            return
+        variants = {str(width): storage.save(variant_name(source_name, width), content) for width, content in renditions}
+        remember_derivative(storage, source_name, 'variants', {'width': source_width, 'variants': variants})
+    with transaction.atomic():
+        instance = model.objects.select_for_update().filter(pk=pk).first()
+        if instance is None or getattr(instance, field_name).name != source_name:
+            for name in variants.values():
+                storage.delete(name)
+            return
+        stale = list(getattr(instance, manifest_field).get('variants', {}).values())
+        setattr(instance, manifest_field, {'source': source_name, 'width': source_width, 'variants': variants})
+        instance.save(update_fields=[manifest_field])
+
+    # Renditions of the previous image are no longer referenced by anything
+    for name in stale:
+        storage.delete(name)
+
+
+def enqueue_image_variants(instance, field_name):
+    """Queue renditions for a WebP image whose manifest is missing or out of date."""
+    if field_name not in RESPONSIVE_IMAGE_FIELDS.get(instance._meta.label, ()):
+        return
+    field_file = getattr(instance, field_name)
+    # Non-WebP sources are converted first; the converted save queues the variants
+    if not field_file or not is_webp(field_file):
+        return
+    if getattr(instance, variants_field_name(field_name)).get('source') == field_file.name:
+        return
+    _enqueue(generate_image_variants, (instance._meta.label, instance.pk, field_name, field_file.name))
+
+
+@shared_task(autoretry_for=(OSError,), retry_backoff=True, max_retries=3)
+def persist_cart(user_id):
+    """Write user ``user_id``'s cart from the cart store to Cart/CartItem rows."""
+    # Cleared first: a change made while this runs schedules another write
+    cache.delete(f"cart:persist:{user_id}")
+    persist_user_cart(user_id)
+
+
+def enqueue_cart_persist(user_id):
+    """Schedule ``persist_cart`` unless one is already pending for this user."""
+    # Expires on its own in case the scheduled task is lost
+    if cache.add(f"cart:persist:{user_id}", 1, CART_PERSIST_DELAY * 12):
+        _send(persist_cart, (user_id,), countdown=CART_PERSIST_DELAY)
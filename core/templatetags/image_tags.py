@@ -0,0 +1,40 @@
+from django import template
+from django.utils.html import format_html
+
+from core.tasks import variants_field_name
+from core.utils.image_utils import IMAGE_VARIANT_WIDTHS
+
+register = template.Library()
+
+
+def _manifest(field_file):
+    instance = getattr(field_file, 'instance', None)
+    manifest = getattr(instance, variants_field_name(field_file.field.name), None) or {}
+    # Ignore a manifest left over from a previous image
+    return manifest if manifest.get('source') == field_file.name else {}
+
+
+@register.simple_tag
+def image_srcset(field_file, sizes='100vw', src='card'):
+    """
+    ``src``/``srcset``/``sizes`` attributes for an <img>, e.g.
+    ``<img {% image_srcset product.main_image sizes="25vw" %} alt="...">``.
+    ``src`` names the rendition used by browsers without srcset support.
+    Falls back to the original file until its renditions have been generated.
+    """
+    if not field_file:
+        return ''
+    manifest = _manifest(field_file)
+    variants = {int(width): name for width, name in manifest.get('variants', {}).items()}
+    if not variants:
+        return format_html('src="{}"', field_file.url)
+
+    storage = field_file.storage
+    candidates = [(width, storage.url(name)) for width, name in sorted(variants.items())]
+    candidates.append((manifest['width'], field_file.url))
+    srcset = ', '.join(f"{url} {width}w" for width, url in candidates)
+
+    # Narrowest rendition at least as wide as the requested one, else the original
+    wanted = IMAGE_VARIANT_WIDTHS.get(src, IMAGE_VARIANT_WIDTHS['card'])
+    fallback = next((url for width, url in candidates if width >= wanted), field_file.url)
+    return format_html('src="{}" srcset="{}" sizes="{}"', fallback, srcset, sizes)
@@ -1,7 +1,48 @@
-from django.test import TestCase, Client
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.test import TestCase, Client, override_settings
+from django.core.management import CommandError, call_command
 from django.urls import reverse
 from django.contrib.auth import get_user_model
-from .models import OnSiteRepairBooking, Order
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import parse_http_date
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from .models import (
+    OnSiteRepairBooking, Order, Product, Brand, Category, Cart, CartItem, BulkDiscountTier,
+    WhatsAppQuery, StoreSettings, OrderItem, InsufficientStockError, DailySalesRollup, MediaBlob,
+    ProductImage, VehicleType, VehicleModel, Vehicle, Review
+)
+from .services import convert_query_to_order
+from .search import search_products
+from . import slugs
+from .pagination import KeysetPaginator, PRODUCT_ORDERINGS
+from .pricing import price_cart_items, price_quantities
+from .rollups import rebuild_daily_rollups, sales_summary
+from .tasks import convert_image_to_webp, persist_cart
+from .storage import cached_derivative, hashed_name, remember_derivative
+from .management.commands import remove_bg, upload_products
+from .templatetags.image_tags import image_srcset
+from .site_context import get_site_context, invalidate_site_context
+from .importing import CHANGED, FIELDS_CHANGED, UNCHANGED, ProductImporter, fingerprint
+from .downloads import ImageDownloader
+from .fitment import (
+    fitment_key, fitment_versions, fitting_product_ids, rebuild_fitment_index, vehicle_product_ids
+)
+from .dashboard import DASHBOARD_CACHE_KEY, DASHBOARD_REFRESH_LOCK_KEY, get_dashboard_metrics
 
 User = get_user_model()
 
@@ -92,3 +133,1187 @@ class OnSiteRepairBookingTest(TestCase):
         }
         response = self.client.post(self.url, data)
         self.assertEqual(response.status_code, 200)
+
+
+class ProductSearchTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        brand = Brand.objects.create(name='Bosch')
+        category = Category.objects.create(name='Brakes')
+        self.pad = Product.objects.create(
+            title='Front Brake Pad', part_number='EVCK-001', hsn_code='8708',
+            brand=brand, category=category, price=100, mrp=120, stock=10
+        )
+        self.cable = Product.objects.create(
+            title='Throttle Cable', part_number='EVTC-002', price=50, mrp=60, stock=10
+        )
+
+    def test_search_by_part_number(self):
+        results = list(search_products(Product.objects.all(), 'EVCK-001'))
+        self.assertEqual(results, [self.pad])
+
+    def test_search_by_brand_and_category_name(self):
+        self.assertEqual(list(search_products(Product.objects.all(), 'bosch')), [self.pad])
+        self.assertEqual(list(search_products(Product.objects.all(), 'brakes')), [self.pad])
+
+    def test_catalog_uses_search(self):
+        response = self.client.get(reverse('catalog'), {'search': 'throttle'})
+        self.assertEqual(list(response.context['products']), [self.cable])
+
+    def test_search_matches_description(self):
+        self.cable.description = 'Fits the Ather 450X twist grip'
+        self.cable.save()
+        self.assertEqual(list(search_products(Product.objects.all(), 'twist grip')), [self.cable])
+
+
+class SlugAllocationTest(TestCase):
+    def test_collisions_get_next_suffix_in_constant_queries(self):
+        for _ in range(5):
+            Product.objects.create(title='Brake Pad', price=10, mrp=12)
+        with CaptureQueriesContext(connection) as queries:
+            product = Product.objects.create(title='Brake Pad', price=10, mrp=12)
+        self.assertEqual(product.slug, 'brake-pad-5')
+        self.assertLessEqual(len([q for q in queries if 'slug' in q['sql'] and q['sql'].startswith('SELECT')]), 1)
+
+    def test_retries_when_a_concurrent_save_takes_the_slug(self):
+        Product.objects.create(title='Brake Pad', price=10, mrp=12)
+        real_taken_slugs = slugs.taken_slugs
+        # The first allocation misses the existing row, as if it was inserted concurrently
+        with mock.patch.object(slugs, 'taken_slugs', side_effect=[set(), real_taken_slugs(Product, 'Brake Pad')]):
+            product = Product.objects.create(title='Brake Pad', price=10, mrp=12)
+        self.assertEqual(product.slug, 'brake-pad-1')
+
+    def test_long_titles_fit_the_field(self):
+        title = 'Rear Disc Brake Caliper Assembly For Electric Scooters And Motorcycles'
+        first = Product.objects.create(title=title, price=10, mrp=12)
+        second = Product.objects.create(title=title, price=10, mrp=12)
+        self.assertEqual(len(first.slug), 50)
+        self.assertTrue(second.slug.endswith('-1') and len(second.slug) <= 50)
+
+    def test_populate_slugs_in_bulk(self):
+        Product.objects.create(title='Brake Pad', price=10, mrp=12)
+        Product.objects.bulk_create([Product(title='Brake Pad', price=10, mrp=12) for _ in range(3)])
+        call_command('populate_slugs', stdout=io.StringIO())
+        self.assertEqual(
+            sorted(Product.objects.values_list('slug', flat=True)),
+            ['brake-pad', 'brake-pad-1', 'brake-pad-2', 'brake-pad-3'],
+        )
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        # Duplicate prices exercise the id tiebreaker
+        for i in range(7):
+            Product.objects.create(title=f'Part {i}', price=10 + (i % 3), mrp=20, stock=5)
+
+    def walk(self, ordering, per_page=3):
+        paginator = KeysetPaginator(Product.objects.all(), ordering, per_page)
+        page = paginator.page()
+        seen = list(page)
+        while page.has_next():
+            page = paginator.page(cursor=page.next_cursor, number=page.next_page_number())
+            seen.extend(page)
+        return seen, page
+
+    def test_cursor_walk_matches_full_ordering(self):
+        for ordering in PRODUCT_ORDERINGS.values():
+            seen, _ = self.walk(ordering)
+            self.assertEqual(seen, list(Product.objects.order_by(*ordering)))
+
+    def test_previous_cursor_returns_previous_page(self):
+        paginator = KeysetPaginator(Product.objects.all(), ('price', 'id'), 3)
+        first = paginator.page()
+        second = paginator.page(cursor=first.next_cursor, number=2)
+        back = paginator.page(cursor=second.previous_cursor, number=1)
+        self.assertEqual(list(back), list(first))
+        self.assertFalse(back.has_previous())
+
+    def test_catalog_follows_cursor(self):
+        response = self.client.get(reverse('catalog'), {'sort': 'price_asc'})
+        page_obj = response.context['page_obj']
+        self.assertEqual(page_obj.paginator.count, 7)
+        response = self.client.get(reverse('catalog'), {'sort': 'price_asc', 'page': 2, 'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_catalog_next_link_crosses_price_tie(self):
+        # 20 per page: the page boundary falls inside a run of equal prices
+        for i in range(20):
+            Product.objects.create(title=f'Tie {i}', price=10, mrp=20, stock=5)
+        seen, params = [], {'sort': 'price_asc'}
+        while True:
+            response = self.client.get(reverse('catalog'), params)
+            page_obj = response.context['page_obj']
+            seen.extend(product.pk for product in page_obj.object_list)
+            if not page_obj.has_next():
+                break
+            self.assertContains(response, f"cursor={page_obj.next_cursor}")
+            params = {'sort': 'price_asc', 'page': page_obj.next_page_number(), 'cursor': page_obj.next_cursor}
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(seen, list(Product.objects.order_by('price', 'id').values_list('pk', flat=True)))
+
+
+class ProductAPITest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.brand = Brand.objects.create(name='Bosch')
+        self.scooter = VehicleType.objects.create(name='Ather 450', type='Scooter')
+
+    def add_products(self, count):
+        for i in range(count):
+            product = Product.objects.create(title=f'Part {i}', price=10, mrp=12, stock=3, brand=self.brand)
+            product.compatible_vehicle_types.add(self.scooter)
+            BulkDiscountTier.objects.create(product=product, min_quantity=10, discount_percentage=5)
+
+    def list_queries(self, params=None):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/products/', params or {})
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(queries)
+
+    def test_query_count_does_not_grow_with_page(self):
+        self.add_products(2)
+        _, few = self.list_queries()
+        self.add_products(8)
+        data, many = self.list_queries()
+        self.assertEqual(few, many)
+        self.assertEqual(len(data['results']), 10)
+        first = data['results'][0]
+        self.assertEqual(first['brand']['name'], 'Bosch')
+        self.assertEqual(first['compatible_vehicle_types'][0]['name'], 'Ather 450')
+        self.assertEqual(first['bulk_discounts'], [{'min_quantity': 10, 'discount_percentage': '5.00'}])
+
+    def test_sparse_fieldset(self):
+        self.add_products(3)
+        data, _ = self.list_queries({'fields': 'id,title,price,stock', 'page_size': 2})
+        self.assertEqual(set(data['results'][0]), {'id', 'title', 'price', 'stock'})
+        self.assertEqual(len(data['results']), 2)
+        self.assertIsNotNone(data['next'])
+        response = self.client.get('/api/products/', {'fields': 'id,secret'})
+        self.assertEqual(response.status_code, 400)
+
+
+class FitmentIndexTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        ather = Brand.objects.create(name='Ather')
+        self.scooter = VehicleType.objects.create(name='Scooter', type='Scooter')
+        self.model = VehicleModel.objects.create(name='450X', brand=ather, type=self.scooter)
+        self.user = get_user_model().objects.create_user(username='rider', password='pass12345')
+        self.vehicle = Vehicle.objects.create(user=self.user, model=self.model, year=2023)
+        self.by_model = Product.objects.create(title='450X Brake Pad', price=10, mrp=12)
+        self.by_type = Product.objects.create(title='Scooter Mirror', price=5, mrp=6)
+        self.other = Product.objects.create(title='Car Wiper', price=5, mrp=6)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.by_model.compatible_vehicle_models.add(self.model)
+            self.by_type.compatible_vehicle_types.add(self.scooter)
+
+    def test_vehicle_matches_its_model_and_type(self):
+        self.assertEqual(vehicle_product_ids(self.vehicle.pk), {self.by_model.pk, self.by_type.pk})
+        self.assertIsNone(vehicle_product_ids(0))
+
+    def test_index_follows_changes(self):
+        vehicle_product_ids(self.vehicle.pk)  # cache both sets
+        with self.captureOnCommitCallbacks(execute=True):
+            self.scooter.products.add(self.other)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.by_model.compatible_vehicle_models.clear()
+        self.assertEqual(vehicle_product_ids(self.vehicle.pk), {self.by_type.pk, self.other.pk})
+        with CaptureQueriesContext(connection) as queries:
+            vehicle_product_ids(self.vehicle.pk)
+        self.assertEqual(len(queries), 1)  # the vehicle itself; both sets came from the cache
+
+    def test_set_built_before_a_change_is_not_served(self):
+        old_version = fitment_versions('type', [self.scooter.pk])[self.scooter.pk]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.scooter.products.add(self.other)
+        # A rebuild that read the links before the change commits after it
+        cache.set(fitment_key('type', self.scooter.pk, old_version), frozenset([self.by_type.pk]))
+        self.assertEqual(fitting_product_ids('type', self.scooter.pk), {self.by_type.pk, self.other.pk})
+
+        rebuild_fitment_index()
+        self.assertEqual(vehicle_product_ids(self.vehicle.pk), {self.by_model.pk, self.by_type.pk, self.other.pk})
+
+    def test_large_sets_filter_through_compatibility_tables(self):
+        with mock.patch('core.fitment.FITMENT_MAX_IN_IDS', 1), CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/products/filter_by_vehicle/', {'vehicle_id': self.vehicle.pk})
+        self.assertEqual({product['id'] for product in response.json()['results']}, {self.by_model.pk, self.by_type.pk})
+        self.assertTrue(any('IN (SELECT' in query['sql'] for query in queries))
+
+    def test_filter_by_vehicle_is_paginated(self):
+        response = self.client.get('/api/products/filter_by_vehicle/', {'vehicle_id': self.vehicle.pk, 'page_size': 1})
+        data = response.json()
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(len(data['results']), 1)
+        self.assertIsNotNone(data['next'])
+        self.assertEqual(self.client.get('/api/products/filter_by_vehicle/', {'vehicle_id': 999}).status_code, 404)
+
+    def test_catalog_filters_by_vehicle(self):
+        response = self.client.get(reverse('catalog'), {'vehicle_id': self.vehicle.pk})
+        self.assertEqual({p.pk for p in response.context['products']}, {self.by_model.pk, self.by_type.pk})
+
+    def test_garage_lists_vehicle_model_and_type(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('garage'))
+        self.assertContains(response, 'Ather 450X')
+        self.assertContains(response, 'Type: Scooter')
+
+class CatalogCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.create(title='Brake Shoe', price=100, mrp=120, stock=10)
+
+    def test_product_save_invalidates_cached_results(self):
+        response = self.client.get(reverse('catalog'))
+        self.assertContains(response, 'Brake Shoe')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.title = 'Disc Brake Shoe'
+            self.product.save()
+
+        response = self.client.get(reverse('catalog'))
+        self.assertContains(response, 'Disc Brake Shoe')
+
+    def test_cached_fragment_gets_fresh_csrf_token(self):
+        self.client.get(reverse('catalog'))
+        response = self.client.get(reverse('catalog'))
+        self.assertNotContains(response, '__CATALOG_CSRF_TOKEN__')
+        self.assertContains(response, 'csrfmiddlewaretoken')
+
+    def test_garage_vehicles_are_not_cached(self):
+        User.objects.create_user(username='mechanic', password='password')
+        self.client.get(reverse('catalog'))
+        self.client.login(username='mechanic', password='password')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('catalog'))
+        tables = ' '.join(q['sql'] for q in queries)
+        self.assertIn('core_vehicle', tables)
+        self.assertNotIn('core_product', tables)
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.create(title='Brake Shoe', price=100, mrp=120, stock=10)
+
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_catalog_not_modified_until_product_changes(self):
+        url = reverse('catalog')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.revalidate(url, response).status_code, 304)
+        self.assertNotIn('core_product', ' '.join(q['sql'] for q in queries))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.title = 'Disc Brake Shoe'
+            self.product.save()
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_product_detail_etag_depends_on_viewer(self):
+        url = reverse('product_detail', args=[self.product.slug])
+        response = self.client.get(url)
+        self.assertEqual(self.revalidate(url, response).status_code, 304)
+
+        User.objects.create_user(username='mechanic', password='password')
+        self.client.login(username='mechanic', password='password')
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_product_detail_changes_with_reviews(self):
+        url = reverse('product_detail', args=[self.product.slug])
+        response = self.client.get(url)
+        user = User.objects.create_user(username='rider', password='password')
+        with self.captureOnCommitCallbacks(execute=True):
+            review = Review.objects.create(product=self.product, user=user, rating=4, comment='Stops well')
+        response = self.revalidate(url, response)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Stops well')
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            review.delete()
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+    def test_last_modified_follows_changes_outside_updated_at(self):
+        url = '/api/products/'
+        response = self.client.get(url)
+        for change in (
+            lambda: Product.reserve_stock({self.product.pk: 2}),
+            lambda: BulkDiscountTier.objects.create(product=self.product, min_quantity=5, discount_percentage=3),
+        ):
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+            revalidated = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+            self.assertEqual(revalidated.status_code, 200)
+            self.assertGreater(parse_http_date(revalidated['Last-Modified']), parse_http_date(response['Last-Modified']))
+            response = revalidated
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+    def test_api_is_publicly_cacheable(self):
+        url = '/api/products/'
+        response = self.client.get(url)
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('Accept', response['Vary'])
+        self.assertEqual(self.revalidate(url, response).status_code, 304)
+        self.assertEqual(self.client.get(url, {'fields': 'id'}, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            BulkDiscountTier.objects.create(product=self.product, min_quantity=5, discount_percentage=3)
+        self.assertEqual(self.revalidate(url, response).status_code, 200)
+
+
+class CartPricingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.cart = Cart.objects.create(user=self.user)
+        self.products = []
+        for i in range(5):
+            product = Product.objects.create(title=f'Cell {i}', price=100, mrp=120, stock=100, gst_percentage=18)
+            BulkDiscountTier.objects.create(product=product, min_quantity=10, discount_percentage=10)
+            BulkDiscountTier.objects.create(product=product, min_quantity=50, discount_percentage=20)
+            CartItem.objects.create(cart=self.cart, product=product, quantity=10 * (i + 1))
+            self.products.append(product)
+
+    def test_cart_priced_in_constant_queries(self):
+        with self.assertNumQueries(2):  # cart items + discount tiers
+            pricing = price_cart_items(self.cart.items.all())
+            list(pricing)
+        self.assertEqual(len(pricing), 5)
+
+    def test_bulk_discount_and_gst(self):
+        pricing = price_quantities({self.products[0].id: 10, self.products[1].id: 60, 999999: 1})
+        first, second = pricing.lines
+        self.assertEqual(first.subtotal, Decimal('900.00'))   # 10% off
+        self.assertEqual(second.subtotal, Decimal('4800.00'))  # 20% off
+        self.assertEqual(pricing.subtotal, Decimal('5700.00'))
+        self.assertEqual(pricing.gst, Decimal('1026.00'))
+        self.assertEqual(pricing.item_count, 70)
+
+    def test_cart_api_matches_model_price(self):
+        self.client.login(username='buyer', password='password')
+        data = self.client.get(reverse('cart_api')).json()
+        expected = sum(item.get_total_price() for item in self.cart.items.all())
+        self.assertEqual(Decimal(str(data['total_price'])), expected)
+
+
+class GuestCartTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.products = [
+            Product.objects.create(title=f'Fuse {i}', price=10, mrp=12, stock=100, moq=1) for i in range(3)
+        ]
+        session = self.client.session
+        session['cart'] = {str(p.id): 2 for p in self.products}
+        session['cart'].update({'999999': 1, 'junk': 3})
+        session.save()
+
+    def test_session_cart_resolved_in_bulk_and_pruned(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(reverse('cart_api')).json()
+        product_queries = [q for q in queries if 'FROM "core_product"' in q['sql']]
+        self.assertEqual(len(product_queries), 1)
+        self.assertEqual(len(data['items']), 3)
+        self.assertEqual(data['cart_count'], 6)
+        # The session dict was moved to the cart store, without the junk entries
+        self.assertNotIn('cart', self.client.session)
+        self.assertEqual(self.client.get(reverse('cart_api')).json()['cart_count'], 6)
+
+    def test_order_create_renders_guest_cart(self):
+        response = self.client.get(reverse('order_create'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['cart_items']), 3)
+
+
+class CartBatchTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.products = [
+            Product.objects.create(title=f'Relay {i}', price=10, mrp=12, stock=20, moq=2) for i in range(3)
+        ]
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.products[0], quantity=4)
+        CartItem.objects.create(cart=cart, product=self.products[1], quantity=2)
+        self.client.login(username='buyer', password='password')
+
+    def batch(self, *operations):
+        operations = [{'action': a, 'product_id': p.id, 'quantity': q} for a, p, q in operations]
+        return self.client.post(reverse('cart_api'), {'operations': operations}, content_type='application/json')
+
+    def test_operations_applied_in_one_pass(self):
+        first, second, third = self.products
+        with CaptureQueriesContext(connection) as queries, mock.patch('core.services.enqueue_cart_persist') as persist:
+            data = self.batch(('update', first, 6), ('delete', second, 0), ('add', third, 1), ('add', third, 3)).json()
+        self.assertTrue(data['success'])
+        self.assertEqual({i['product_id']: i['quantity'] for i in data['items']}, {first.id: 6, third.id: 5})
+        self.assertEqual(data['cart_count'], 11)
+        self.assertEqual(len([q for q in queries if 'FROM "core_product"' in q['sql']]), 1)
+        persist.assert_called_once_with(self.user.pk)
+
+        persist_cart(self.user.pk)
+        self.assertEqual(dict(CartItem.objects.values_list('product_id', 'quantity')), {first.id: 6, third.id: 5})
+
+    def test_nothing_written_when_any_operation_fails(self):
+        first, second, third = self.products
+        data = self.batch(('update', first, 8), ('update', second, 1), ('add', third, 50)).json()
+        self.assertFalse(data['success'])
+        self.assertEqual([e['index'] for e in data['errors']], [1, 2])
+        self.assertEqual(data['cart_count'], 6)
+        self.assertEqual(dict(CartItem.objects.values_list('product_id', 'quantity')), {first.id: 4, second.id: 2})
+
+    def test_guest_batch_and_malformed_payload(self):
+        self.client.logout()
+        data = self.batch(('add', self.products[0], 1), ('update', self.products[0], 3)).json()
+        self.assertEqual([(i['product_id'], i['quantity']) for i in data['items']], [(self.products[0].id, 3)])
+        self.assertEqual(data['total_price'], 30.0)
+        response = self.client.post(
+            reverse('cart_api'), {'operations': [{'action': 'explode', 'product_id': 1}]}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class CartStoreTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='password')
+        self.products = [Product.objects.create(title=f'Horn {i}', price=50, mrp=60, stock=10, moq=1) for i in range(2)]
+
+    def add(self, product, quantity=1):
+        return self.client.post(
+            reverse('cart_api'), {'action': 'add', 'product_id': product.id, 'quantity': quantity},
+            content_type='application/json',
+        ).json()
+
+    def test_add_to_cart_does_not_write_cart_rows(self):
+        self.client.login(username='buyer', password='password')
+        with CaptureQueriesContext(connection) as queries, mock.patch('core.services.enqueue_cart_persist') as persist:
+            self.add(self.products[0], 2)
+            data = self.add(self.products[0], 3)
+        self.assertEqual(data['cart_count'], 5)
+        # Only the first use reads the (empty) rows; nothing is written to them
+        writes = [q['sql'] for q in queries if not q['sql'].startswith('SELECT') and 'core_cart' in q['sql']]
+        self.assertEqual(writes, [])
+        self.assertEqual(len([q for q in queries if 'FROM "core_cartitem"' in q['sql']]), 1)
+        self.assertEqual(persist.call_count, 2)
+        self.assertFalse(CartItem.objects.exists())
+
+        persist_cart(self.user.pk)
+        self.assertEqual(list(CartItem.objects.values_list('product_id', 'quantity')), [(self.products[0].id, 5)])
+
+    def test_expired_cart_reloaded_from_rows(self):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.products[1], quantity=4)
+        self.client.login(username='buyer', password='password')
+        self.assertEqual(self.client.get(reverse('cart_api')).json()['cart_count'], 4)
+
+    def test_guest_cart_merged_on_login(self):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.products[0], quantity=1)
+        self.add(self.products[0], 2)
+        self.add(self.products[1], 1)
+
+        self.client.login(username='buyer', password='password')
+        self.assertNotIn('cart_token', self.client.session)
+        self.assertEqual(
+            dict(CartItem.objects.values_list('product_id', 'quantity')),
+            {self.products[0].id: 3, self.products[1].id: 1},
+        )
+
+    def test_api_cart_shows_lines_before_they_are_persisted(self):
+        self.client.login(username='buyer', password='password')
+        with mock.patch('core.services.enqueue_cart_persist'):
+            self.client.post('/api/carts/add_item/', {'product_id': self.products[0].id, 'quantity': 3})
+        self.assertFalse(CartItem.objects.exists())
+        carts = self.client.get('/api/carts/').json()
+        self.assertEqual(len(carts), 1)
+        self.assertEqual(
+            [(item['product']['id'], item['quantity']) for item in carts[0]['items']], [(self.products[0].id, 3)]
+        )
+
+    def test_api_checkout_reads_and_clears_store(self):
+        self.client.login(username='buyer', password='password')
+        with mock.patch('core.services.enqueue_cart_persist'):
+            response = self.client.post('/api/carts/add_item/', {'product_id': self.products[0].id, 'quantity': 2})
+            self.assertEqual(response.json()['quantity'], 2)
+            self.add(self.products[1], 1)
+        # Not written to the rows yet: the order still has both lines
+        response = self.client.post('/api/orders/', {})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Order.objects.get().items.count(), 2)
+
+        # The write scheduled before checkout must not bring the cart back
+        persist_cart(self.user.pk)
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(self.client.get(reverse('cart_api')).json()['cart_count'], 0)
+
+    def test_cleanup_deletes_abandoned_rows(self):
+        stale = Cart.objects.create(user=self.user)
+        Cart.objects.filter(pk=stale.pk).update(updated_at=timezone.now() - timedelta(days=90))
+        fresh = Cart.objects.create(user=User.objects.create_user(username='other', password='password'))
+        call_command('cleanup_carts', stdout=io.StringIO())
+        self.assertEqual(list(Cart.objects.values_list('pk', flat=True)), [fresh.pk])
+
+
+class CheckoutPipelineTest(TestCase):
+    checkout_data = {
+        'full_name': 'Ravi Kumar', 'phone': '9876543210', 'pincode': '700001', 'city': 'Kolkata',
+        'district': 'Kolkata', 'state': 'West Bengal', 'local_address': '12 Park Street',
+    }
+
+    def setUp(self):
+        StoreSettings.get_solo()
+
+    def fill_guest_cart(self, lines):
+        session = self.client.session
+        session['cart'] = {}
+        for i in range(lines):
+            product = Product.objects.create(title=f'Bolt {i}', price=20, mrp=25, stock=100, moq=1)
+            session['cart'][str(product.id)] = 3
+        session.save()
+
+    def checkout_queries(self, lines):
+        self.fill_guest_cart(lines)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('order_create'), self.checkout_data)
+        self.assertEqual(response.status_code, 302)
+        return len(queries)
+
+    def test_checkout_query_count_is_constant(self):
+        small = self.checkout_queries(2)
+        large = self.checkout_queries(12)
+        self.assertEqual(small, large)
+
+    def test_inquiry_totals_and_conversion(self):
+        self.fill_guest_cart(3)
+        self.client.post(reverse('order_create'), self.checkout_data)
+        query = WhatsAppQuery.objects.get()
+        self.assertEqual(query.items.count(), 3)
+        self.assertEqual(query.total_amount, Decimal('180.00'))
+        self.assertTrue(all(item.subtotal == Decimal('60.00') for item in query.items.all()))
+
+        order = convert_query_to_order(query.id)
+        self.assertEqual(order.items.count(), 3)
+        self.assertEqual(order.subtotal, Decimal('180.00'))
+        self.assertEqual(order.gst, Decimal('32.40'))
+        self.assertEqual(order.total_amount, Decimal('262.40'))  # + 50 delivery
+        query.refresh_from_db()
+        self.assertEqual(query.status, 'ACCEPT_AS_ORDER')
+
+
+class StockReservationTest(TestCase):
+    def setUp(self):
+        self.order = Order.objects.create(status='Pending')
+        self.brake = Product.objects.create(title='Brake Lever', price=50, mrp=60, stock=5)
+        self.light = Product.objects.create(title='Tail Light', price=80, mrp=90, stock=1)
+        self.horn = Product.objects.create(title='Horn', price=30, mrp=35, stock=10)
+
+    def add(self, product, quantity):
+        OrderItem.objects.create(order=self.order, product=product, quantity=quantity, price=product.price)
+
+    def test_process_order_decrements_only_stock(self):
+        self.add(self.brake, 2)
+        self.add(self.horn, 4)
+        updated_at = self.brake.updated_at
+        self.order.process_order()
+        self.brake.refresh_from_db()
+        self.horn.refresh_from_db()
+        self.assertEqual((self.brake.stock, self.horn.stock), (3, 6))
+        self.assertEqual(self.brake.updated_at, updated_at)
+        self.assertEqual(self.order.subtotal, Decimal('220.00'))
+
+    def test_all_short_lines_reported_and_nothing_reserved(self):
+        self.add(self.brake, 6)
+        self.add(self.light, 2)
+        self.add(self.horn, 1)
+        with self.assertRaises(InsufficientStockError) as ctx:
+            self.order.process_order()
+        failures = {line['product_id']: line for line in ctx.exception.failures}
+        self.assertEqual(set(failures), {self.brake.id, self.light.id})
+        self.assertEqual(failures[self.light.id]['available'], 1)
+        self.horn.refresh_from_db()
+        self.assertEqual(self.horn.stock, 10)
+
+
+class DailySalesRollupTest(TestCase):
+    def setUp(self):
+        self.today = timezone.localdate()
+
+    def rollup(self):
+        return DailySalesRollup.objects.get(date=self.today)
+
+    def test_order_changes_update_rollup(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.create(status='Pending', total_amount=Decimal('150.00'))
+        self.assertEqual(self.rollup().orders_by_status, {'Pending': 1})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order.status = 'Delivered'
+            order.save()
+        rollup = self.rollup()
+        self.assertEqual(rollup.orders_by_status, {'Delivered': 1})
+        self.assertEqual((rollup.revenue, rollup.delivered_orders), (Decimal('150.00'), 1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order.delete()
+        rollup = self.rollup()
+        self.assertEqual((rollup.revenue, rollup.delivered_orders, rollup.orders_by_status), (Decimal('0.00'), 0, {}))
+
+    def test_rebuild_matches_incremental_rollup(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.create_user(username='rider', password='password')
+            Order.objects.create(status='Delivered', total_amount=Decimal('99.50'))
+            Order.objects.create(status='Shipped', total_amount=Decimal('10.00'))
+            OnSiteRepairBooking.objects.create(
+                full_name='Rider', mobile_no='1234567890', vehicle_type='Bike',
+                brand='Ola', model_no='S1', problem_details='Brakes', address='Road 1'
+            )
+        incremental = sales_summary(self.today)
+        rebuild_daily_rollups()
+        self.assertEqual(sales_summary(self.today), incremental)
+        self.assertEqual(incremental['today_revenue'], Decimal('99.50'))
+        self.assertEqual(incremental['new_customers_week'], 1)
+        self.assertEqual(incremental['repair_type_counts'], [('Bike', 1)])
+
+
+    def test_summary_aggregates_date_ranges_in_sql(self):
+        for days_ago, revenue, by_status, by_type in (
+            (0, '10.00', {'Pending': 1}, {'Bike': 2}),
+            (3, '20.00', {'Pending': 2, 'Delivered': 1}, {}),
+            (10, '40.00', {'Shipped': 1}, {'Car': 3}),
+            (30, '80.00', {}, {'Bike': 2}),
+        ):
+            DailySalesRollup.objects.create(
+                date=self.today - timedelta(days=days_ago), revenue=Decimal(revenue), delivered_orders=1,
+                orders_by_status=by_status, repairs_by_vehicle_type=by_type, new_customers=1,
+            )
+        with self.assertNumQueries(3):
+            summary = sales_summary(self.today)
+        self.assertEqual(
+            [summary[name] for name in ('total_revenue', 'today_revenue', 'last_7_revenue', 'prev_7_revenue')],
+            [Decimal('150.00'), Decimal('10.00'), Decimal('30.00'), Decimal('40.00')],
+        )
+        self.assertEqual((summary['delivered_orders'], summary['new_customers_week']), (4, 2))
+        self.assertEqual(summary['sales_trend'][3], (self.today - timedelta(days=3), Decimal('20.00')))
+        self.assertEqual(summary['sales_trend'][6], (self.today, Decimal('10.00')))
+        self.assertEqual(dict(summary['order_status_counts']), {'Pending': 3, 'Delivered': 1, 'Shipped': 1})
+        self.assertEqual(summary['repair_type_counts'], [('Bike', 4), ('Car', 3)])
+
+
+class DashboardMetricsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        Order.objects.create(status='Pending', total_amount=Decimal('20.00'))
+        OnSiteRepairBooking.objects.create(
+            full_name='Rider', mobile_no='1234567890', vehicle_type='Scooter',
+            brand='Ather', model_no='450X', problem_details='Battery', address='Road 2', status='Accepted'
+        )
+
+    def test_metrics_counts(self):
+        metrics = get_dashboard_metrics()
+        self.assertEqual(metrics['pending_orders'], 1)
+        self.assertEqual((metrics['pending_repairs'], metrics['active_repairs']), (0, 1))
+
+    def test_cached_metrics_skip_database(self):
+        get_dashboard_metrics()
+        with self.assertNumQueries(0):
+            get_dashboard_metrics()
+
+    def test_stale_metrics_served_while_refresh_in_progress(self):
+        cache.set(DASHBOARD_CACHE_KEY, {'metrics': {'pending_orders': 7}, 'fresh_until': 0})
+        cache.add(DASHBOARD_REFRESH_LOCK_KEY, True)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_dashboard_metrics()['pending_orders'], 7)
+        cache.delete(DASHBOARD_REFRESH_LOCK_KEY)
+        self.assertEqual(get_dashboard_metrics()['pending_orders'], 1)
+
+    def test_cold_cache_waits_for_the_refreshing_request(self):
+        cache.add(DASHBOARD_REFRESH_LOCK_KEY, True)
+
+        def computed_elsewhere(seconds):
+            cache.set(DASHBOARD_CACHE_KEY, {'metrics': {'pending_orders': 9}, 'fresh_until': time.time() + 60})
+
+        with mock.patch('core.dashboard.time.sleep', side_effect=computed_elsewhere), self.assertNumQueries(0):
+            self.assertEqual(get_dashboard_metrics()['pending_orders'], 9)
+
+
+class SiteContextCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        invalidate_site_context()
+
+    def test_cached_after_first_load(self):
+        get_site_context()
+        with self.assertNumQueries(0):
+            context = get_site_context()
+        self.assertEqual(context['store_settings'].pk, 1)
+
+    def test_saving_settings_invalidates(self):
+        settings = get_site_context()['store_settings']
+        settings.whatsapp_number = '919999999999'
+        settings.save()
+        self.assertEqual(get_site_context()['store_settings'].whatsapp_number, '919999999999')
+
+
+def png_upload(name='part.png', size=(4, 4)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'red').save(buffer, format='PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class WebPConversionTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_save_converts_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            brand = Brand.objects.create(name='Ola', logo=png_upload())
+            # Nothing is encoded until the transaction commits
+            self.assertTrue(brand.logo.name.endswith('.png'))
+        brand.refresh_from_db()
+        self.assertTrue(brand.logo.name.endswith('.webp'))
+        self.assertEqual(Image.open(brand.logo.path).format, 'WEBP')
+
+    def test_vector_images_are_not_queued(self):
+        with mock.patch('core.tasks._enqueue') as enqueue, self.captureOnCommitCallbacks(execute=True):
+            brand = Brand.objects.create(name='Ultraviolette', logo=SimpleUploadedFile('logo.svg', b'<svg/>'))
+            brand.save()
+        enqueue.assert_not_called()
+
+    def test_task_is_idempotent(self):
+        brand = Brand.objects.create(name='Ather', logo=png_upload())
+        source_name = brand.logo.name
+        convert_image_to_webp('core.Brand', brand.pk, 'logo', source_name)
+        brand.refresh_from_db()
+        converted = brand.logo.name
+        convert_image_to_webp('core.Brand', brand.pk, 'logo', source_name)
+        brand.refresh_from_db()
+        self.assertEqual(brand.logo.name, converted)
+
+    def test_variants_generated_and_served_as_srcset(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(title='Hub Motor', price=10, mrp=12, main_image=png_upload(size=(900, 600)))
+        product.refresh_from_db()
+        manifest = product.main_image_variants
+        self.assertEqual(manifest['source'], product.main_image.name)
+        self.assertEqual(sorted(manifest['variants'], key=int), ['160', '400', '800'])  # never upscaled past 900px
+        self.assertEqual(Image.open(product.main_image.storage.path(manifest['variants']['400'])).size, (400, 267))
+
+        attrs = image_srcset(product.main_image, sizes='25vw')
+        card_url = product.main_image.storage.url(manifest['variants']['400'])
+        self.assertIn(f'{card_url} 400w', attrs)
+        self.assertIn(f'{product.main_image.url} 900w', attrs)
+        self.assertTrue(attrs.startswith(f'src="{card_url}"'))
+
+    def test_identical_uploads_share_one_file_and_conversion(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = Brand.objects.create(name='Ampere', logo=png_upload('ampere.png'))
+        with self.captureOnCommitCallbacks(execute=True):
+            second = Brand.objects.create(name='Ampere Reo', logo=png_upload('reo.png'))
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.logo.name, second.logo.name)
+        blob = MediaBlob.objects.get(name=first.logo.name)
+        self.assertEqual(blob.ref_count, 2)
+        # Both originals were released after conversion, so the PNG is gone but remembered
+        source = MediaBlob.objects.get(derivatives__webp=first.logo.name)
+        self.assertEqual(source.ref_count, 0)
+        self.assertFalse(first.logo.storage.exists(source.name))
+
+        storage = first.logo.storage
+        storage.delete(first.logo.name)
+        self.assertTrue(storage.exists(second.logo.name))
+        storage.delete(second.logo.name)
+        self.assertFalse(storage.exists(second.logo.name))
+
+    def test_bulk_command_resumes_from_checkpoint(self):
+        first = Brand.objects.create(name='Hero', logo=png_upload('hero.png'))
+        second = Brand.objects.create(name='Okinawa', logo=png_upload('okinawa.png'))
+        checkpoint = os.path.join(self.media_root, 'checkpoint.json')
+        with open(checkpoint, 'w') as f:
+            json.dump({'core.Brand.logo': first.pk}, f)
+
+        with override_settings(BASE_DIR=self.media_root):
+            call_command('convert_to_webp', workers=1, checkpoint=checkpoint, stdout=io.StringIO())
+
+        original_name = second.logo.name
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertTrue(first.logo.name.endswith('.png'))
+        self.assertTrue(second.logo.name.endswith('.webp'))
+        self.assertEqual(MediaBlob.objects.get(name=second.logo.name).ref_count, 1)
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, 'backup_originals', original_name)))
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def test_checkpoint_stops_before_failed_rows(self):
+        first = Brand.objects.create(name='Hero', logo=png_upload('hero.png'))
+        broken = Brand.objects.create(name='Okinawa')
+        last = Brand.objects.create(name='Ather', logo=png_upload('ather.png'))
+        with open(os.path.join(self.media_root, 'broken.png'), 'wb') as f:
+            f.write(b'not an image')
+        Brand.objects.filter(pk=broken.pk).update(logo='broken.png')
+        checkpoint = os.path.join(self.media_root, 'checkpoint.json')
+
+        with override_settings(BASE_DIR=self.media_root):
+            call_command('convert_to_webp', workers=1, restart=True, checkpoint=checkpoint, stdout=io.StringIO())
+
+        last.refresh_from_db()
+        self.assertTrue(last.logo.name.endswith('.webp'))
+        # The next run starts again at the failed row
+        with open(checkpoint) as f:
+            self.assertEqual(json.load(f), {'core.Brand.logo': first.pk})
+
+    @override_settings(STORAGES={
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    })
+    def test_bulk_command_keeps_originals_other_rows_show(self):
+        os.makedirs(os.path.join(self.media_root, 'brands'))
+        Image.new('RGB', (4, 4), 'red').save(os.path.join(self.media_root, 'brands', 'shared.png'))
+        skipped = Brand.objects.create(name='Hero')
+        converted = Brand.objects.create(name='Okinawa')
+        Brand.objects.update(logo='brands/shared.png')
+        checkpoint = os.path.join(self.media_root, 'checkpoint.json')
+        with open(checkpoint, 'w') as f:
+            json.dump({'core.Brand.logo': skipped.pk}, f)
+
+        with override_settings(BASE_DIR=self.media_root):
+            call_command('convert_to_webp', workers=1, checkpoint=checkpoint, stdout=io.StringIO())
+
+        skipped.refresh_from_db()
+        converted.refresh_from_db()
+        self.assertEqual(converted.logo.name, 'brands/shared.webp')
+        self.assertEqual(skipped.logo.name, 'brands/shared.png')
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, 'brands', 'shared.png')))
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, 'backup_originals', 'brands', 'shared.png')))
+
+    def test_bulk_command_keeps_references_held_elsewhere(self):
+        brand = Brand.objects.create(name='Bajaj', logo=png_upload('bajaj.png'))
+        original_name = brand.logo.name
+        brand.logo.storage.retain(original_name)  # e.g. a row the command doesn't touch
+
+        with override_settings(BASE_DIR=self.media_root):
+            call_command('convert_to_webp', workers=1, restart=True, stdout=io.StringIO())
+
+        brand.refresh_from_db()
+        self.assertTrue(brand.logo.name.endswith('.webp'))
+        self.assertEqual(MediaBlob.objects.get(name=original_name).ref_count, 1)
+        self.assertTrue(brand.logo.storage.exists(original_name))
+
+
+class RemoveBackgroundTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.products = [
+            Product.objects.create(title=f'Mirror {i}', price=10, mrp=12, main_image=png_upload('mirror.png'))
+            for i in range(2)
+        ]
+        self.original = self.products[0].main_image.name
+
+    def processed_file(self):
+        """What a worker writes for content-addressed storage: the result under its own hash name."""
+        buffer = io.BytesIO()
+        Image.new('RGB', (4, 4), 'white').save(buffer, format='PNG')
+        data = buffer.getvalue()
+        new_name = hashed_name(hashlib.sha256(data).hexdigest(), '.png')
+        os.makedirs(os.path.dirname(os.path.join(self.media_root, new_name)), exist_ok=True)
+        with open(os.path.join(self.media_root, new_name), 'wb') as f:
+            f.write(data)
+        return new_name
+
+    def test_processed_content_gets_new_name_and_fresh_blob(self):
+        storage = self.products[0].main_image.storage
+        remember_derivative(storage, self.original, 'webp', 'content/stale.webp')
+        Product.objects.update(main_image_variants={'source': self.original, 'variants': {'160': 'old.webp'}})
+        new_name = self.processed_file()
+        backup_root = os.path.join(self.media_root, 'backup')
+
+        remove_bg.Command(stdout=io.StringIO()).invalidate_renditions(
+            [('core', 'Product', ['main_image'])], {self.original: new_name}, backup_root,
+        )
+
+        self.assertEqual(set(Product.objects.values_list('main_image', flat=True)), {new_name})
+        self.assertEqual(list(Product.objects.values_list('main_image_variants', flat=True)), [{}, {}])
+        self.assertEqual(MediaBlob.objects.get(name=new_name).ref_count, 2)
+        self.assertEqual(MediaBlob.objects.get(name=self.original).ref_count, 0)
+        self.assertFalse(storage.exists(self.original))
+        self.assertTrue(os.path.exists(os.path.join(backup_root, self.original)))
+        # The pre-removal WebP copy stays with the old content
+        self.assertIsNone(cached_derivative(storage, new_name, 'webp'))
+
+    def test_in_place_files_only_reset_their_rows(self):
+        other = Product.objects.create(title='Horn', price=5, mrp=6, main_image=png_upload('horn.png', (6, 6)))
+        Product.objects.update(main_image_variants={'variants': {'160': 'old.webp'}})
+
+        remove_bg.Command(stdout=io.StringIO()).invalidate_renditions(
+            [('core', 'Product', ['main_image'])], {self.original: self.original}, self.media_root,
+        )
+        self.assertEqual(
+            [product.main_image_variants for product in Product.objects.exclude(pk=other.pk)], [{}, {}]
+        )
+        other.refresh_from_db()
+        self.assertEqual(other.main_image_variants, {'variants': {'160': 'old.webp'}})
+        self.assertEqual(MediaBlob.objects.get(name=self.original).ref_count, 2)
+
+    def test_manifest_hashes_are_skipped(self):
+        self.addCleanup(remove_bg.init_worker, None, frozenset())
+        with open(os.path.join(self.media_root, self.original), 'rb') as f:
+            digest = remove_bg.file_hash(f.read())
+        job = (self.media_root, os.path.join(self.media_root, 'backup'), self.original, True, True)
+
+        remove_bg.init_worker('u2net', frozenset([digest]))
+        self.assertEqual(remove_bg.process_job(job)[:2], (self.original, 'skipped'))
+        remove_bg.init_worker('u2net', frozenset(['0' * 64]))
+        self.assertEqual(remove_bg.process_job(job)[:2], (self.original, 'processed'))  # dry run: no rembg call
+
+    def test_parse_since(self):
+        now = timezone.now()
+        self.assertAlmostEqual(remove_bg.parse_since('24h'), now - timedelta(hours=24), delta=timedelta(seconds=5))
+        self.assertAlmostEqual(remove_bg.parse_since(' 7d '), now - timedelta(days=7), delta=timedelta(seconds=5))
+        day = remove_bg.parse_since('2024-05-01')
+        self.assertTrue(timezone.is_aware(day))
+        self.assertEqual((day.year, day.month, day.day, day.hour), (2024, 5, 1, 0))
+        self.assertEqual(
+            remove_bg.parse_since('2024-05-01T10:30:00+00:00'),
+            datetime(2024, 5, 1, 10, 30, tzinfo=dt_timezone.utc),
+        )
+        with self.assertRaises(CommandError):
+            remove_bg.parse_since('yesterday')
+
+
+class ProductImporterTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def import_rows(self, count, price):
+        importer = ProductImporter(key_field='part_number', chunk_size=10, log=lambda message: None)
+        for i in range(count):
+            importer.add(f"P-{i}", {'title': 'Brake Pad', 'price': price, 'mrp': price}, brand='Generic', category='Brakes')
+        return importer.finish()
+
+    def test_creates_then_updates_in_bulk(self):
+        Product.objects.create(title='Brake Pad', price=1, mrp=1)
+        with CaptureQueriesContext(connection) as queries:
+            stats = self.import_rows(30, 100)
+        self.assertEqual((stats['created'], stats['updated'], stats['chunks']), (30, 0, 3))
+        # A handful of statements per chunk, not per row
+        self.assertLess(len(queries), 40)
+        slugs = set(Product.objects.filter(part_number__isnull=False).values_list('slug', flat=True))
+        self.assertEqual(len(slugs), 30)
+        self.assertNotIn('brake-pad', slugs)
+        self.assertEqual(Brand.objects.get(name='Generic').products.count(), 30)
+
+        stats = self.import_rows(30, 120)
+        self.assertEqual((stats['created'], stats['updated']), (0, 30))
+        self.assertEqual(Product.objects.filter(part_number__isnull=False, price=120).count(), 30)
+
+    def test_gallery_images_replace_previous_ones(self):
+        importer = ProductImporter(key_field='title', replace_images=True, log=lambda message: None)
+        importer.add('Throttle', {'price': 5, 'mrp': 5}, main_image=png_upload('a.png'), images=[png_upload('b.png', (6, 6))])
+        importer.finish()
+        importer = ProductImporter(key_field='title', replace_images=True, log=lambda message: None)
+        importer.add('Throttle', {'price': 6, 'mrp': 6}, images=[png_upload('c.png', (8, 8))])
+        importer.finish()
+        product = Product.objects.get(title='Throttle')
+        self.assertEqual(ProductImage.objects.filter(product=product).count(), 1)
+        self.assertTrue(product.main_image)
+
+    def test_main_image_alone_replaces_gallery(self):
+        importer = ProductImporter(key_field='title', replace_images=True, log=lambda message: None)
+        importer.add('Mirror', {'price': 5, 'mrp': 5}, main_image=png_upload('a.png'), images=[png_upload('b.png', (6, 6))])
+        importer.finish()
+        importer = ProductImporter(key_field='title', replace_images=True, log=lambda message: None)
+        importer.add('Mirror', {'price': 6, 'mrp': 6}, main_image=png_upload('c.png', (8, 8)))
+        importer.finish()
+        self.assertFalse(ProductImage.objects.filter(product__title='Mirror').exists())
+
+    def test_failing_row_does_not_lose_its_chunk(self):
+        Product.objects.create(title='Brake Pad', part_number='P-1', price=1, mrp=1)
+        importer = ProductImporter(key_field='part_number', chunk_size=10, log=lambda message: None)
+        for i in range(5):
+            price = 'n/a' if i == 3 else 100
+            importer.add(f"P-{i}", {'title': 'Brake Pad', 'price': price, 'mrp': 100}, main_image=png_upload(f"{i}.png", (i + 1, i + 1)))
+        stats = importer.finish()
+        self.assertEqual((stats['created'], stats['updated'], stats['failed']), (3, 1, 1))
+        self.assertEqual(importer.report['failed'], ['P-3'])
+        self.assertFalse(Product.objects.filter(part_number='P-3').exists())
+        self.assertEqual(Product.objects.get(part_number='P-1').price, 100)
+        # The failed row's image was released; the others are still referenced once
+        self.assertEqual(
+            sorted(MediaBlob.objects.values_list('ref_count', flat=True)), [0, 1, 1, 1, 1]
+        )
+
+    def test_constraint_violation_is_not_retried_as_slug_collision(self):
+        importer = ProductImporter(key_field='part_number', chunk_size=10, log=lambda message: None)
+        importer.add('P-1', {'title': 'Horn', 'price': 5, 'mrp': 5})
+        importer.add('P-2', {'title': None, 'price': 5, 'mrp': 5})
+        with CaptureQueriesContext(connection) as queries:
+            stats = importer.finish()
+        self.assertEqual((stats['created'], stats['failed']), (1, 1))
+        self.assertEqual(importer.report['failed'], ['P-2'])
+        # The taken slugs were never reloaded for a retry
+        self.assertFalse(any('"slug" IS NULL' in query['sql'] for query in queries))
+
+    def test_import_command_streams_workbook_with_embedded_images(self):
+        from openpyxl import Workbook
+        from openpyxl.drawing.image import Image as SheetImage
+
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet['A1'] = 'Supplier price list'
+        sheet.append([])
+        sheet.append(['PART NO', 'Item', 'Dealer Price\n( Iincluding GST)'])
+        sheet.append(['BP-1', 'Brake pad', 250])
+        sheet.append(['TH-1', 'Throttle grip', None])
+        sheet.add_image(SheetImage(png_upload()), 'D4')
+        path = os.path.join(self.media_root, 'spare.xlsx')
+        workbook.save(path)
+
+        call_command('import_products', path, stdout=io.StringIO())
+        brake_pad = Product.objects.get(part_number='BP-1')
+        self.assertEqual((brake_pad.price, brake_pad.category.name), (250, 'Brake'))
+        self.assertTrue(brake_pad.main_image)
+        self.assertFalse(Product.objects.get(part_number='TH-1').main_image)
+
+    def sync(self, rows, prune=False):
+        importer = ProductImporter(key_field='title', sync_source='sheet', log=lambda message: None)
+        changes = {}
+        for title, price, image_urls in rows:
+            fields = {'price': price, 'mrp': price}
+            fingerprints = (fingerprint(fields), fingerprint(image_urls))
+            changes[title] = importer.sync_check(title, *fingerprints)
+            if changes[title] != UNCHANGED:
+                importer.add(title, fields, fingerprints=fingerprints)
+        importer.finish(prune=prune)
+        return changes, importer.diff_report()
+
+    def test_sync_only_writes_changed_rows(self):
+        self.sync([('Controller', 100, ['http://img/c.png']), ('Charger', 50, []), ('Horn', 5, [])])
+        changes, report = self.sync([('Controller', 100, ['http://img/c2.png']), ('Charger', 55, [])], prune=True)
+        self.assertEqual(changes, {'Controller': CHANGED, 'Charger': FIELDS_CHANGED})
+        self.assertEqual(report['deleted'], ['Horn'])
+        self.assertEqual(report['counts'], {'created': 0, 'updated': 2, 'unchanged': 0, 'deleted': 1, 'failed': 0})
+        self.assertTrue(Product.objects.get(title='Horn').is_out_of_stock_manual)
+
+        with CaptureQueriesContext(connection) as queries:
+            changes, report = self.sync([('Controller', 100, ['http://img/c2.png']), ('Charger', 55, []), ('Horn', 5, [])])
+        self.assertEqual(report['unchanged'], ['Controller', 'Charger'])
+        self.assertEqual(changes['Horn'], FIELDS_CHANGED)  # back in the sheet after being pruned
+        self.assertFalse(Product.objects.get(title='Horn').is_out_of_stock_manual)
+        self.assertLess(len(queries), 20)
+
+
+class ImageServer(BaseHTTPRequestHandler):
+    """Local stand-in for a supplier's image host."""
+    body = b'image-bytes'
+    hits = []
+
+    def do_GET(self):
+        self.hits.append(self.path)
+        if self.path == '/flaky.png' and self.hits.count(self.path) == 1:
+            self.send_response(503)
+            self.end_headers()
+            return
+        if self.path == '/missing.png':
+            self.send_response(404)
+            self.end_headers()
+            return
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ImageDownloaderTest(TestCase):
+    def setUp(self):
+        ImageServer.hits = []
+        server = ThreadingHTTPServer(('127.0.0.1', 0), ImageServer)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+
+    def downloader(self):
+        return ImageDownloader(workers=4, per_host=2, backoff=0, cache_dir=self.cache_dir, log=lambda message: None)
+
+    def test_fetches_concurrently_with_retries(self):
+        urls = [f"{self.base_url}/{name}.png" for name in ('a', 'b', 'flaky', 'missing')]
+        downloader = self.downloader()
+        files = downloader.fetch_all(urls)
+        self.assertEqual(files[urls[0]].read(), b'image-bytes')
+        self.assertEqual(files[urls[0]].name, 'a.png')
+        self.assertIsNotNone(files[urls[2]])  # succeeded on the retry
+        self.assertIsNone(files[urls[3]])
+        self.assertEqual(downloader.stats, {'downloaded': 3, 'cached': 0, 'failed': 1})
+
+    def test_unchanged_images_come_from_the_cache(self):
+        url = f"{self.base_url}/a.png"
+        self.downloader().fetch_all([url])
+        downloader = self.downloader()
+        files = downloader.fetch_all([url])
+        self.assertEqual(files[url].read(), b'image-bytes')
+        self.assertEqual(downloader.stats['cached'], 1)
+        self.assertEqual(ImageServer.hits, ['/a.png', '/a.png'])
+
+    def test_unwritable_cache_falls_back_to_downloaded_bytes(self):
+        url = f"{self.base_url}/a.png"
+        blocked = os.path.join(self.cache_dir, 'blocked')
+        open(blocked, 'w').close()  # a file where the cache directory should be
+        messages = []
+        downloader = ImageDownloader(backoff=0, cache_dir=blocked, log=messages.append)
+        files = downloader.fetch_all([url])
+        self.assertEqual(files[url].read(), b'image-bytes')
+        self.assertEqual(downloader.stats, {'downloaded': 1, 'cached': 0, 'failed': 0})
+        self.assertTrue(messages[0].startswith(f"Could not cache image {url}"))
+
+    def test_sync_retries_rows_with_failed_downloads(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        importer = ProductImporter(key_field='title', sync_source='sheet', log=lambda message: None)
+        rows = []
+        for title, names in (('Horn', ['a']), ('Relay', ['b', 'missing'])):
+            image_urls = [f"{self.base_url}/{name}.png" for name in names]
+            fingerprints = (fingerprint({'price': 5}), fingerprint(image_urls))
+            importer.sync_check(title, *fingerprints)
+            rows.append((title, {'price': 5, 'mrp': 5}, 'Electrical', image_urls, fingerprints))
+        upload_products.Command().add_rows(importer, self.downloader(), rows)
+        importer.finish()
+
+        importer = ProductImporter(key_field='title', sync_source='sheet', log=lambda message: None)
+        self.assertEqual(
+            [importer.sync_check(title, *fingerprints) for title, _, _, _, fingerprints in rows], [UNCHANGED, CHANGED]
+        )
@@ -1,11 +1,11 @@
 import logging
-from rest_framework.throttling import SimpleRateThrottle
+from rest_framework.throttling import SimpleRateThrottle, UserRateThrottle
 
 logger = logging.getLogger(__name__)
 
-class BurstThrottle(SimpleRateThrottle):
+class BurstThrottle(UserRateThrottle):
     """
-    Custom burst throttle that allows 10 requests per second.
+    Custom burst throttle that allows 10 requests per second (per user, or per IP for guests).
     """
     scope = 'burst'
     rate = '10/second'
@@ -27,3 +27,40 @@ def convert_to_webp(image_field_file):
     
     # Return a Django ContentFile
     return ContentFile(output.read(), name=new_filename)
+
+
+# Responsive renditions generated for catalog images, by name -> width in px
+IMAGE_VARIANT_WIDTHS = {
+    'thumbnail': 160,
+    'card': 400,
+    'detail': 800,
+    'zoom': 1600,
+}
+
+
+def variant_name(source_name, width):
+    """Storage path for a rendition: products/x.webp -> products/variants/x-400w.webp"""
+    directory, filename = os.path.split(source_name)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, 'variants', f"{stem}-{width}w.webp")
+
+
+def build_image_variants(image_field_file, quality=80):
+    """
+    Resizes an image to each of IMAGE_VARIANT_WIDTHS narrower than the source.
+    Returns (source_width, [(width, ContentFile), ...]); the source is never upscaled.
+    """
+    img = Image.open(image_field_file)
+    img.load()
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if 'transparency' in img.info or img.mode in ('LA', 'PA') else 'RGB')
+
+    variants = []
+    for width in sorted(set(IMAGE_VARIANT_WIDTHS.values())):
+        if width >= img.width:
+            break
+        height = max(1, round(img.height * width / img.width))
+        output = io.BytesIO()
+        img.resize((width, height), Image.LANCZOS).save(output, format='WEBP', quality=quality)
+        variants.append((width, ContentFile(output.getvalue(), name=f"{width}w.webp")))
+    return img.width, variants
@@ -3,20 +3,25 @@ from django.urls import reverse
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q, Sum, Count
-from datetime import timedelta
-from django.core.paginator import Paginator
-from django.views.decorators.cache import cache_page
+from django.db.models import Q
+from django.core.paginator import InvalidPage
 from django.views.decorators.csrf import csrf_protect, csrf_exempt
 from django.contrib.admin.views.decorators import staff_member_required
 from django.http import JsonResponse
+from django.core.cache import cache
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+from django.utils.decorators import method_decorator
+from django.utils.safestring import mark_safe
 from django.utils import timezone
+from django.db import transaction
 from decimal import Decimal
 import random
 import urllib.parse
 
 from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
 from .models import (
@@ -32,7 +37,18 @@ from .serializers import (
     WishlistSerializer, ReviewSerializer, CouponSerializer
 )
 from .forms import SignupForm, LoginForm, VehicleForm, CartAddForm, OnSiteRepairBookingForm, AdminOnSiteRepairForm, AdminOrderForm
-from .services import CartService
+from .services import CART_ACTIONS, MAX_CART_OPERATIONS, CartService, save_order_with_items, save_query_with_items
+from .search import search_products
+from .pagination import KeysetPaginator, ProductCursorPagination, product_ordering
+from .dashboard import get_dashboard_metrics
+from .fitment import filter_fitting
+from .conditional import (
+    API_CACHE_CONTROL, PAGE_CACHE_CONTROL, api_etag, catalog_etag, catalog_last_modified, conditional,
+    product_etag, product_last_modified,
+)
+from .catalog_cache import (
+    CATALOG_CACHE_TIMEOUT, CATALOG_CSRF_PLACEHOLDER, catalog_cache_key, normalize_catalog_filters
+)
 
 def homepage(request):
     products = Product.objects.filter(stock__gt=0).select_related('brand', 'category').order_by('-id')[:6]
@@ -91,7 +107,7 @@ def user_logout(request):
 
 @login_required
 def garage(request):
-    vehicles = Vehicle.objects.filter(user=request.user).select_related('brand', 'model', 'type')
+    vehicles = Vehicle.objects.filter(user=request.user).select_related('model__brand', 'model__type')
     if request.method == 'POST':
         form = VehicleForm(request.POST)
         if form.is_valid():
@@ -125,8 +141,6 @@ def wishlist_view(request):
 
 
 def cart_view(request):
-    cart_items, total_price = CartService.get_cart_items_and_total(request)
-    
     if request.method == 'POST':
         product_id = request.POST.get('product_id')
         action = request.POST.get('action') # 'add', 'update', 'delete'
@@ -157,17 +171,56 @@ def cart_view(request):
         next_url = request.POST.get('next', 'cart')
         return redirect(next_url)
 
+    pricing = CartService.get_cart_pricing(request)
     return render(request, 'core/cart.html', {
-        'cart_items': cart_items,
-        'total_price': total_price,
+        'cart_items': pricing.lines,
+        'total_price': pricing.subtotal,
     })
 
 
+def _cart_api_response(success, message, pricing, **extra):
+    items = [{
+        'product_id': line.product.id,
+        'title': line.product.title,
+        'price': float(line.product.price),
+        'quantity': line.quantity,
+        'subtotal': float(line.subtotal),
+        'image_url': line.product.main_image.url if line.product.main_image else None,
+        'slug': line.product.slug
+    } for line in pricing]
+
+    return JsonResponse({
+        'success': success,
+        'message': message,
+        'items': items,
+        'total_price': float(pricing.subtotal),
+        'cart_count': pricing.item_count,
+        **extra,
+    })
+
+def _parse_cart_operations(operations):
+    """``[{"action", "product_id", "quantity"}, ...]`` -> ``[(action, product_id, quantity)]``, or None if malformed."""
+    if not isinstance(operations, list) or not 0 < len(operations) <= MAX_CART_OPERATIONS:
+        return None
+    parsed = []
+    for operation in operations:
+        if not isinstance(operation, dict) or operation.get('action') not in CART_ACTIONS:
+            return None
+        try:
+            parsed.append((operation['action'], int(operation.get('product_id')), int(operation.get('quantity', 1))))
+        except (TypeError, ValueError):
+            return None
+    return parsed
+
 @csrf_exempt
 def cart_api(request):
     """
     AJAX API for cart operations.
     Actions: 'add', 'update', 'delete', 'get'
+
+    ``{"operations": [{"action": ..., "product_id": ..., "quantity": ...}, ...]}``
+    applies several edits in one request: all of them or, if any fails
+    validation, none (``errors`` lists ``{"index", "message"}`` per failure).
     """
     if request.method == 'POST':
         import json
@@ -175,7 +228,19 @@ def cart_api(request):
             data = json.loads(request.body)
         except json.JSONDecodeError:
             return JsonResponse({'success': False, 'message': 'Invalid JSON data.'}, status=400)
-        
+
+        if 'operations' in data:
+            operations = _parse_cart_operations(data['operations'])
+            if operations is None:
+                return JsonResponse({'success': False, 'message': 'Invalid operations.'}, status=400)
+            errors, pricing = CartService.apply_operations(request, operations)
+            return _cart_api_response(
+                not errors,
+                errors[0][1] if errors else "Cart updated.",
+                pricing,
+                errors=[{'index': index, 'message': message} for index, message in errors],
+            )
+
         action = data.get('action')
         product_id = data.get('product_id')
         
@@ -196,42 +261,8 @@ def cart_api(request):
         success = True
         message = ""
 
-    # Fetch updated cart state
-    cart_items_raw, total_price = CartService.get_cart_items_and_total(request)
-    
-    # Format cart items for JSON response
-    items = []
-    cart_count = 0
-    for item in cart_items_raw:
-        if request.user.is_authenticated:
-            # item is a CartItem object
-            product = item.product
-            quantity = item.quantity
-            subtotal = float(item.get_total_price())
-        else:
-            # item is a dict
-            product = item['product']
-            quantity = item['quantity']
-            subtotal = float(item['subtotal'])
-        
-        cart_count += quantity
-        items.append({
-            'product_id': product.id,
-            'title': product.title,
-            'price': float(product.price),
-            'quantity': quantity,
-            'subtotal': subtotal,
-            'image_url': product.main_image.url if product.main_image else None,
-            'slug': product.slug
-        })
-
-    return JsonResponse({
-        'success': success,
-        'message': message,
-        'items': items,
-        'total_price': float(total_price),
-        'cart_count': cart_count
-    })
+    # Fetch updated cart state (priced once, see core.pricing)
+    return _cart_api_response(success, message, CartService.get_cart_pricing(request))
 
 
 def wishlist_view(request):
@@ -260,22 +291,18 @@ def wishlist_view(request):
     wishlist_products = Product.objects.filter(id__in=wishlist_ids).select_related('brand', 'category')
     return render(request, 'core/wishlist.html', {'wishlist': wishlist_products, 'logo': active_logo})
 
-@cache_page(60 * 15)
-def catalog(request):
+def _render_catalog_results(filters):
+    """Product grid + pagination for the given filters; shared by every visitor, so no per-user data."""
+    vehicle_id, category_id, brand_id, search_query, sort_option = (
+        filters['vehicle_id'], filters['category'], filters['brand'], filters['search'], filters['sort']
+    )
     products = Product.objects.select_related('brand', 'category').prefetch_related('compatible_vehicle_types', 'compatible_vehicle_models').all().order_by('-id')
 
-    vehicle_id = request.GET.get('vehicle_id')
-    category_id = request.GET.get('category')
-    brand_id = request.GET.get('brand')
-    search_query = request.GET.get('search')
-    sort_option = request.GET.get('sort')
-
     if vehicle_id:
-        try:
-            vehicle = Vehicle.objects.get(id=vehicle_id)
-            products = products.filter(compatible_vehicle_types=vehicle.type)
-        except Vehicle.DoesNotExist:
-            pass
+        # Fitment index lookup instead of joining through the compatibility tables
+        fitting = filter_fitting(products, vehicle_id)
+        if fitting is not None:
+            products = fitting
 
     if category_id:
         products = products.filter(category_id=category_id)
@@ -284,73 +311,67 @@ def catalog(request):
         products = products.filter(brand_id=brand_id)
 
     if search_query:
-        products = products.filter(title__icontains=search_query)
-
-    if sort_option == 'price_asc':
-        products = products.order_by('price')
-    elif sort_option == 'price_desc':
-        products = products.order_by('-price')
-    elif sort_option == 'name_asc':
-        products = products.order_by('title')
-        products = products.order_by('title')
-    elif sort_option == 'name_desc':
-        products = products.order_by('-title')
-
-    # Add pagination
-    paginator = Paginator(products, 20)  # 20 products per page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+        # Ranked full-text match over title, part number, HSN, brand, category and description
+        products = search_products(products, search_query)
 
-    brands = Brand.objects.all()
-    categories = Category.objects.all()
-    vehicle_types = VehicleType.objects.all()
-    vehicles = Vehicle.objects.filter(user=request.user) if request.user.is_authenticated else []
+    # Keyset pagination: prev/next follow a cursor (no OFFSET); numbered links jump by page
+    ordering = product_ordering(sort_option, searching=bool(search_query))
+    paginator = KeysetPaginator(products, ordering, 20)  # 20 products per page
+    try:
+        page_obj = paginator.page(cursor=filters['cursor'], number=filters['page'])
+    except InvalidPage:
+        page_obj = paginator.page()
 
-    return render(request, 'core/catalog.html', {
+    # Rendered without the request: the CSRF token is a placeholder swapped in per response
+    return render_to_string('core/includes/catalog_results.html', {
         'products': page_obj.object_list,
         'page_obj': page_obj,
-        'brands': brands,
-        'categories': categories,
-        'vehicle_types': vehicle_types,
-        'vehicles': vehicles,
         'selected_vehicle': vehicle_id,
         'selected_category': category_id,
         'selected_brand': brand_id,
         'search_query': search_query,
         'selected_sort': sort_option,
+        'csrf_token': CATALOG_CSRF_PLACEHOLDER,
+    })
+
+@conditional(catalog_etag, catalog_last_modified, **PAGE_CACHE_CONTROL)
+def catalog(request):
+    filters = normalize_catalog_filters(request.GET)
+
+    results_key = catalog_cache_key('results', *filters.values())
+    results_html = cache.get(results_key)
+    if results_html is None:
+        results_html = _render_catalog_results(filters)
+        cache.set(results_key, results_html, CATALOG_CACHE_TIMEOUT)
+
+    filter_options = cache.get_or_set(
+        catalog_cache_key('filter_options'),
+        lambda: {'brands': list(Brand.objects.all()), 'categories': list(Category.objects.all())},
+        CATALOG_CACHE_TIMEOUT,
+    )
+    # Per-user: the garage dropdown is never part of the cached fragment
+    vehicles = Vehicle.objects.filter(user=request.user).select_related('model__brand') if request.user.is_authenticated else []
+
+    return render(request, 'core/catalog.html', {
+        'catalog_results': mark_safe(results_html.replace(CATALOG_CSRF_PLACEHOLDER, get_token(request))),
+        'brands': filter_options['brands'],
+        'categories': filter_options['categories'],
+        'vehicles': vehicles,
+        'selected_vehicle': filters['vehicle_id'],
+        'selected_category': filters['category'],
+        'selected_brand': filters['brand'],
+        'search_query': request.GET.get('search', ''),
+        'selected_sort': filters['sort'],
     })
 
 def order_create(request):
-    # Get cart items
-    items = []
-    if request.user.is_authenticated:
-        try:
-            cart = Cart.objects.get(user=request.user)
-            items = list(cart.items.all())  # CartItem objects
-        except Cart.DoesNotExist:
-            items = []
-    else:
-        session_cart = request.session.get('cart', {})
-        for product_id, quantity in session_cart.items():
-            try:
-                product = Product.objects.get(id=product_id)
-                items.append({'product': product, 'quantity': quantity})
-            except Product.DoesNotExist:
-                continue
+    # Cart lines priced once (bulk discounts included), reused for display and the inquiry
+    pricing = CartService.get_cart_pricing(request)
 
-    if not items:
+    if not pricing:
         messages.error(request, "Cart is empty")
         return redirect("cart")
 
-    # Calculate total price for display
-    total_price = 0
-    if request.user.is_authenticated:
-        for item in items:
-            total_price += item.get_total_price()
-    else:
-        for item in items:
-            total_price += item['product'].price * item['quantity']
-
     # Handle form POST
     if request.method == 'POST':
         full_name = request.POST['full_name']
@@ -377,8 +398,8 @@ def order_create(request):
                 messages.error(request, 'Invalid or expired coupon')
                 return redirect('order_create')
 
-        # Create WhatsApp Query
-        query = WhatsAppQuery.objects.create(
+        # Build the inquiry and its items in memory, then write them in one transaction
+        query = WhatsAppQuery(
             customer_name=full_name,
             phone=phone,
             email=email,
@@ -390,36 +411,25 @@ def order_create(request):
             status='PENDING'
         )
 
-        # Create Query Items and collect info for WhatsApp
+        query_items = []
         product_details_text = ""
-        for item in items:
-            if request.user.is_authenticated:
-                product = item.product
-                quantity = item.quantity
-                price = product.price
-            else:
-                product = item['product']
-                quantity = item['quantity']
-                price = product.price
-
-            WhatsAppQueryItem.objects.create(
-                query=query,
-                product=product,
-                quantity=quantity,
-                price=price,
-                subtotal=price * quantity
-            )
+        for line in pricing:
+            product = line.product
+            quantity = line.quantity
+            price = line.unit_price.quantize(Decimal('0.01'))
+
+            query_items.append(WhatsAppQueryItem(product=product, quantity=quantity, price=price))
             product_details_text += f"\nProduct: {product.title}\nQuantity: {quantity}\nPrice: ₹{price}\n"
 
-        # Update query message and total
         query.query_message = product_details_text
-        query.calculate_total()
 
-        # Clear cart
-        if request.user.is_authenticated:
-            Cart.objects.filter(user=request.user).delete()
-        else:
-            request.session['cart'] = {}
+        with transaction.atomic():
+            save_query_with_items(query, query_items)
+
+            # Clear cart
+            if request.user.is_authenticated:
+                Cart.objects.filter(user=request.user).delete()
+        CartService.clear_cart(request)
 
         # Get Store Settings for WhatsApp number
         settings = StoreSettings.get_solo()
@@ -444,12 +454,13 @@ def order_create(request):
         return redirect(wa_url)
 
     return render(request, 'core/order_create.html', {
-        'cart_items': items,
-        'total_price': total_price,
+        'cart_items': pricing.lines,
+        'total_price': pricing.subtotal,
     })
 
 
 
+@conditional(product_etag, product_last_modified, **PAGE_CACHE_CONTROL)
 def product_detail(request, slug):
     product = get_object_or_404(Product, slug=slug)
     return render(request, 'core/product_detail.html', {'product': product})
@@ -539,23 +550,61 @@ class VehicleViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return Vehicle.objects.filter(user=self.request.user)
+        return Vehicle.objects.filter(user=self.request.user).select_related('model__brand', 'model__type')
 
 class ProductViewSet(viewsets.ModelViewSet):
+    """
+    Paginated product API. ``?fields=id,title,price,stock`` returns only
+    those fields, and the queryset only loads what they need.
+    """
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [permissions.AllowAny]
+    pagination_class = ProductCursorPagination
     throttle_classes = []  # Disable throttling for this public endpoint
 
+    def requested_fields(self):
+        fields = self.request.query_params.get('fields') if self.request.method == 'GET' else None
+        if not fields:
+            return None
+        fields = [name.strip() for name in fields.split(',') if name.strip()]
+        unknown = set(fields) - set(ProductSerializer.Meta.fields)
+        if unknown:
+            raise ValidationError({'fields': f"Unknown fields: {', '.join(sorted(unknown))}"})
+        return fields
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.requested_fields())
+        return super().get_serializer(*args, **kwargs)
+
+    def get_queryset(self):
+        return self.get_serializer().optimize_queryset(super().get_queryset())
+
+    # Same body for every visitor until the catalog changes: 304 on revalidation, cacheable by a CDN
+    @method_decorator(conditional(api_etag, catalog_last_modified, vary=('Accept',), **API_CACHE_CONTROL))
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @method_decorator(conditional(api_etag, catalog_last_modified, vary=('Accept',), **API_CACHE_CONTROL))
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     @action(detail=False, methods=['get'])
     def filter_by_vehicle(self, request):
+        """Paginated parts fitting ``?vehicle_id=``, optionally narrowed by ``?category=`` / ``?brand=``."""
         vehicle_id = request.query_params.get('vehicle_id')
-        if vehicle_id:
-            vehicle = Vehicle.objects.get(id=vehicle_id)
-            products = Product.objects.filter(compatible_vehicle_types=vehicle.type)
-            serializer = self.get_serializer(products, many=True)
-            return Response(serializer.data)
-        return Response({"error": "Vehicle ID required"}, status=status.HTTP_400_BAD_REQUEST)
+        if not vehicle_id or not vehicle_id.isdigit():
+            return Response({"error": "Vehicle ID required"}, status=status.HTTP_400_BAD_REQUEST)
+        products = filter_fitting(self.get_queryset(), vehicle_id)
+        if products is None:
+            return Response({"error": "Vehicle not found"}, status=status.HTTP_404_NOT_FOUND)
+
+        for param, field in (('category', 'category_id'), ('brand', 'brand_id')):
+            value = request.query_params.get(param)
+            if value and value.isdigit():
+                products = products.filter(**{field: value})
+        page = self.paginate_queryset(products)
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
 
 class CartViewSet(viewsets.ModelViewSet):
     queryset = Cart.objects.all()
@@ -565,21 +614,48 @@ class CartViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return Cart.objects.filter(user=self.request.user)
 
-    @action(detail=True, methods=['post'])
-    def add_item(self, request, pk=None):
-        cart = self.get_object()
-        product_id = request.data.get('product_id')
-        quantity = int(request.data.get('quantity', 1))
-        product = Product.objects.get(id=product_id)
-        if product.stock < quantity:
-            return Response({"error": "Insufficient stock"}, status=status.HTTP_400_BAD_REQUEST)
-        cart_item, created = CartItem.objects.get_or_create(cart=cart, product=product)
-        if not created:
-            cart_item.quantity += quantity
-        else:
-            cart_item.quantity = quantity
-        cart_item.save()
-        return Response(CartItemSerializer(cart_item).data)
+    def cart_data(self, request, cart):
+        """
+        ``cart`` with its lines from the cart store: the rows are written by
+        the debounced persist_cart and may lag the latest changes.
+        """
+        rows = {item.product_id: item for item in cart.items.all()} if cart else {}
+        items = []
+        for line in CartService.get_cart_pricing(request):
+            item = rows.get(line.product.id) or CartItem(cart=cart, product=line.product)
+            item.product, item.quantity = line.product, line.quantity
+            items.append(item)
+        return {
+            'id': cart.pk if cart else None,
+            'user': request.user.pk,
+            'items': CartItemSerializer(items, many=True).data,
+            'created_at': cart.created_at if cart else None,
+        }
+
+    def list(self, request, *args, **kwargs):
+        cart = self.get_queryset().order_by('pk').first()
+        data = self.cart_data(request, cart)
+        return Response([data] if cart or data['items'] else [])
+
+    def retrieve(self, request, *args, **kwargs):
+        return Response(self.cart_data(request, self.get_object()))
+
+    @action(detail=False, methods=['post'])
+    def add_item(self, request):
+        """
+        Add to the requester's cart through the cart store (rows may not exist
+        yet), returning the resulting line.
+        """
+        try:
+            product_id = int(request.data.get('product_id'))
+            quantity = int(request.data.get('quantity', 1))
+        except (TypeError, ValueError):
+            return Response({"error": "product_id and quantity must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+        success, message = CartService.add_to_cart(request, product_id, quantity)
+        if not success:
+            return Response({"error": message}, status=status.HTTP_400_BAD_REQUEST)
+        line = next(line for line in CartService.get_cart_pricing(request) if line.product.id == product_id)
+        return Response(CartItemSerializer(CartItem(product=line.product, quantity=line.quantity)).data)
 
 class OrderViewSet(viewsets.ModelViewSet):
     queryset = Order.objects.all()
@@ -590,8 +666,9 @@ class OrderViewSet(viewsets.ModelViewSet):
         return Order.objects.filter(user=self.request.user)
 
     def create(self, request):
-        cart = Cart.objects.get(user=request.user)
-        if not cart.items.exists():
+        # From the cart store: the rows may lag the latest changes
+        pricing = CartService.get_cart_pricing(request)
+        if not pricing:
             return Response({"error": "Cart is empty"}, status=status.HTTP_400_BAD_REQUEST)
         
         coupon_code = request.data.get('coupon_code')
@@ -602,17 +679,15 @@ class OrderViewSet(viewsets.ModelViewSet):
             except Coupon.DoesNotExist:
                 return Response({"error": "Invalid or expired coupon"}, status=status.HTTP_400_BAD_REQUEST)
         
-        order = Order.objects.create(user=request.user, status='Pending', coupon=coupon)
-        for item in cart.items.all():
-            OrderItem.objects.create(
-                order=order,
-                product=item.product,
-                quantity=item.quantity,
-                price=item.get_total_price() / item.quantity
-            )
-        order.total_amount = order.calculate_total()
-        order.save()
-        cart.items.all().delete()
+        order = Order(user=request.user, status='Pending', coupon=coupon)
+        items = [
+            OrderItem(product=line.product, quantity=line.quantity, price=line.unit_price.quantize(Decimal('0.01')))
+            for line in pricing
+        ]
+        with transaction.atomic():
+            save_order_with_items(order, items)
+            Cart.objects.filter(user=request.user).delete()
+        CartService.clear_cart(request)
         return Response(OrderSerializer(order).data, status=status.HTTP_201_CREATED)
 
 class WishlistViewSet(viewsets.ModelViewSet):
@@ -666,67 +741,6 @@ def onsite_repair_booking(request):
 @staff_member_required
 def admin_management_hub(request):
     """Advanced Premium Dashboard for staff members."""
-    today = timezone.now().date()
-    yesterday = today - timedelta(days=1)
-    seven_days_ago = today - timedelta(days=7)
-    
-    # 1. Financials (only from Delivered orders)
-    delivered_orders = Order.objects.filter(status='Delivered')
-    total_revenue = delivered_orders.aggregate(res=Sum('total_amount'))['res'] or Decimal('0.00')
-    
-    today_revenue = delivered_orders.filter(updated_at__date=today).aggregate(res=Sum('total_amount'))['res'] or Decimal('0.00')
-    
-    # Revenue Growth Calculation (last 7 days vs previous 7 days)
-    last_7_revenue = delivered_orders.filter(updated_at__date__gte=seven_days_ago).aggregate(res=Sum('total_amount'))['res'] or Decimal('0.00')
-    prev_7_start = today - timedelta(days=14)
-    prev_7_revenue = delivered_orders.filter(updated_at__date__gte=prev_7_start, updated_at__date__lt=seven_days_ago).aggregate(res=Sum('total_amount'))['res'] or Decimal('0.00')
-    
-    growth_percentage = 0
-    if prev_7_revenue > 0:
-        growth_percentage = ((last_7_revenue - prev_7_revenue) / prev_7_revenue) * 100
-
-    # 2. Operations Pulse
-    pending_repairs = OnSiteRepairBooking.objects.filter(status='Pending').count()
-    pending_orders = Order.objects.filter(status='Pending').count()
-    active_repairs = OnSiteRepairBooking.objects.exclude(status__in=['Completed', 'Cancelled', 'Rejected']).count()
-    total_customers = User.objects.filter(is_active=True).count()
-    new_customers_week = User.objects.filter(date_joined__gte=seven_days_ago).count()
-    
-    # 2.1 Order Status Breakdown
-    order_status_counts = Order.objects.values('status').annotate(count=Count('id'))
-    status_labels = [item['status'] for item in order_status_counts]
-    status_data = [item['count'] for item in order_status_counts]
-
-    # 2.2 Top Selling Products
-    top_selling_products = Product.objects.annotate(
-        total_sold=Sum('order_items__quantity', filter=Q(order_items__order__status='Delivered'))
-    ).filter(total_sold__gt=0).order_by('-total_sold')[:5]
-
-    # 2.3 Financial Metrics
-    total_orders_count = Order.objects.filter(status='Delivered').count()
-    avg_order_value = total_revenue / total_orders_count if total_orders_count > 0 else Decimal('0.00')
-    
-    # 3. Smart Alerts
-    low_stock_products = Product.objects.filter(stock__lt=5).select_related('brand', 'category').order_by('stock')[:5]
-    
-    # 4. Recent Activity (Unified)
-    recent_orders = Order.objects.all().select_related('user').order_by('-created_at')[:5]
-    recent_repairs = OnSiteRepairBooking.objects.all().order_by('-created_at')[:5]
-    
-    # 5. Chart Data: Sales Trend (Last 7 Days)
-    sales_trend_labels = []
-    sales_trend_data = []
-    for i in range(6, -1, -1):
-        day = today - timedelta(days=i)
-        rev = delivered_orders.filter(updated_at__date=day).aggregate(res=Sum('total_amount'))['res'] or Decimal('0.00')
-        sales_trend_labels.append(day.strftime('%b %d'))
-        sales_trend_data.append(float(rev))
-        
-    # 6. Chart Data: Repair breakdown
-    repair_types = OnSiteRepairBooking.objects.values('vehicle_type').annotate(count=Count('id')).order_by('-count')
-    repair_labels = [item['vehicle_type'] for item in repair_types]
-    repair_counts = [item['count'] for item in repair_types]
-
     import json
     # 0. Global Search Handling
     q = request.GET.get('q', '').strip()
@@ -742,27 +756,10 @@ def admin_management_hub(request):
         # Generic search -> Redirect to Order list by default with the query
         return redirect(f"{reverse('admin_order_list')}?q={q}")
 
-    context = {
-        'total_revenue': total_revenue,
-        'today_revenue': today_revenue,
-        'growth_percentage': round(growth_percentage, 1),
-        'pending_repairs': pending_repairs,
-        'pending_orders': pending_orders,
-        'active_repairs': active_repairs,
-        'total_customers': total_customers,
-        'new_customers_week': new_customers_week,
-        'low_stock_products': low_stock_products,
-        'recent_orders': recent_orders,
-        'recent_repairs': recent_repairs,
-        'top_selling_products': top_selling_products,
-        'avg_order_value': round(avg_order_value, 2),
-        'status_labels': json.dumps(status_labels),
-        'status_data': json.dumps(status_data),
-        'sales_trend_labels': json.dumps(sales_trend_labels),
-        'sales_trend_data': json.dumps(sales_trend_data),
-        'repair_labels': json.dumps(repair_labels),
-        'repair_counts': json.dumps(repair_counts),
-    }
+    # Financials, operations pulse, alerts, recent activity and chart data (briefly cached)
+    context = dict(get_dashboard_metrics())
+    for key in ('status_labels', 'status_data', 'sales_trend_labels', 'sales_trend_data', 'repair_labels', 'repair_counts'):
+        context[key] = json.dumps(context[key])
     
     return render(request, 'core/admin_management_hub.html', context)
 
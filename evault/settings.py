@@ -52,6 +52,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'django_ckeditor_5',
     'core',
 ]
@@ -185,6 +186,17 @@ CACHES = {
     }
 }
 
+# Celery (background jobs such as image conversion)
+CELERY_BROKER_URL = config('CELERY_BROKER_URL', default='redis://127.0.0.1:6379/0')
+CELERY_TASK_ACKS_LATE = True
+CELERY_TASK_IGNORE_RESULT = True
+# Run tasks inline when no worker is available (tests turn this on with override_settings)
+CELERY_TASK_ALWAYS_EAGER = config('CELERY_TASK_ALWAYS_EAGER', default=False, cast=bool)
+CELERY_TASK_EAGER_PROPAGATES = True
+
+# Redis holding the cart hashes (core.cart_store); defaults to the cache's Redis server
+CART_REDIS_URL = config('CART_REDIS_URL', default=None)
+
 # Session engine to use cache
 SESSION_ENGINE = "django.contrib.sessions.backends.cache"
 SESSION_CACHE_ALIAS = "default"
@@ -224,7 +236,8 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 
 STORAGES = {
     "default": {
-        "BACKEND": "django.core.files.storage.FileSystemStorage",
+        # Deduplicated, content-hash named media files (see core/storage.py)
+        "BACKEND": "core.storage.ContentAddressedStorage",
     },
     "staticfiles": {
         "BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage",
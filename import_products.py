@@ -2,7 +2,6 @@ import os
 import sys
 import argparse
 import pandas as pd
-import requests
 import re
 from io import BytesIO
 from django.core.files import File
@@ -14,7 +13,11 @@ import django
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'evault.settings')
 django.setup()
 
-from core.models import Product, Brand, Category, Manufacturer
+from core.downloads import ImageDownloader
+from core.importing import ProductImporter
+from core.spreadsheets import in_blocks, iter_records
+
+DOWNLOAD_BLOCK_ROWS = 100
 
 def clean_numeric(value):
     """Extracts numeric parts from strings like '5 SET' or '10.5%'"""
@@ -61,34 +64,20 @@ def find_local_image(image_dir, part_number):
             return file_path
     return None
 
-def download_image(url):
-    """Helper to download image from URL and return a Django File object"""
-    if not url or pd.isna(url) or str(url).lower() == 'nan':
-        return None
-    
-    url_str = str(url).strip()
-    if not url_str.startswith('http'):
-        # If it's a local file path (passed from import_data fallback)
-        if os.path.exists(url_str):
-            try:
-                with open(url_str, 'rb') as f:
-                    return File(BytesIO(f.read()), name=os.path.basename(url_str))
-            except Exception as e:
-                print(f"    [!] Failed to read local image {url_str}: {e}")
-        return None
-
+def read_local_image(path):
+    """Helper to read a local image file and return a Django File object"""
     try:
-        response = requests.get(url_str, timeout=10)
-        if response.status_code == 200:
-            file_name = url_str.split("/")[-1].split("?")[0] # Basic filename extraction
-            if not file_name:
-                file_name = "product_image.jpg"
-            return File(BytesIO(response.content), name=file_name)
+        with open(path, 'rb') as f:
+            return File(BytesIO(f.read()), name=os.path.basename(path))
     except Exception as e:
-        print(f"    [!] Failed to download image {url_str}: {e}")
+        print(f"    [!] Failed to read local image {path}: {e}")
     return None
 
-def import_data(source, image_dir=None):
+def photo_urls(rows):
+    """Direct image URLs in the PHOTOS column of the given rows"""
+    return [str(row['PHOTOS']).strip() for row in rows if str(row.get('PHOTOS') or '').startswith('http')]
+
+def import_data(source, image_dir=None, download_workers=16):
     use_excel = False
     # Convert Google Sheet URL to Export link
     # We prefer Excel (.xlsx) because it preserves embedded images
@@ -117,124 +106,87 @@ def import_data(source, image_dir=None):
             if files:
                 print(f"\n[OK] Found {len(files)} potential images in '{image_dir}'")
 
-    image_map = {} # Maps row index to image file data
-    
-    try:
-        if use_excel:
-            import openpyxl
-            from openpyxl.drawing.image import Image as OpenpyxlImage
-            
-            # Download to memory if it's a URL
-            if source.startswith('http'):
-                response = requests.get(source)
-                file_content = BytesIO(response.content)
-            else:
-                file_content = source
-                
-            wb = openpyxl.load_workbook(file_content, data_only=True)
-            ws = wb.active
-            
-            # Extract images and their anchors
-            print(f"Extracting embedded images from Excel...")
-            for image in ws._images:
-                # anchor._from.row is 0-indexed row
-                row_idx = image.anchor._from.row
-                image_map[row_idx] = image._data()
-            
-            # Convert worksheet to DataFrame
-            data = ws.values
-            cols = next(data)
-            df = pd.DataFrame(data, columns=cols)
-            # Adjust row index for image_map because we skipped the header row
-            # If the image was on row 2 (index 1), and header was row 1 (index 0), 
-            # now row 2 is index 0 in our new df.
-            image_map = {k - 1: v for k, v in image_map.items()}
-            
-        else:
-            df = pd.read_csv(source)
-            
-    except Exception as e:
-        print(f"\nERROR: Could not read source: {e}")
-        return
-    
     products_with_no_image = 0
     images_matched = 0
-    
-    for index, row in df.iterrows():
-        try:
-            # 1. Handle Brand & Category
-            brand_obj, _ = Brand.objects.get_or_create(name="Default Brand")
-            cat_obj, _ = Category.objects.get_or_create(name="General")
-
-            # 2. Map Columns to Model Fields
-            product_title = str(row.get('Item', '')).strip()
-            part_no = str(row.get('PART NO', '')).strip()
-            
-            # Skip empty rows or header rows that slipped through
-            if not product_title or product_title.lower() in ['nan', 'none', 'item']:
-                continue 
-            if part_no.lower() in ['part no', 'nan', 'none']:
-                continue
-
-            # Use update_or_create to prevent duplicates based on Part Number
-            product, created = Product.objects.update_or_create(
-                part_number=part_no,
-                defaults={
-                    'title': product_title,
-                    'hsn_code': str(row.get('HSN CODE', '')),
-                    'stock': to_int(row.get('QUANTITY')),
-                    'gst_percentage': to_decimal(row.get('GST')),
-                    'price': to_decimal(row.get('Dealer basic PRICE')),
-                    'mrp': to_decimal(row.get('MRP')),
-                    'brand': brand_obj,
-                    'category': cat_obj,
-                }
-            )
-
-            # 3. Handle Product Photo
-            image_url = row.get('PHOTOS')
-            img_file = None
-            
-            # Priority 1: Direct URL from sheet (if any)
-            if image_url and not pd.isna(image_url) and str(image_url).startswith('http'):
-                img_file = download_image(image_url)
-            
-            # Priority 2: Extracted from Excel row
-            if not img_file and index in image_map:
+    rows_read = 0
+    importer = ProductImporter(key_field='part_number')
+    downloader = ImageDownloader(workers=download_workers)
+
+    # Rows are streamed (read-only workbook / chunked CSV); embedded images are read per row on demand
+    try:
+        for block in in_blocks(iter_records(source, xlsx=use_excel), DOWNLOAD_BLOCK_ROWS):
+            # Fetch the photos of this block of rows concurrently
+            downloaded = downloader.fetch_all(photo_urls(block))
+            for row in block:
+                rows_read += 1
                 try:
-                    img_data = image_map[index]
-                    # We don't know the extension for sure from binary data easily without extra libs, 
-                    # but usually it's png or jpg in Excel.
-                    img_file = File(BytesIO(img_data), name=f"{part_no}.png")
-                    print(f"  [√] Extracted embedded image for {part_no}")
-                    images_matched += 1
+                    # 1. Map Columns to Model Fields
+                    product_title = str(row.get('Item') or '').strip()
+                    part_no = str(row.get('PART NO') or '').strip()
+
+                    # Skip empty rows or header rows that slipped through
+                    if not product_title or product_title.lower() in ['nan', 'none', 'item']:
+                        continue
+                    if not part_no or part_no.lower() in ['part no', 'nan', 'none']:
+                        continue
+
+                    fields = {
+                        'title': product_title,
+                        'hsn_code': str(row.get('HSN CODE') or ''),
+                        'stock': to_int(row.get('QUANTITY')),
+                        'gst_percentage': to_decimal(row.get('GST')),
+                        'price': to_decimal(row.get('Dealer basic PRICE')),
+                        'mrp': to_decimal(row.get('MRP')),
+                    }
+
+                    # 2. Handle Product Photo
+                    image_url = row.get('PHOTOS')
+                    img_file = None
+
+                    # Priority 1: Direct URL from sheet (if any)
+                    if image_url and str(image_url).startswith('http'):
+                        img_file = downloaded.get(str(image_url).strip())
+
+                    # Priority 2: Extracted from Excel row
+                    if not img_file:
+                        img_file = row.image(name=part_no)
+                        if img_file:
+                            print(f"  [√] Extracted embedded image for {part_no}")
+                            images_matched += 1
+
+                    # Priority 3: Fallback to local image directory
+                    if not img_file and image_dir:
+                        local_path = find_local_image(image_dir, part_no)
+                        if local_path:
+                            print(f"  [√] Found local image for {part_no}: {os.path.basename(local_path)}")
+                            img_file = read_local_image(local_path)
+                            images_matched += 1
+
+                    if not img_file:
+                        existing = importer.products.get(part_no)
+                        if not (existing and existing.main_image):
+                            products_with_no_image += 1
+                            if not use_excel and not image_dir:
+                                print(f"  [!] No photo URL for {part_no}. Hint: Use a Google Sheet URL or provided --image-dir.")
+
+                    # 3. Queue the row; products are written in bulk chunks
+                    importer.add(part_no, fields, brand="Default Brand", category="General", main_image=img_file)
+
                 except Exception as e:
-                    print(f"    [!] Failed to process extracted image for {part_no}: {e}")
-
-            # Priority 3: Fallback to local image directory
-            if not img_file and image_dir:
-                local_path = find_local_image(image_dir, part_no)
-                if local_path:
-                    print(f"  [√] Found local image for {part_no}: {os.path.basename(local_path)}")
-                    img_file = download_image(local_path)
-                    images_matched += 1
-
-            if img_file:
-                product.main_image.save(img_file.name, img_file, save=False)
-            elif not product.main_image:
-                products_with_no_image += 1
-                if not use_excel and not image_dir:
-                    print(f"  [!] No photo URL for {part_no}. Hint: Use a Google Sheet URL or provided --image-dir.")
-            
-            product.save()
-            print(f"{'[Created]' if created else '[Updated]'}: {product_title}")
-
-        except Exception as e:
-            print(f"Error at row {index}: {e}")
+                    print(f"Error at row {row.number}: {e}")
+    except Exception as e:
+        print(f"\nERROR: Could not read source: {e}")
+
+    downloader.close()
+    stats = importer.finish()
 
     print(f"\n--- IMPORT SUMMARY ---")
-    print(f"Total Rows Processed: {len(df)}")
+    print(f"Total Rows Processed: {rows_read}")
+    print(f"Products Created: {stats['created']}, Updated: {stats['updated']} ({stats['seconds']}s)")
+    if stats['failed']:
+        print(f"Products Failed to Save: {stats['failed']} ({', '.join(importer.report['failed'])})")
     print(f"Images Successfully Matched/Extracted: {images_matched}")
+    print(f"Images Downloaded: {downloader.stats['downloaded']}, Unchanged (cached): {downloader.stats['cached']}, Failed: {downloader.stats['failed']}")
     print(f"Products Still Missing Image: {products_with_no_image}")
     
     if products_with_no_image > 0:
@@ -247,6 +199,7 @@ if __name__ == "__main__":
     parser.add_argument("source", nargs="?", default="https://docs.google.com/spreadsheets/d/1rKBHhhgj4LLQCAhQ_ptjn8bM8Q2o8aU3/edit?usp=sharing", 
                         help="URL of the Google Sheet or path to a local XLSX/CSV file.")
     parser.add_argument("--image-dir", help="Optional local directory to look for product images (named by Part Number).")
+    parser.add_argument("--download-workers", type=int, default=16, help="Concurrent image downloads.")
     
     args = parser.parse_args()
-    import_data(args.source, image_dir=args.image_dir)
\ No newline at end of file
+    import_data(args.source, image_dir=args.image_dir, download_workers=args.download_workers)
\ No newline at end of file